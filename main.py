@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 import shutil
@@ -12,13 +13,17 @@ from injector import Injector
 from safe_update import merge_cache_to_new_version
 from src.bilibili.bili_comment import BiliComment
 from src.bilibili.bili_credential import BiliCredential
+from src.bilibili.bili_http import BiliHttp
 from src.bilibili.bili_session import BiliSession
+from src.bilibili.rate_governor import RateGovernor
 from src.chain.ask_ai import AskAI
 from src.chain.summarize import Summarize
 from src.core.app import BiliGPT
 from src.listener.bili_listen import Listen
+from src.listener.prefetcher import Prefetcher
 from src.models.config import Config
 from src.utils.callback import scheduler_error_callback
+from src.utils.leader_lease import LeaderLease
 from src.utils.logging import LOGGER
 from src.utils.queue_manager import QueueManager
 
@@ -26,8 +31,15 @@ from src.utils.queue_manager import QueueManager
 class BiliGPTPipeline:
     stop_event: asyncio.Event
 
-    def __init__(self):
+    def __init__(self, role: str = "all"):
+        """
+        :param role: 运行角色，all: 单进程运行全部功能；listener: 只负责监听b站消息和发送回复；
+                     worker: 只负责处理总结、问答任务，可以同时开多个。各进程通过同一个队列数据库和任务记录数据库协作
+        """
         _LOGGER.info("正在启动BiliGPTHelper")
+        self.role = role
+        self.runs_listener = role in ("all", "listener")
+        self.runs_worker = role in ("all", "worker")
         with open("VERSION", encoding="utf-8") as ver:
             version = ver.read()
         _LOGGER.info(f"当前运行版本：V{version}")
@@ -93,62 +105,107 @@ class BiliGPTPipeline:
         try:
             _injector = self.injector
 
+            # bilibili_api按事件循环区分会话，所以要在这里注册
+            _LOGGER.info("正在初始化b站共享http会话")
+            _injector.get(BiliHttp).install()
+
             # 恢复队列任务
             _LOGGER.info("正在恢复队列信息")
-            _injector.get(QueueManager).recover_queue(_injector.get(Config).storage_settings.queue_save_dir)
-
-            # 初始化at侦听器
-            _LOGGER.info("正在初始化at侦听器")
-            listen = _injector.get(Listen)
-
-            # 初始化摘要处理链
-            _LOGGER.info("正在初始化摘要处理链")
-            summarize_chain = _injector.get(Summarize)
-
-            # 初始化ask_ai处理链
-            _LOGGER.info("正在初始化ask_ai处理链")
-            ask_ai_chain = _injector.get(AskAI)
-
-            # 启动侦听器
-            _LOGGER.info("正在启动at侦听器")
-            listen.start_listen_at()
-            _LOGGER.info("正在启动视频更新检测侦听器")
-            listen.start_video_mission()
-
-            # 默认关掉私信，私信太烧内存
-            # _LOGGER.info("启动私信侦听器")
-            # await listen.listen_private()
+            _injector.get(QueueManager).recover_queue(
+                _injector.get(Config).storage_settings.queue_save_dir,
+                release_leases_now=self.role == "all",  # 多进程运行时不能抢其他进程手上的任务，等租约到期
+            )
 
-            _LOGGER.info("正在启动cookie过期检查和刷新")
+            listen = None
+            if self.runs_listener:
+                # 初始化at侦听器
+                _LOGGER.info("正在初始化at侦听器")
+                listen = _injector.get(Listen)
+
+            if self.runs_worker:
+                # 初始化摘要处理链
+                _LOGGER.info("正在初始化摘要处理链")
+                summarize_chain = _injector.get(Summarize)
+
+                # 初始化ask_ai处理链
+                _LOGGER.info("正在初始化ask_ai处理链")
+                ask_ai_chain = _injector.get(AskAI)
+
+            if self.runs_listener:
+                # 运行多个副本时只有主节点轮询b站，先抢一次租约，之后定时续约
+                _LOGGER.info("正在竞选主节点")
+                leader = _injector.get(LeaderLease)
+                if not leader.renew():
+                    _LOGGER.info("已有其他副本在轮询b站，本副本作为热备运行")
+                _injector.get(AsyncIOScheduler).add_job(
+                    leader.renew, trigger="interval", seconds=leader.ttl / 3, id="leader_lease"
+                )
+
+                # 启动侦听器
+                _LOGGER.info("正在启动at侦听器")
+                listen.start_listen_at()
+                _LOGGER.info("正在启动视频更新检测侦听器")
+                listen.start_video_mission()
+                if _injector.get(Config).prefetch_settings.enable:
+                    _LOGGER.info("正在启动预取")
+                    _injector.get(Prefetcher).start()
+
+                # 默认关掉私信，私信太烧内存
+                # _LOGGER.info("启动私信侦听器")
+                # await listen.listen_private()
+
+            # cookie刷新后旧的刷新令牌会失效，只有主节点刷新，其他进程（包括只跑处理链的）从共享库同步
+            _LOGGER.info("正在启动cookie过期检查和同步")
             _injector.get(BiliCredential).start_check()
 
             # 启动定时任务调度器
             _LOGGER.info("正在启动定时任务调度器")
             _injector.get(AsyncIOScheduler).start()
             _injector.get(AsyncIOScheduler).add_listener(scheduler_error_callback, EVENT_JOB_ERROR)
-
-            # 启动处理链
-            _LOGGER.info("正在启动处理链")
-            summarize_task = asyncio.create_task(summarize_chain.main())
-            ask_ai_task = asyncio.create_task(ask_ai_chain.main())
-
-            # 启动评论
-            _LOGGER.info("正在启动评论处理链")
-            comment = BiliComment(
-                _injector.get(QueueManager).get_queue("reply"),
-                _injector.get(BiliCredential),
+            _injector.get(AsyncIOScheduler).add_job(
+                _injector.get(BiliHttp).log_metrics, trigger="interval", minutes=30, id="bili_http_metrics"
             )
-            comment_task = asyncio.create_task(comment.start_comment())
-
-            # 启动私信
-            _LOGGER.info("正在启动私信处理链")
-            private = BiliSession(
-                _injector.get(BiliCredential),
-                _injector.get(QueueManager).get_queue("private"),
+            # 定时给正在处理的任务续租约，进程崩溃后租约到期，任务会被其他进程接手
+            _injector.get(AsyncIOScheduler).add_job(
+                _injector.get(QueueManager).heartbeat,
+                trigger="interval",
+                seconds=_injector.get(Config).queue_settings.visibility_timeout / 3,
+                id="queue_heartbeat",
             )
-            private_task = asyncio.create_task(private.start_private_reply())
 
-            _LOGGER.info("摘要处理链、评论处理链、私信处理链启动完成")
+            running_tasks = []
+            if self.runs_worker:
+                # 启动处理链
+                _LOGGER.info("正在启动处理链")
+                running_tasks.append(asyncio.create_task(summarize_chain.main()))
+                running_tasks.append(asyncio.create_task(ask_ai_chain.main()))
+
+            if self.runs_listener:
+                # 启动评论
+                _LOGGER.info("正在启动评论处理链")
+                comment = BiliComment(
+                    _injector.get(QueueManager).get_queue("reply"),
+                    _injector.get(BiliCredential),
+                    _injector.get(RateGovernor),
+                    _injector.get(Config).bilibili_settings.comment_concurrency,
+                    _injector.get(Config).bilibili_settings.comment_max_length,
+                )
+                running_tasks.append(asyncio.create_task(comment.start_comment()))
+                _injector.get(AsyncIOScheduler).add_job(
+                    comment.dispatcher.log_metrics, trigger="interval", minutes=10, id="comment_metrics"
+                )
+
+                # 启动私信
+                _LOGGER.info("正在启动私信处理链")
+                private = BiliSession(
+                    _injector.get(BiliCredential),
+                    _injector.get(QueueManager).get_queue("private"),
+                    _injector.get(RateGovernor),
+                    max_length=_injector.get(Config).bilibili_settings.private_max_length,
+                )
+                running_tasks.append(asyncio.create_task(private.start_private_reply()))
+
+            _LOGGER.info(f"以{self.role}角色启动，处理链启动完成")
 
             # 定时执行指定up是否有更新视频，如果有自动回复
             # mission = BiliMission(_injector.get(BiliCredential), _injector.get(AsyncIOScheduler))
@@ -165,16 +222,18 @@ class BiliGPTPipeline:
                     for job in sched.get_jobs():
                         sched.remove_job(job.id)
                     sched.shutdown()
-                    listen.close_private_listen()
-                    _LOGGER.info("正在保存队列任务信息")
-                    _injector.get(QueueManager).safe_close_all_queues(
-                        _injector.get(Config).storage_settings.queue_save_dir
-                    )
+                    if listen is not None:
+                        _injector.get(LeaderLease).release()
+                        if listen.sess is not None:  # 私信侦听（listen_private）没启用时没有会话可关
+                            listen.close_private_listen()
                     _LOGGER.info("正在关闭所有的处理链")
-                    summarize_task.cancel()
-                    ask_ai_task.cancel()
-                    comment_task.cancel()
-                    private_task.cancel()
+                    for task in running_tasks:
+                        task.cancel()
+                    await asyncio.gather(*running_tasks, return_exceptions=True)
+                    _LOGGER.info("正在关闭任务队列（队列任务已实时保存）")
+                    _injector.get(QueueManager).close()
+                    _injector.get(BiliHttp).log_metrics()
+                    await _injector.get(BiliHttp).close()
                     # mission_task.cancel()
                     # _LOGGER.info("正在生成本次运行的统计报告")
                     # statistics_dir = _injector.get(Config).model_dump()["storage_settings"][
@@ -192,7 +251,15 @@ class BiliGPTPipeline:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BiliGPTHelper")
+    parser.add_argument(
+        "--role",
+        choices=("all", "listener", "worker"),
+        default=os.getenv("BILIGPT_ROLE", "all"),
+        help="all: 单进程运行全部功能（默认）；listener: 只负责监听和发送回复，只能开一个；worker: 只负责处理任务，可以开多个",
+    )
+    args = parser.parse_args()
     os.environ["DEBUG_MODE"] = "false"
     _LOGGER = LOGGER.bind(name="main")
-    biligpt = BiliGPTPipeline()
+    biligpt = BiliGPTPipeline(args.role)
     asyncio.run(biligpt.start())
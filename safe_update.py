@@ -1,5 +1,6 @@
 import copy
 import json
+import os
 import shutil
 import traceback
 
@@ -11,6 +12,8 @@ _LOGGER = LOGGER.bind(name="safe-update")
 
 def merge_cache_to_new_version(cache_file_path: str) -> bool:
     """迁移老缓存文件到新版本格式"""
+    if not os.path.exists(cache_file_path):
+        return True  # 没有旧缓存，或者已经迁移到数据库了
     content = read_file(cache_file_path)
     try:
         content_dict: dict = json.loads(content)
@@ -1,14 +1,57 @@
 import abc
+import asyncio
+import contextlib
+import difflib
+import functools
+import glob
+import os
 import re
-from typing import Optional
+from collections.abc import Callable
+
+from pydub import AudioSegment
 
 from src.core.routers.llm_router import LLMRouter
 from src.models.config import Config
+from src.utils.logging import LOGGER
+from src.utils.rate_limiter import ProviderLimiter
+
+_LOGGER = LOGGER.bind(name="ASR")
+
+SEGMENT_LENGTH = 300 * 1000  # 切片长度（毫秒）
+WINDOW_LENGTH = 5 * 1000  # 切片前后的滑动窗口（毫秒）
+OVERLAP_CHARS = 200  # 拼接时在前一段结尾、后一段开头各取多少字找重叠（两个窗口共10s，中英文都够用）
+MIN_OVERLAP_MATCH = 6  # 公共片段至少多长才当成重叠，太短容易对错位置
+
+
+def merge_overlap(prev: str, text: str) -> str:
+    """
+    拼接相邻两个切片的转写结果，去掉滑动窗口里被转写了两遍的文字
+    在前一段结尾和后一段开头找最长的公共片段当对齐点：前一段保留到对齐点，后一段从对齐点接上。
+    两边断句、标点不完全一样也能对上；找不到足够长的公共片段就直接拼接
+    """
+    tail = prev[-OVERLAP_CHARS:]
+    head = text[:OVERLAP_CHARS]
+    matcher = difflib.SequenceMatcher(None, tail, head, autojunk=False)
+    match = matcher.find_longest_match(0, len(tail), 0, len(head))
+    if match.size < MIN_OVERLAP_MATCH:
+        return prev + text
+    return prev[: len(prev) - len(tail) + match.a] + text[match.b :]
+
+
+def remove_temp_files(audio_path: str, temp_dir: str):
+    """删除音频文件和从它切出来的所有切片（包括没导出完的），不存在的跳过"""
+    name = os.path.splitext(os.path.basename(audio_path))[0]
+    for file in [audio_path, *glob.glob(f"{glob.escape(temp_dir)}/{glob.escape(name)}_segment_*.mp3*")]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file)
 
 
 class ASRBase:
     """ASR基类，所有ASR子类都应该继承这个类"""
 
+    limiter: ProviderLimiter | None = None  # 限流器，由ASR路由器在加载时根据配置注入
+    parallel_segments: bool = True  # 切片能否并发转写，本地模型之类不能同时跑多个的设为False
+
     def __init__(self, config: Config, llm_router: LLMRouter):
         self.config = config
         self.llm_router = llm_router
@@ -32,16 +75,101 @@ class ASRBase:
         pass
 
     @abc.abstractmethod
-    async def transcribe(self, audio_path: str, **kwargs) -> Optional[str]:
+    async def transcribe(self, audio_path: str, **kwargs) -> str | None:
         """
         转写方法
         该方法最好只传入音频路径，返回转写结果，对于其他配置参数需要从self.config中获取
         注意，这个方法中的转写部分不能阻塞，否则你要实现下方的_wait_transcribe方法，并在这里采用 **线程池** 方式调用
         None建议当且仅当在转写失败时返回，因为当接收方收到None时会报告错误，当错误计数达到一定值时会停止使用该ASR
+
+        调用方可能会额外传入checkpoint（切片序号 -> 已转写的文本）和on_checkpoint（每转完一个切片的回调），
+        建议直接交给_transcribe_segments处理，这样进程中途挂掉重启后只需要转写剩下的切片
         """
         pass
 
-    def _sync_transcribe(self, audio_path: str, **kwargs) -> Optional[str]:
+    def _limit(self):
+        """
+        限流上下文，每次真正调用转写（比如api的每个切片）时都应该包在里面
+        没有配置限流时什么都不做
+        """
+        return self.limiter.limit() if self.limiter else contextlib.nullcontext()
+
+    def _cut_audio(self, audio_path: str) -> list[str]:
+        """将音频切割为300s的片段，前后有5s的滑动窗口，返回切割后的文件路径列表
+        切片文件名只由音频文件名和序号决定，同一个音频切出来的文件名总是一样的，已经存在的切片不会重新导出，
+        所以转写断点里的切片序号在重启后依然对得上。调用方要保证同时转写的音频文件名互不相同（比如带上任务uuid）
+        :param audio_path: 音频文件路径
+        :return: 切割后的文件路径列表
+        """
+        temp = self.config.storage_settings.temp_dir
+        name = os.path.splitext(os.path.basename(audio_path))[0]
+        audio = AudioSegment.from_file(audio_path, "mp3")
+        start_time = 0
+        export_file_list = []
+
+        while start_time < len(audio):
+            file_path = f"{temp}/{name}_segment_{len(export_file_list)}.mp3"
+            if not os.path.exists(file_path):
+                segment = audio[max(start_time - WINDOW_LENGTH, 0) : start_time + SEGMENT_LENGTH + WINDOW_LENGTH]
+                # 先导出到临时文件再改名，避免中途挂掉留下不完整的切片
+                with open(file_path + ".part", "wb") as file:
+                    segment.export(file, format="mp3")
+                os.replace(file_path + ".part", file_path)
+                _LOGGER.debug(f"第{len(export_file_list)}个切片导出完成")
+            export_file_list.append(file_path)
+            start_time += SEGMENT_LENGTH
+
+        return export_file_list
+
+    async def _transcribe_segments(
+        self,
+        audio_path: str,
+        checkpoint: dict[int, str] | None = None,
+        on_checkpoint: Callable[[dict[int, str]], None] | None = None,
+        **kwargs,
+    ) -> str | None:
+        """
+        切片转写，每个切片调用一次_sync_transcribe
+        :param audio_path: 音频文件路径
+        :param checkpoint: 转写断点，切片序号 -> 已转写的文本，里面有的切片直接跳过
+        :param on_checkpoint: 每转完一个切片就带着最新的断点调用一次，用于持久化进度
+        :param kwargs: 其他参数(传递给_sync_transcribe)
+        :return: 拼接后的转写结果（去掉了切片之间重叠的部分），有切片失败时返回None（已完成的切片仍然保留在断点里）
+        """
+        loop = asyncio.get_running_loop()
+        checkpoint = dict(checkpoint or {})
+        _LOGGER.info("正在切割音频")
+        export_file_list = self._cut_audio(audio_path)
+        todo = [num for num in range(len(export_file_list)) if num not in checkpoint]
+        _LOGGER.info(f"音频切割完成，共{len(export_file_list)}个切片，需要转写{len(todo)}个")
+
+        async def _run(num: int) -> str | None:
+            func = functools.partial(self._sync_transcribe, export_file_list[num], **kwargs)
+            async with self._limit():
+                text = await loop.run_in_executor(None, func)
+            if text is not None:
+                checkpoint[num] = text
+                if on_checkpoint is not None:
+                    on_checkpoint(dict(checkpoint))
+            return text
+
+        if self.parallel_segments:
+            result = await asyncio.gather(*[_run(num) for num in todo])
+        else:
+            result = []
+            for num in todo:
+                result.append(await _run(num))
+                if result[-1] is None:
+                    break
+        if None in result:
+            _LOGGER.error("有切片识别失败，返回None")
+            return None
+        # 清除临时文件
+        for file in export_file_list:
+            os.remove(file)
+        return functools.reduce(merge_overlap, (checkpoint[num] for num in range(len(export_file_list))), "")
+
+    def _sync_transcribe(self, audio_path: str, **kwargs) -> str | None:
         """
         阻塞转写方法，选择性实现
         """
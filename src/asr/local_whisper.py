@@ -1,8 +1,5 @@
-import asyncio
-import functools
 import time
 import traceback
-from typing import Optional
 
 from src.asr.asr_base import ASRBase
 from src.core.routers.llm_router import LLMRouter
@@ -14,6 +11,8 @@ _LOGGER = LOGGER.bind(name="LocalWhisper")
 
 
 class LocalWhisper(ASRBase):
+    parallel_segments = False  # 同一个模型不能同时转写多个切片
+
     def __init__(self, config: Config, llm_router: LLMRouter):
         super().__init__(config, llm_router)
         self.llm_router = llm_router
@@ -46,7 +45,7 @@ class LocalWhisper(ASRBase):
             return text
         return answer
 
-    def _sync_transcribe(self, audio_path, **kwargs) -> Optional[str]:
+    def _sync_transcribe(self, audio_path, **kwargs) -> str | None:
         try:
             begin_time = time.perf_counter()
             _LOGGER.info(f"开始转写 {audio_path}")
@@ -64,19 +63,15 @@ class LocalWhisper(ASRBase):
             _LOGGER.error(f"转写失败，错误信息为{e}", exc_info=True)
             return None
 
-    async def transcribe(self, audio_path, **kwargs) -> Optional[str]:  # 添加self参数以访问线程池
-        loop = asyncio.get_event_loop()
-
-        func = functools.partial(self._sync_transcribe, audio_path, **kwargs)
-
-        result = await loop.run_in_executor(None, func)
+    async def transcribe(self, audio_path, **kwargs) -> str | None:
+        result = await self._transcribe_segments(audio_path, **kwargs)
         w = self.config.ASRs.local_whisper
         try:
             if w.after_process and result is not None:
                 bt = time.perf_counter()
                 _LOGGER.info("正在进行后处理")
                 text = await self.after_process(result)
-                _LOGGER.debug(f"后处理完成，用时{time.perf_counter()-bt}s")
+                _LOGGER.debug(f"后处理完成，用时{time.perf_counter() - bt}s")
                 return text
             return result
         except Exception as e:
@@ -1,7 +1,5 @@
 import asyncio
 import random
-from asyncio import Queue
-from typing import Optional, Union
 
 import tenacity
 from bilibili_api import comment, video
@@ -9,19 +7,39 @@ from injector import inject
 
 from src.bilibili.bili_credential import BiliCredential
 from src.bilibili.bili_video import BiliVideo
+from src.bilibili.rate_governor import RateGovernor
 from src.models.task import AskAIResponse, BiliGPTTask, SummarizeAiResponse
 from src.utils.callback import chain_callback
-from src.utils.exceptions import RiskControlFindError
+from src.utils.durable_queue import DurableQueue
+from src.utils.keyed_dispatcher import KeyedDispatcher
 from src.utils.logging import LOGGER
+from src.utils.text_splitter import split_text
 
 _LOGGER = LOGGER.bind(name="bilibili-comment")
 
 
 class BiliComment:
     @inject
-    def __init__(self, comment_queue: Queue, credential: BiliCredential):
+    def __init__(
+        self,
+        comment_queue: DurableQueue,
+        credential: BiliCredential,
+        governor: RateGovernor,
+        max_concurrency: int = 3,
+        max_length: int = 1000,
+    ):
+        """
+        :param comment_queue: 评论队列
+        :param credential: B站凭证
+        :param governor: b站接口限速器
+        :param max_concurrency: 最多同时处理几个视频的回复
+        :param max_length: 单条评论的最大长度，超过的部分以楼中楼的形式接在第一条评论下面
+        """
         self.comment_queue = comment_queue
         self.credential = credential
+        self.governor = governor
+        self.max_length = max_length
+        self.dispatcher = KeyedDispatcher("comment", self._handle, max_concurrency)
 
     @staticmethod
     async def get_random_comment(
@@ -99,9 +117,7 @@ class BiliComment:
         return comment_str
 
     @staticmethod
-    def build_reply_content(
-        response: Union[SummarizeAiResponse, AskAIResponse, str], user: str, source_type: str
-    ) -> str:
+    def build_reply_content(response: SummarizeAiResponse | AskAIResponse | str, user: str, source_type: str) -> str:
         """
         构建回复内容
         :param source_type: task来源
@@ -135,48 +151,86 @@ class BiliComment:
         before_sleep=chain_callback,
     )
     async def start_comment(self):
-        """发送评论"""
-        while True:
-            risk_control_count = 0
-            data = None
-            while risk_control_count < 3:
-                try:
-                    if data is not None:
-                        _LOGGER.debug("继续处理上一次失败的评论任务")
-                    if data is None:
-                        data: Optional[BiliGPTTask] = await self.comment_queue.get()
-                        _LOGGER.debug("获取到新的评论任务，开始处理")
-                    video_obj, _type = await BiliVideo(credential=self.credential, url=data.video_url).get_video_obj()
-                    video_obj: video.Video
-                    aid = video_obj.get_aid()
-                    if str(aid).startswith("av"):
-                        aid = aid[2:]
-                    oid = int(aid)
-                    # root = data.source_extra_attr.source_id
-                    user = data.raw_task_data["user"]["nickname"]
-                    source_type = data.source_type
-                    text = BiliComment.build_reply_content(data.process_result, user, source_type)
-                    resp = await comment.send_comment(
-                        oid=oid,
-                        credential=self.credential,
-                        text=text,
-                        type_=comment.CommentResourceType.VIDEO,
-                    )
-                    if not resp["need_captcha"] and resp["success_toast"] == "发送成功":
-                        _LOGGER.debug(resp)
-                        _LOGGER.info("发送评论成功，休息30秒")
-                        await asyncio.sleep(30)
-                        break  # 评论成功，退出当前任务的重试循环
-                    _LOGGER.warning("发送评论失败，大概率被风控了，咱们歇会儿再试吧")
-                    risk_control_count += 1
-                    if risk_control_count >= 3:
-                        _LOGGER.warning("连续3次风控，跳过当前任务处理下一个")
-                        data = None
-                        break
-                    raise RiskControlFindError
-                except RiskControlFindError:
-                    _LOGGER.warning("遇到风控，等待60秒后重试当前任务")
-                    await asyncio.sleep(60)
-                except asyncio.CancelledError:
-                    _LOGGER.info("评论处理链关闭")
+        """发送评论：同一个视频下的回复按顺序发，不同视频之间并发发送（实际发送速度由限速器控制）"""
+        try:
+            while True:
+                await self.dispatcher.wait_for_room()  # 手上的任务够多了就先不领，留在队列里
+                data: BiliGPTTask = await self.comment_queue.get()
+                _LOGGER.debug(f"获取到新的评论任务{data.uuid}，交给分发器处理")
+                self.dispatcher.submit(data.video_id, data)
+        except asyncio.CancelledError:
+            _LOGGER.info("评论处理链关闭")
+            await self.dispatcher.close()
+
+    async def _handle(self, data: BiliGPTTask):
+        """发送完就从队列确认，发送时出错则放回队列稍后重试"""
+        with self.comment_queue.processing(data):
+            await self._send_one(data)
+
+    async def _send_one(self, data: BiliGPTTask):
+        """发送一个任务的回复，超长的话切成几段，后面的段落回复在第一条评论下面"""
+        video_obj, _type = await BiliVideo(credential=self.credential, url=data.video_url).get_video_obj()
+        video_obj: video.Video
+        aid = video_obj.get_aid()
+        if str(aid).startswith("av"):
+            aid = aid[2:]
+        oid = int(aid)
+        # root = data.source_extra_attr.source_id
+        user = data.raw_task_data["user"]["nickname"]
+        source_type = data.source_type
+        text = BiliComment.build_reply_content(data.process_result, user, source_type)
+        chunks = split_text(text, self.max_length, numbered=True)
+        # 出错重新投递时从上次发到的那段接着发，已经发出去的不再重复发
+        progress = data.reply_progress or {}
+        root = progress.get("root")
+        start = progress.get("sent", 0)
+        if start:
+            _LOGGER.info(f"任务{data.uuid}：前{start}/{len(chunks)}段评论已经发过了，接着发剩下的")
+        for index in range(start, len(chunks)):
+            resp = await self._send_with_retry(oid, chunks[index], root)
+            if resp is None:
+                _LOGGER.warning(f"任务{data.uuid}：第{index + 1}/{len(chunks)}段评论发送失败，放弃剩下的部分")
+                return
+            if root is None:
+                root = resp.get("rpid")
+                if not root and index + 1 < len(chunks):
+                    # 拿不到第一段的rpid就没法把后面的段落接在它下面，不能拿0凑合（会变成一条条单独的评论）
+                    _LOGGER.warning(f"任务{data.uuid}：拿不到第一段评论的rpid，剩下的{len(chunks) - 1}段不发了")
                     return
+            data.reply_progress = {"root": root, "sent": index + 1}
+            self.comment_queue.update(data)
+        _LOGGER.info(f"任务{data.uuid}：发送评论成功，共{len(chunks)}段")
+
+    async def _send_with_retry(self, oid: int, text: str, root: int = None) -> dict | None:
+        """
+        发送一条评论，遇到风控最多重试3次
+
+        :param oid: 视频aid
+        :param text: 评论内容
+        :param root: 要回复的评论rpid，为空则直接评论视频
+        :return: 发送成功返回b站的响应（里面有评论的rpid），失败返回None
+        """
+        for _ in range(3):
+            await self.governor.acquire("comment")
+            try:
+                resp = await comment.send_comment(
+                    oid=oid,
+                    credential=self.credential,
+                    text=text,
+                    type_=comment.CommentResourceType.VIDEO,
+                    root=root,
+                    parent=root,
+                )
+            except Exception as e:
+                if self.governor.report_exception("comment", e):
+                    _LOGGER.warning("发送评论失败，被风控了，等限速器冷却结束后重试")
+                    continue
+                raise
+            if not resp["need_captcha"] and resp["success_toast"] == "发送成功":
+                _LOGGER.debug(resp)
+                self.governor.success("comment")
+                return resp
+            self.governor.risk("comment", "need_captcha")
+            _LOGGER.warning("发送评论失败，大概率被风控了，等限速器冷却结束后重试")
+        _LOGGER.warning("连续3次风控，放弃发送")
+        return None
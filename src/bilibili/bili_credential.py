@@ -1,16 +1,33 @@
+import json
+import time
 from datetime import datetime
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from bilibili_api import Credential
 from injector import inject
 
+from src.utils.file_tools import open_sqlite
+from src.utils.leader_lease import LeaderLease
 from src.utils.logging import LOGGER
 
 _LOGGER = LOGGER.bind(name="bilibili-credential")
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS credential (
+    name TEXT PRIMARY KEY,
+    cookies TEXT NOT NULL,  -- json
+    updated_at REAL NOT NULL
+);
+"""
+SYNC_INTERVAL = 10  # 多久从共享库里同步一次其他进程刷新过的cookie（分钟）
+
 
 class BiliCredential(Credential):
-    """B站凭证类，主要增加定时检查cookie是否过期"""
+    """B站凭证类，主要增加定时检查cookie是否过期
+
+    多个进程运行时只有主节点负责刷新cookie（刷新后旧的刷新令牌就失效了，各自刷新会互相顶掉），
+    刷新后的cookie写进共享库，其他进程（热备、处理进程）定时从共享库同步
+    """
 
     # noinspection PyPep8Naming,SpellCheckingInspection
     @inject
@@ -22,6 +39,8 @@ class BiliCredential(Credential):
         dedeuserid: str,
         ac_time_value: str,
         sched: AsyncIOScheduler,
+        db_path: str = None,
+        leader: LeaderLease = None,
     ):
         """
         全部强制要求传入，以便于cookie刷新。
@@ -31,6 +50,8 @@ class BiliCredential(Credential):
         :param buvid3: buvid3 cookie值
         :param dedeuserid: dedeuserid cookie值
         :param ac_time_value: ac_time_value cookie值
+        :param db_path: 共享cookie的数据库，所有进程要用同一个文件，为空则不共享
+        :param leader: 主节点租约，只有主节点会刷新cookie，为空则总是自己刷新
         """
         super().__init__(
             sessdata=SESSDATA,
@@ -40,16 +61,62 @@ class BiliCredential(Credential):
             ac_time_value=ac_time_value,
         )
         self.sched = sched
+        self.leader = leader
+        self.conn = None
+        self._synced_at = 0.0  # 上次从共享库同步的cookie的更新时间
+        if db_path:
+            self.conn = open_sqlite(db_path)
+            self.conn.executescript(_SCHEMA)
+            self.sync()
+
+    def sync(self):
+        """共享库里有更新的cookie（其他进程刷新过）就换上"""
+        if self.conn is None:
+            return
+        row = self.conn.execute(
+            "SELECT cookies, updated_at FROM credential WHERE name = 'bilibili' AND updated_at > ?", (self._synced_at,)
+        ).fetchone()
+        if row is None:
+            return
+        cookies = json.loads(row[0])
+        self.sessdata = cookies["sessdata"]
+        self.bili_jct = cookies["bili_jct"]
+        self.dedeuserid = cookies["dedeuserid"]
+        self.ac_time_value = cookies["ac_time_value"]
+        self._synced_at = row[1]
+        _LOGGER.info("已从共享库同步其他进程刷新过的cookie")
+
+    def _save(self):
+        """把刷新后的cookie写进共享库"""
+        if self.conn is None:
+            return
+        now = time.time()
+        cookies = {
+            "sessdata": self.sessdata,
+            "bili_jct": self.bili_jct,
+            "dedeuserid": self.dedeuserid,
+            "ac_time_value": self.ac_time_value,
+        }
+        self.conn.execute(
+            "INSERT OR REPLACE INTO credential (name, cookies, updated_at) VALUES ('bilibili', ?, ?)",
+            (json.dumps(cookies), now),
+        )
+        self._synced_at = now
 
     async def _check_refresh(self):
         """
-        检查cookie是否过期
+        检查cookie是否过期，只有主节点会刷新
         """
+        self.sync()
+        if self.leader is not None and not self.leader.is_leader:
+            _LOGGER.debug("不是主节点，cookie由主节点负责刷新")
+            return
         _LOGGER.debug("正在检查cookie是否过期")
         if await self.check_refresh():
             _LOGGER.info("cookie过期，正在刷新")
             await self.refresh()
-            _LOGGER.info("cookie刷新成功")
+            self._save()
+            _LOGGER.info("cookie刷新成功，已写入共享库")
         else:
             _LOGGER.debug("cookie未过期")
 
@@ -70,4 +137,8 @@ class BiliCredential(Credential):
             max_instances=3,
             next_run_time=datetime.now(),
         )
-        _LOGGER.info("[定时任务]检查cookie是否过期定时任务注册成功，每60秒检查一次")
+        if self.conn is not None:
+            self.sched.add_job(self.sync, trigger="interval", minutes=SYNC_INTERVAL, id="sync_credential")
+        _LOGGER.info(
+            f"[定时任务]检查cookie是否过期定时任务注册成功，每12小时检查一次（只有主节点刷新），每{SYNC_INTERVAL}分钟同步一次"
+        )
@@ -0,0 +1,182 @@
+"""所有b站请求共用的httpx会话：连接复用、HTTP/2、全局重试预算、按接口统计耗时"""
+
+import asyncio
+import bisect
+import random
+import time
+from collections import defaultdict
+
+import httpx
+from bilibili_api import HEADERS
+from bilibili_api.utils.network import set_session
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="bilibili-http")
+
+try:
+    import h2  # noqa: F401
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # 耗时直方图的桶上界（秒），最后还有一个+inf桶
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_METHODS = ("GET", "HEAD")  # 只重试幂等请求，发评论、发私信这种POST重试了会发两遍
+
+
+class RetryBudget:
+    """
+    全局重试预算：每个请求往预算里存ratio个令牌，每次重试取走一个
+    b站整体出问题的时候，重试总量被限制在请求量的一定比例内，不会因为大家一起重试把情况搞得更糟
+    """
+
+    def __init__(self, ratio: float, min_tokens: float = 10, max_tokens: float = 100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+
+    def deposit(self):
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class LatencyHistogram:
+    """单个接口的耗时直方图"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        """按桶估算分位数，返回所在桶的上界"""
+        target = self.count * p
+        seen = 0
+        for index, num in enumerate(self.buckets):
+            seen += num
+            if seen >= target and num:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+
+class _RetryTransport(httpx.AsyncBaseTransport):
+    """在真正的transport外面包一层：统计每次请求的耗时，幂等请求失败时在预算允许的范围内退避重试"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, bili_http: "BiliHttp"):
+        self._transport = transport
+        self._bili_http = bili_http
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        bili_http = self._bili_http
+        bili_http.budget.deposit()
+        attempt = 0
+        while True:
+            begin = time.perf_counter()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                bili_http.observe(request, time.perf_counter() - begin, error=True)
+                if not self._can_retry(request, attempt):
+                    raise
+                _LOGGER.debug(f"请求{request.url.host}{request.url.path}出错：{e!r}，第{attempt + 1}次重试")
+            else:
+                bili_http.observe(request, time.perf_counter() - begin, error=response.status_code >= 400)
+                if response.status_code not in RETRY_STATUS_CODES or not self._can_retry(request, attempt):
+                    return response
+                await response.aclose()
+                _LOGGER.debug(
+                    f"请求{request.url.host}{request.url.path}返回{response.status_code}，第{attempt + 1}次重试"
+                )
+            await asyncio.sleep(bili_http.backoff_base * 2**attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def _can_retry(self, request: httpx.Request, attempt: int) -> bool:
+        return (
+            request.method in RETRY_METHODS
+            and attempt < self._bili_http.max_retries
+            and self._bili_http.budget.withdraw()
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class BiliHttp:
+    """b站请求共用的httpx会话，bilibili_api的请求和下载字幕、音频都走这里"""
+
+    def __init__(
+        self,
+        http2: bool = True,
+        max_connections: int = 20,
+        timeout: float = 15,
+        max_retries: int = 3,
+        retry_budget_ratio: float = 0.2,
+        backoff_base: float = 0.5,
+    ):
+        """
+        :param http2: 是否启用HTTP/2（需要安装h2）
+        :param max_connections: 连接池大小
+        :param timeout: 单次请求超时时间（秒）
+        :param max_retries: 单个请求最多重试几次
+        :param retry_budget_ratio: 重试总量最多占请求量的比例
+        :param backoff_base: 退避等待的基础时间（秒），每次重试翻倍
+        """
+        if http2 and not _HTTP2_AVAILABLE:
+            _LOGGER.warning("没有安装h2，无法启用HTTP/2，将使用HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.budget = RetryBudget(retry_budget_ratio)
+        self.histograms: dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=_RetryTransport(httpx.AsyncHTTPTransport(http2=http2, limits=limits), self),
+        )
+
+    def install(self):
+        """让bilibili_api也使用这个会话，必须在事件循环里调用（bilibili_api按事件循环区分会话）"""
+        set_session(self.client)
+        _LOGGER.info("已将共享的http会话注册给bilibili_api")
+
+    @staticmethod
+    def endpoint(request: httpx.Request) -> str:
+        """接口名：域名+路径，音视频CDN的路径每次都不一样，只按域名统计"""
+        host = request.url.host
+        if "bilivideo" in host or "akamaized" in host or host.startswith("upos-"):
+            return host
+        return f"{host}{request.url.path}"
+
+    def observe(self, request: httpx.Request, seconds: float, error: bool = False):
+        self.histograms[self.endpoint(request)].observe(seconds, error)
+
+    def log_metrics(self):
+        """打印各接口的耗时统计"""
+        if not self.histograms:
+            return
+        lines = [
+            f"{name}：{h.count}次，失败{h.errors}次，平均{h.total / h.count:.3f}s，"
+            f"p50≤{h.percentile(0.5)}s，p95≤{h.percentile(0.95)}s"
+            for name, h in sorted(self.histograms.items(), key=lambda item: item[1].count, reverse=True)
+        ]
+        _LOGGER.info("b站接口耗时统计：\n" + "\n".join(lines))
+
+    async def close(self):
+        await self.client.aclose()
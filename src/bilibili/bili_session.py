@@ -1,5 +1,4 @@
 import asyncio
-from typing import Union
 
 import tenacity
 from bilibili_api import session
@@ -7,41 +6,64 @@ from bilibili_api.session import EventType
 from injector import inject
 
 from src.bilibili.bili_credential import BiliCredential
-from src.bilibili.bili_video import BiliVideo
+from src.bilibili.rate_governor import RateGovernor
 from src.models.task import AskAIResponse, BiliGPTTask, SummarizeAiResponse
 from src.utils.callback import chain_callback
+from src.utils.durable_queue import DurableQueue
+from src.utils.keyed_dispatcher import KeyedDispatcher
 from src.utils.logging import LOGGER
+from src.utils.text_splitter import split_text
 
 _LOGGER = LOGGER.bind(name="bilibili-session")
 
 
 class BiliSession:
     @inject
-    def __init__(self, credential: BiliCredential, private_queue: asyncio.Queue):
+    def __init__(
+        self,
+        credential: BiliCredential,
+        private_queue: DurableQueue,
+        governor: RateGovernor,
+        max_concurrency: int = 5,
+        max_length: int = 500,
+    ):
         """
         初始化BiliSession类
 
         :param credential: B站凭证
         :param private_queue: 私信队列
+        :param governor: b站接口限速器
+        :param max_concurrency: 最多同时给几个用户发私信
+        :param max_length: 单条私信的最大长度，超过会按句子切成几条发
         """
         self.credential = credential
         self.private_queue = private_queue
+        self.governor = governor
+        self.max_length = max_length
+        self.dispatcher = KeyedDispatcher("private", self._send_reply, max_concurrency)
 
     @staticmethod
-    async def quick_send(credential, task: BiliGPTTask, msg: str):
+    async def quick_send(credential, task: BiliGPTTask, msg: str, governor: RateGovernor = None):
         """快速发送私信"""
-        await session.send_msg(
-            credential,
-            # at_items["item"]["private_msg_event"]["text_event"]["sender_uid"],
-            int(task.sender_id),
-            EventType.TEXT,
-            msg,
-        )
+        await BiliSession._send(credential, int(task.sender_id), msg, governor)
 
     @staticmethod
-    def build_reply_content(response: Union[SummarizeAiResponse, AskAIResponse]) -> list:
-        """构建回复内容（由于有私信消息过长被截断的先例，所以返回是一个list，分消息发）"""
-        # TODO 有时还是会触碰到b站的字数墙，但不清楚字数限制是多少，再等等看
+    async def _send(credential, receiver_id: int, msg: str, governor: RateGovernor = None):
+        """发送一条私信，传入限速器的话会先排队等待，并把结果反馈给限速器"""
+        if governor is None:
+            await session.send_msg(credential, receiver_id, EventType.TEXT, msg)
+            return
+        await governor.acquire("private")
+        try:
+            await session.send_msg(credential, receiver_id, EventType.TEXT, msg)
+        except Exception as e:
+            governor.report_exception("private", e)
+            raise
+        governor.success("private")
+
+    @staticmethod
+    def build_reply_content(response: SummarizeAiResponse | AskAIResponse) -> list:
+        """构建回复内容（由于有私信消息过长被截断的先例，所以返回是一个list，发送前会再按长度限制合并或切分）"""
         # TODO 这种判断方式很不优雅，但现在是半夜十二点，我不想改了，我想睡觉了
         if isinstance(response, SummarizeAiResponse):
             msg_list = [
@@ -50,32 +72,44 @@ class BiliSession:
             ]
         elif isinstance(response, AskAIResponse):
             msg_list = [f"【回答】{response.answer}\n\n【自我评分】{response.score}分"]
+        elif isinstance(response, str):
+            msg_list = [response]
         else:
             msg_list = [f"程序内部错误：无法识别的回复类型{type(response)}"]
         return msg_list
 
+    @staticmethod
+    def pack_messages(msg_list: list[str], limit: int = 500) -> list[str]:
+        """把要发的几段内容尽量合并成少量私信，每条不超过limit，单段超长时按句子切开"""
+        packed = []
+        for msg in msg_list:
+            if packed and len(packed[-1]) + 2 + len(msg) <= limit:
+                packed[-1] += "\n\n" + msg
+                continue
+            packed.extend(split_text(msg, limit))
+        return packed
+
     @tenacity.retry(
         retry=tenacity.retry_if_exception_type(Exception),
         wait=tenacity.wait_fixed(10),
         before_sleep=chain_callback,
     )
     async def start_private_reply(self):
-        """发送评论"""
-        while True:
-            try:
+        """发送私信：同一个用户的消息按顺序发，不同用户之间交替发送，不再每条之间干等"""
+        try:
+            while True:
+                await self.dispatcher.wait_for_room()  # 手上的任务够多了就先不领，留在队列里
                 data: BiliGPTTask = await self.private_queue.get()
-                _LOGGER.debug("获取到新的私信任务，开始处理")
-                _, _type = await BiliVideo(credential=self.credential, url=data.video_url).get_video_obj()
-                msg_list = BiliSession.build_reply_content(data.process_result)
-                for msg in msg_list:
-                    await session.send_msg(
-                        self.credential,
-                        # data["item"]["private_msg_event"]["text_event"]["sender_uid"],
-                        int(data.sender_id),
-                        EventType.TEXT,
-                        msg,
-                    )
-                    await asyncio.sleep(3)
-            except asyncio.CancelledError:
-                _LOGGER.info("私信处理链关闭")
-                return
+                _LOGGER.debug(f"获取到新的私信任务{data.uuid}，交给分发器处理")
+                self.dispatcher.submit(data.sender_id, data)
+        except asyncio.CancelledError:
+            _LOGGER.info("私信处理链关闭")
+            await self.dispatcher.close()
+
+    async def _send_reply(self, data: BiliGPTTask):
+        """把一个任务的回复打包后发给对应用户"""
+        msg_list = BiliSession.pack_messages(BiliSession.build_reply_content(data.process_result), self.max_length)
+        with self.private_queue.processing(data):  # 发送完就从队列确认，出错则放回队列稍后重试
+            for msg in msg_list:
+                await BiliSession._send(self.credential, int(data.sender_id), msg, self.governor)
+        _LOGGER.info(f"任务{data.uuid}：私信发送完成，共{len(msg_list)}条")
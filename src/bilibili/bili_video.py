@@ -1,5 +1,3 @@
-from typing import Optional
-
 from bilibili_api import ResourceType, parse_link, video
 from injector import inject
 
@@ -26,7 +24,8 @@ class BiliVideo:
         self._bvid = bvid
         self.aid = aid
         self.url = url
-        self.video_obj: Optional[video.Video] = None
+        self.video_obj: video.Video | None = None
+        self._subtitle_urls: dict[int, str | None] = {}  # cid -> 字幕链接，同一个视频的字幕链接只请求一次
 
     async def get_video_obj(self):
         _type = ResourceType.VIDEO
@@ -54,10 +53,10 @@ class BiliVideo:
             await self.get_video_obj()
         return await self.video_obj.get_pages()
 
-    async def get_video_tags(self, page_index: int = 0):
+    async def get_video_tags(self, page_index: int = 0, cid: int = None):
         if not self.video_obj:
             await self.get_video_obj()
-        return await self.video_obj.get_tags(page_index=page_index)
+        return await self.video_obj.get_tags(page_index=page_index, cid=cid)
 
     async def get_video_download_url(self, page_index: int = 0):
         if not self.video_obj:
@@ -65,13 +64,19 @@ class BiliVideo:
         return await self.video_obj.get_download_url(page_index=page_index)
 
     async def get_video_subtitle(self, cid: int = None, page_index: int = 0):
-        """返回字幕链接，如果有多个字幕则优先返回非ai和翻译字幕，如果没有则返回ai字幕"""
+        """返回字幕链接，如果有多个字幕则优先返回非ai和翻译字幕，如果没有则返回ai字幕（结果会被缓存，重复调用不会再发请求）"""
         if not self.video_obj:
             await self.get_video_obj()
         if not cid:
             cid = await self.video_obj.get_cid(page_index=page_index)
+        if cid in self._subtitle_urls:
+            return self._subtitle_urls[cid]
         info = await self.video_obj.get_player_info(cid=cid)
-        json_files = info["subtitle"]["subtitles"]
+        self._subtitle_urls[cid] = self._choose_subtitle(info["subtitle"]["subtitles"])
+        return self._subtitle_urls[cid]
+
+    @staticmethod
+    def _choose_subtitle(json_files: list) -> str | None:
         if len(json_files) == 0:
             return None
         if len(json_files) == 1:
@@ -0,0 +1,160 @@
+"""b站接口的全局自适应限速器
+
+每个接口（发评论、发私信、拉UP视频列表……）单独维护一个速率，用AIMD调整：
+调用成功就慢慢加速（加法增加），遇到风控信号（need_captcha、风控错误码）就立刻减半并冷却一段时间（乘法减少）
+-412、-352这种整个账号/IP被拦截的错误码会让所有接口一起暂停
+同一个进程里的所有组件共用一个实例，评论、私信、侦听器、处理链之间能互相感知到风控；多个进程之间不共享速率
+"""
+
+import asyncio
+import time
+from collections.abc import Coroutine
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+from bilibili_api.exceptions import NetworkException, ResponseCodeException
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="rate-governor")
+
+GLOBAL_RISK_CODES = (-412, -352)  # 请求被拦截、风控校验失败，整个账号/IP都会受影响
+ENDPOINT_RISK_CODES = (-509, 12015)  # 请求过于频繁、需要验证码，只影响当前接口
+GLOBAL_COOLDOWN = 120  # 触发全局风控后所有接口暂停多久（秒）
+
+T = TypeVar("T")
+
+
+@dataclass
+class EndpointPolicy:
+    initial_rpm: float  # 初始每分钟调用次数
+    min_rpm: float  # 速率下限
+    max_rpm: float  # 速率上限
+    increase: float  # 每次成功后增加多少rpm
+    cooldown: float  # 触发风控后额外冷却多久（秒）
+
+
+# 写接口的初始值沿用之前写死的间隔：评论30秒一条、私信3秒一条
+# UP视频列表是读接口，UP多的时候按20秒一个要扫一个多小时，初始放宽到2秒一个，被风控了会自己降下来
+POLICIES = {
+    "comment": EndpointPolicy(initial_rpm=2, min_rpm=0.1, max_rpm=6, increase=0.2, cooldown=60),
+    "private": EndpointPolicy(initial_rpm=20, min_rpm=0.5, max_rpm=30, increase=1, cooldown=30),
+    "up_video_list": EndpointPolicy(initial_rpm=30, min_rpm=1, max_rpm=120, increase=2, cooldown=60),
+    "at": EndpointPolicy(initial_rpm=6, min_rpm=0.5, max_rpm=12, increase=0.5, cooldown=30),
+}
+# 处理链里获取视频信息、标签、评论、字幕、音频的读接口，每个任务都要调一遍，给得宽一些
+VIDEO_READ_POLICY = EndpointPolicy(initial_rpm=60, min_rpm=2, max_rpm=300, increase=5, cooldown=30)
+POLICIES.update(
+    dict.fromkeys(
+        (
+            "video_resolve",
+            "video_info",
+            "video_tags",
+            "video_comments",
+            "player_info",
+            "subtitle_file",
+            "download_url",
+            "audio_stream",
+        ),
+        VIDEO_READ_POLICY,
+    )
+)
+DEFAULT_POLICY = EndpointPolicy(initial_rpm=30, min_rpm=1, max_rpm=120, increase=2, cooldown=30)
+
+
+@dataclass
+class _EndpointState:
+    policy: EndpointPolicy
+    rpm: float
+    next_allowed: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class RateGovernor:
+    """全局只有一个实例，由注入器提供"""
+
+    def __init__(self):
+        self._states: dict[str, _EndpointState] = {}
+        self._global_until = 0.0
+
+    def _state(self, endpoint: str) -> _EndpointState:
+        if endpoint not in self._states:
+            policy = POLICIES.get(endpoint, DEFAULT_POLICY)
+            self._states[endpoint] = _EndpointState(policy=policy, rpm=policy.initial_rpm)
+        return self._states[endpoint]
+
+    async def acquire(self, endpoint: str):
+        """在调用接口前等待，直到当前速率允许发出下一次请求"""
+        state = self._state(endpoint)
+        async with state.lock:  # 同一个接口按先来后到排队
+            wait = max(state.next_allowed, self._global_until) - time.monotonic()
+            if wait > 0:
+                _LOGGER.debug(f"接口{endpoint}限速中，等待{wait:.1f}秒（当前速率{state.rpm:.2f}次/分钟）")
+                await asyncio.sleep(wait)
+            state.next_allowed = time.monotonic() + 60 / state.rpm
+
+    async def call(self, endpoint: str, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """
+        限速调用一次接口：排队等到速率允许再发出请求，然后根据结果调整速率
+
+        :param endpoint: 接口名
+        :param coro: 还没开始执行的请求协程
+        :param timeout: 请求本身的超时时间（秒），排队等待的时间不算在内，None为不限
+        """
+        try:
+            await self.acquire(endpoint)
+        except BaseException:
+            coro.close()  # 排队时被取消，请求不会再发出了
+            raise
+        try:
+            result = await asyncio.wait_for(coro, timeout)
+        except Exception as e:
+            self.report_exception(endpoint, e)
+            raise
+        self.success(endpoint)
+        return result
+
+    def success(self, endpoint: str):
+        """调用成功，加法增加速率"""
+        state = self._state(endpoint)
+        state.rpm = min(state.policy.max_rpm, state.rpm + state.policy.increase)
+
+    def risk(self, endpoint: str, reason: str, global_pause: bool = False):
+        """
+        遇到风控，乘法减少速率并冷却
+
+        :param endpoint: 接口名
+        :param reason: 风控原因，用于日志
+        :param global_pause: 是否让所有接口一起暂停
+        """
+        state = self._state(endpoint)
+        state.rpm = max(state.policy.min_rpm, state.rpm / 2)
+        state.next_allowed = max(state.next_allowed, time.monotonic() + state.policy.cooldown)
+        if global_pause:
+            self._global_until = max(self._global_until, time.monotonic() + GLOBAL_COOLDOWN)
+            _LOGGER.warning(f"接口{endpoint}触发全局风控（{reason}），所有b站接口暂停{GLOBAL_COOLDOWN}秒")
+        _LOGGER.warning(
+            f"接口{endpoint}遇到风控（{reason}），速率降为{state.rpm:.2f}次/分钟，冷却{state.policy.cooldown}秒"
+        )
+
+    def report_exception(self, endpoint: str, e: BaseException) -> bool:
+        """
+        根据异常判断是否是风控，是的话按风控处理
+
+        :return: 是否是风控导致的异常
+        """
+        code: int | None = None
+        if isinstance(e, ResponseCodeException):
+            code = e.code
+        elif isinstance(e, NetworkException) and e.status == 412:  # 有时候412是直接以http状态码返回的
+            code = -412
+        if code in GLOBAL_RISK_CODES:
+            self.risk(endpoint, f"错误码{code}", global_pause=True)
+            return True
+        if code in ENDPOINT_RISK_CODES:
+            self.risk(endpoint, f"错误码{code}")
+            return True
+        return False
+
+    def current_rpm(self, endpoint: str) -> float:
+        return self._state(endpoint).rpm
@@ -3,13 +3,13 @@ import time
 import traceback
 
 import tenacity
-import yaml
 
 from src.bilibili.bili_session import BiliSession
 from src.chain.base_chain import BaseChain
 from src.llm.templates import Templates
 from src.models.task import AskAIResponse, BiliGPTTask, Chains, ProcessStages
 from src.utils.callback import chain_callback
+from src.utils.json_repair import parse_llm_json
 from src.utils.logging import LOGGER
 
 _LOGGER = LOGGER.bind(name="ask-ai-chain")
@@ -20,7 +20,7 @@ class AskAI(BaseChain):
         match task.source_type:
             case "bili_private":
                 _LOGGER.debug("该消息是私信消息，继续处理")
-                await BiliSession.quick_send(self.credential, task, "视频已开始处理，你先别急")
+                await BiliSession.quick_send(self.credential, task, "视频已开始处理，你先别急", self.governor)
                 return True
             case "bili_comment":
                 _LOGGER.debug("该消息是评论消息，继续处理")
@@ -43,120 +43,156 @@ class AskAI(BaseChain):
             await self._on_start()
             while True:
                 task: BiliGPTTask = await self.ask_ai_queue.get()
-                _item_uuid = task.uuid
-                self._create_record(task)
-                _LOGGER.info(f"ask_ai处理链获取到任务了：{task.uuid}")
-                # 检查是否满足处理条件
-                if task.process_stage == ProcessStages.END:
-                    _LOGGER.info(f"任务{task.uuid}已经结束，获取下一个")
-                    continue
-                if not await self._precheck(task):
-                    continue
-                # 获取视频相关信息
-                # data = self.task_status_recorder.get_data_by_uuid(_item_uuid)
-                resp = await self._get_video_info(task, if_get_comments=False)
-                if resp is None:
-                    continue
-                (
-                    video,
-                    video_info,
-                    format_video_name,
-                    video_tags_string,
-                    video_comments,
-                ) = resp
-                if task.process_stage in (
-                    ProcessStages.PREPROCESS,
-                    ProcessStages.WAITING_LLM_RESPONSE,
-                ):
-                    begin_time = time.perf_counter()
-                    # FIXME: 需要修改项目的cache实现，标注来自于哪个处理链，否则事有点大
-                    if await self._is_cached_video(task, _item_uuid, video_info):
+                with self.ask_ai_queue.processing(task):  # 处理完（包括中途跳过）才从队列确认，崩溃重启后会重新处理
+                    _item_uuid = task.uuid
+                    self._create_record(task)
+                    _LOGGER.info(f"ask_ai处理链获取到任务了：{task.uuid}")
+                    # 检查是否满足处理条件
+                    if task.process_stage == ProcessStages.END:
+                        _LOGGER.info(f"任务{task.uuid}已经结束，获取下一个")
                         continue
-                    # 处理视频音频流和字幕
-                    _LOGGER.debug("视频信息获取成功，正在获取视频音频流和字幕")
-                    if task.subtitle is not None:
-                        text = task.subtitle
-                        _LOGGER.debug("使用字幕缓存，开始使用模板生成prompt")
-                    else:
-                        text = await self._smart_get_subtitle(video, _item_uuid, format_video_name, task)
-                        if text is None:
-                            continue
-                        task.subtitle = text
-                    _LOGGER.info(
-                        f"视频{format_video_name}音频流和字幕处理完成，共用时{time.perf_counter() - begin_time}s，开始调用LLM生成摘要"
-                    )
-                    self.task_status_recorder.update_record(
-                        _item_uuid,
-                        new_task_data=task,
-                        process_stage=ProcessStages.WAITING_LLM_RESPONSE,
-                    )
-                    llm = self.llm_router.get_one()
-                    if llm is None:
-                        _LOGGER.warning("没有可用的LLM，关闭系统")
-                        await self._set_err_end(msg="没有可用的LLM，被迫结束处理", task=task)
-                        self.stop_event.set()
+                    if await self._shed_if_expired(task):
+                        continue
+                    if not await self._precheck(task):
+                        continue
+                    if task.process_stage == ProcessStages.PREPROCESS and await self._is_similar_question(task):
                         continue
-                    prompt = llm.use_template(
-                        Templates.ASK_AI_USER,
-                        Templates.ASK_AI_SYSTEM,
-                        title=video_info["title"],
-                        subtitle=text,
-                        description=video_info["desc"],
-                        question=task.command_params.question,
-                    )
-                    _LOGGER.debug("prompt生成成功，开始调用llm")
-                    # 调用openai的Completion API
-                    response = await llm.completion(prompt)
-                    if response is None:
-                        _LOGGER.warning(f"任务{task.uuid}：ai未返回任何内容，请自行检查问题，跳过处理")
-                        await self._set_err_end(msg="ai未返回任何内容，请自行检查问题，跳过处理", task=task)
-                        self.llm_router.report_error(llm.alias)
+                    # 获取视频相关信息
+                    # data = self.task_status_recorder.get_data_by_uuid(_item_uuid)
+                    resp = await self._get_video_info(task, if_get_comments=False)
+                    if resp is None:
                         continue
-                    answer, tokens = response
-                    self.now_tokens += tokens
-                    _LOGGER.debug(f"llm输出内容为：{answer}")
-                    _LOGGER.debug("调用llm成功，开始处理结果")
-                    task.process_result = answer
-                    task.process_stage = ProcessStages.WAITING_SEND
-                    self.task_status_recorder.update_record(_item_uuid, task)
-                if task.process_stage in (
-                    ProcessStages.WAITING_SEND,
-                    ProcessStages.WAITING_RETRY,
-                ):
-                    begin_time = time.perf_counter()
-                    answer = task.process_result
-                    # obj, _type = await video.get_video_obj()
-                    # 处理结果
-                    if answer:
-                        try:
-                            if task.process_stage == ProcessStages.WAITING_RETRY:
-                                raise Exception("触发重试")
-                            answer = answer.replace("False", "false")  # 解决一部分因为大小写问题导致的json解析失败
-                            answer = answer.replace("True", "true")
-                            resp = yaml.safe_load(answer)
-                            task.process_result = AskAIResponse.model_validate(resp)
-                            _LOGGER.info(
-                                f"ai返回内容解析正确，视频{format_video_name}摘要处理完成，共用时{time.perf_counter() - begin_time}s"
-                            )
-                            await self.finish(task)
-                        except Exception as e:
-                            _LOGGER.error(f"处理结果失败：{e}，大概是ai返回的格式不对，尝试修复")
-                            traceback.print_tb(e.__traceback__)
-                            self.task_status_recorder.update_record(
-                                _item_uuid,
-                                new_task_data=task,
-                                process_stage=ProcessStages.WAITING_RETRY,
-                            )
-                            await self.retry(
-                                answer,
-                                task,
-                                format_video_name,
-                                begin_time,
-                                video_info,
-                            )
+                    (
+                        video,
+                        video_info,
+                        format_video_name,
+                        video_tags_string,
+                        video_comments,
+                    ) = resp
+                    if task.process_stage in (
+                        ProcessStages.PREPROCESS,
+                        ProcessStages.WAITING_LLM_RESPONSE,
+                    ):
+                        begin_time = time.perf_counter()
+                        # 不再按视频缓存（同一个视频不同的问题会拿到同一个回答），相同的问题由LLM调用缓存直接命中
+                        # 处理视频音频流和字幕
+                        _LOGGER.debug("视频信息获取成功，正在获取视频音频流和字幕")
+                        if task.subtitle is not None:
+                            text = task.subtitle
+                            _LOGGER.debug("使用字幕缓存，开始使用模板生成prompt")
+                        else:
+                            text = await self._smart_get_subtitle(video, _item_uuid, format_video_name, task)
+                            if text is None:
+                                continue
+                            task.subtitle = text
+                        _LOGGER.info(
+                            f"视频{format_video_name}音频流和字幕处理完成，共用时{time.perf_counter() - begin_time}s，开始调用LLM生成摘要"
+                        )
+                        self.task_status_recorder.update_record(
+                            _item_uuid,
+                            new_task_data=task,
+                            process_stage=ProcessStages.WAITING_LLM_RESPONSE,
+                        )
+                        llm = self.llm_router.get_one()
+                        if llm is None:
+                            _LOGGER.warning("没有可用的LLM，关闭系统")
+                            await self._set_err_end(msg="没有可用的LLM，被迫结束处理", task=task)
+                            self.stop_event.set()
+                            continue
+                        prompt = llm.use_template(
+                            Templates.ASK_AI_USER,
+                            Templates.ASK_AI_SYSTEM,
+                            title=video_info["title"],
+                            subtitle=self._relevant_subtitle(task, text),
+                            description=video_info["desc"],
+                            question=task.command_params.question,
+                        )
+                        _LOGGER.debug("prompt生成成功，开始调用llm")
+                        # 调用openai的Completion API
+                        response = await llm.completion(
+                            prompt,
+                            cache_validator=lambda _answer: self._parse_answer(_answer, record_stats=False) is not None,
+                            **llm.structured_params(AskAIResponse),
+                        )
+                        if response is None:
+                            _LOGGER.warning(f"任务{task.uuid}：ai未返回任何内容，请自行检查问题，跳过处理")
+                            await self._set_err_end(msg="ai未返回任何内容，请自行检查问题，跳过处理", task=task)
+                            self.llm_router.report_error(llm.alias)
+                            continue
+                        answer, tokens = response
+                        self.now_tokens += tokens
+                        _LOGGER.debug(f"llm输出内容为：{answer}")
+                        _LOGGER.debug("调用llm成功，开始处理结果")
+                        task.process_result = answer
+                        task.process_stage = ProcessStages.WAITING_SEND
+                        self.task_status_recorder.update_record(_item_uuid, task)
+                    if task.process_stage in (
+                        ProcessStages.WAITING_SEND,
+                        ProcessStages.WAITING_RETRY,
+                    ):
+                        begin_time = time.perf_counter()
+                        answer = task.process_result
+                        # obj, _type = await video.get_video_obj()
+                        # 处理结果
+                        if answer:
+                            try:
+                                if task.process_stage == ProcessStages.WAITING_RETRY:
+                                    raise Exception("触发重试")
+                                parsed = self._parse_answer(answer)  # 先在本地修复，修不好再交给LLM重试
+                                if parsed is None:
+                                    raise Exception("ai返回内容本地修复失败")
+                                task.process_result = parsed
+                                if self.config.llm_settings.question_cache.enable:
+                                    self.question_cache.add(
+                                        task.video_id, task.command_params.question, task.process_result.model_dump()
+                                    )
+                                _LOGGER.info(
+                                    f"ai返回内容解析正确，视频{format_video_name}摘要处理完成，共用时{time.perf_counter() - begin_time}s"
+                                )
+                                await self.finish(task)
+                            except Exception as e:
+                                _LOGGER.error(f"处理结果失败：{e}，大概是ai返回的格式不对，尝试修复")
+                                traceback.print_tb(e.__traceback__)
+                                self.task_status_recorder.update_record(
+                                    _item_uuid,
+                                    new_task_data=task,
+                                    process_stage=ProcessStages.WAITING_RETRY,
+                                )
+                                await self.retry(
+                                    answer,
+                                    task,
+                                    format_video_name,
+                                    begin_time,
+                                    video_info,
+                                )
         except asyncio.CancelledError:
             _LOGGER.info("收到关闭信号，ask_ai处理链关闭")
 
+    def _relevant_subtitle(self, task: BiliGPTTask, text: str) -> str:
+        """长字幕只保留和问题相关的几段（按原来的先后顺序，中间用省略号隔开），短字幕原样返回"""
+        settings = self.config.transcript_settings
+        if not settings.retrieval or len(text) <= settings.retrieval_min_length:
+            return text
+        chunks = self.transcript_index.retrieve(task.video_id, text, task.command_params.question, settings.top_k)
+        relevant = "\n……\n".join(chunks)
+        _LOGGER.info(f"字幕共{len(text)}字，检索出{len(chunks)}段和问题相关的字幕，共{len(relevant)}字")
+        return relevant
+
+    async def _is_similar_question(self, task: BiliGPTTask) -> bool:
+        """同一个视频下之前有人问过相似的问题，就直接复用回答，不再获取字幕和调用LLM"""
+        if not self.config.llm_settings.question_cache.enable:
+            return False
+        cached = self.question_cache.lookup(task.video_id, task.command_params.question)
+        if cached is None:
+            return False
+        try:
+            task.process_result = AskAIResponse.model_validate(cached)
+        except Exception:
+            _LOGGER.warning(f"任务{task.uuid}：相似问题的回答格式不对，按正常流程处理")
+            return False
+        await self.finish(task, use_cache=True)
+        return True
+
     async def _on_start(self):
         """在启动处理链时先处理一下之前没有处理完的视频"""
         _LOGGER.info("正在启动摘要处理链，开始将上次未处理完的视频加入队列")
@@ -167,13 +203,21 @@ class AskAI(BaseChain):
         for task in uncomplete_task:
             if task["process_stage"] != ProcessStages.END.value:
                 try:
+                    _task = BiliGPTTask.model_validate(task)
+                    if await self._shed_if_expired(_task):  # 排队太久的不再恢复
+                        continue
                     _LOGGER.debug(f"恢复uuid: {task['uuid']} 的任务")
-                    self.ask_ai_queue.put_nowait(BiliGPTTask.model_validate(task))
+                    self.ask_ai_queue.put_nowait(_task)
                 except Exception:
                     traceback.print_exc()
                     # TODO 这里除了打印日志，是不是还应该记录在视频状态中？
                     _LOGGER.error(f"在恢复uuid: {task['uuid']} 时出现错误！跳过恢复")
 
+    @staticmethod
+    def _parse_answer(answer: str, record_stats: bool = True) -> AskAIResponse | None:
+        """尝试把ai返回的内容解析为AskAIResponse（格式有小毛病会先在本地修复），失败返回None"""
+        return parse_llm_json(answer, AskAIResponse, record_stats)
+
     async def retry(self, ai_answer, task: BiliGPTTask, format_video_name, begin_time, video_info):
         """通过重试prompt让chatgpt重新构建json
 
@@ -2,17 +2,17 @@ import abc
 import asyncio
 import os
 import time
-from typing import Optional
 
 import ffmpeg
-import httpx
-from bilibili_api import HEADERS
 from injector import inject
 
+from src.asr.asr_base import remove_temp_files
 from src.bilibili.bili_comment import BiliComment
 from src.bilibili.bili_credential import BiliCredential
+from src.bilibili.bili_http import BiliHttp
 from src.bilibili.bili_session import BiliSession
 from src.bilibili.bili_video import BiliVideo
+from src.bilibili.rate_governor import RateGovernor
 from src.core.routers.asr_router import ASRouter
 from src.core.routers.llm_router import LLMRouter
 from src.models.config import Config
@@ -24,9 +24,14 @@ from src.models.task import (
     SummarizeAiResponse,
 )
 from src.utils.cache import Cache
+from src.utils.deadline import DeadlineStatus, check_deadline
 from src.utils.logging import LOGGER
+from src.utils.question_cache import QuestionCache
 from src.utils.queue_manager import QueueManager
+from src.utils.subtitle_cache import SubtitleCache
 from src.utils.task_status_record import TaskStatusRecorder
+from src.utils.transcript_compress import compress_transcript, split_cues
+from src.utils.transcript_index import TranscriptIndex
 
 
 class BaseChain:
@@ -45,8 +50,18 @@ class BaseChain:
         task_status_recorder: TaskStatusRecorder,
         stop_event: asyncio.Event,
         llm_router: LLMRouter,
+        question_cache: QuestionCache,
+        bili_http: BiliHttp,
+        governor: RateGovernor,
+        subtitle_cache: SubtitleCache,
+        transcript_index: TranscriptIndex,
     ):
         self.llm_router = llm_router
+        self.subtitle_cache = subtitle_cache
+        self.transcript_index = transcript_index
+        self.bili_http = bili_http
+        self.governor = governor
+        self.question_cache = question_cache
         self.queue_manager = queue_manager
         self.config = config
         self.cache = cache
@@ -96,6 +111,7 @@ class BaseChain:
                     self.credential,
                     task,
                     msg,
+                    self.governor,
                 )
             case "bili_comment":
                 _task.process_result = msg
@@ -107,6 +123,8 @@ class BaseChain:
                 _task.process_result = msg
                 self._LOGGER.debug(f"任务{task.uuid}:评论消息，将结果放入评论处理队列，内容：{msg}")
                 await self.reply_queue.put(task)
+            case "prefetch":
+                self._LOGGER.debug(f"任务{task.uuid}:预取任务，没有人在等回复，不用发送：{msg}")
 
     async def _set_normal_end(self, task: BiliGPTTask = None, _uuid: str = None):
         """当一个视频正常结束时，调用此方法
@@ -135,12 +153,42 @@ class BaseChain:
             end_reason=EndReasons.NONEED,
             gmt_end=int(time.time()),
         )
+        if task.source_type == "prefetch":
+            return
         await BiliSession.quick_send(
             self.credential,
             task,
             "AI觉得你的视频不需要处理，换个更有意义的视频再试试看吧！",
+            self.governor,
         )
 
+    def _deadline_status(self, task: BiliGPTTask) -> DeadlineStatus:
+        """根据任务排队的时间判断该正常处理、降级处理还是放弃"""
+        settings = self.config.queue_settings
+        return check_deadline(task, settings.soft_deadlines, settings.hard_deadlines)
+
+    async def _shed_if_expired(self, task: BiliGPTTask) -> bool:
+        """
+        任务超过硬截止时间、且还没拿到LLM的结果时放弃处理（已经有结果的任务发送很便宜，照常发出去）
+
+        :return: 被放弃返回True
+        """
+        if task.process_stage not in (ProcessStages.PREPROCESS, ProcessStages.WAITING_LLM_RESPONSE):
+            return False
+        if self._deadline_status(task) != DeadlineStatus.EXPIRED:
+            return False
+        self._LOGGER.warning(
+            f"任务{task.uuid}：已经排队{int(time.time()) - task.gmt_create}秒，超过了截止时间，放弃处理"
+        )
+        self.task_status_recorder.update_record(
+            task.uuid,
+            new_task_data=None,
+            process_stage=ProcessStages.END,
+            end_reason=EndReasons.EXPIRED,
+            gmt_end=int(time.time()),
+        )
+        return True
+
     @abc.abstractmethod
     async def _precheck(self, task: BiliGPTTask) -> bool:
         """检查是否符合调用条件
@@ -177,6 +225,8 @@ class BaseChain:
             case "bili_up":
                 _LOGGER.info(f"任务{task.uuid}:评论消息，将结果放入评论处理队列")
                 await self.reply_queue.put(reply_data)
+            case "prefetch":
+                _LOGGER.info(f"任务{task.uuid}:预取任务，结果只写入缓存，等用户来问")
         _LOGGER.debug("处理结束，开始清理并提交记录")
         self.task_status_recorder.update_record(
             reply_data.uuid,
@@ -230,7 +280,7 @@ class BaseChain:
 
     async def _get_video_info(
         self, task: BiliGPTTask, if_get_comments: bool = True
-    ) -> Optional[tuple[BiliVideo, dict, str, str, Optional[str]]]:
+    ) -> tuple[BiliVideo, dict, str, str, str | None] | None:
         """获取视频的一些信息
         :param task: 任务对象
         :param if_get_comments: 是否获取评论，为假就返回空
@@ -244,109 +294,200 @@ class BaseChain:
         video_comments: 随机获取的几条视频评论拼接的字符串
         """
         _LOGGER = self._LOGGER
+        settings = self.config.bilibili_settings
         _LOGGER.info("开始处理该视频音频流和字幕")
         video = BiliVideo(self.credential, url=task.video_url)
-        _LOGGER.debug("视频对象创建成功，正在获取视频信息")
-        video_info = await video.get_video_info
-        _LOGGER.debug("视频信息获取成功，正在获取视频标签")
+        video_obj, _ = await self.governor.call("video_resolve", video.get_video_obj())
+        _LOGGER.debug("视频对象创建成功，开始并发获取视频信息、评论、标签和字幕链接")
+        # 评论只需要aid，和视频信息一起发出去；标签和字幕链接需要cid，等视频信息回来后再一起发
+        comments_task = (
+            asyncio.create_task(
+                self._fetch_optional(
+                    "video_comments",
+                    BiliComment.get_random_comment(video_obj.get_aid(), self.credential),
+                    settings.video_comments_timeout,
+                    "视频评论",
+                )
+            )
+            if if_get_comments
+            else None
+        )
+        try:
+            video_info = await self.governor.call("video_info", video.get_video_info, settings.video_info_timeout)
+        except BaseException:
+            if comments_task:
+                comments_task.cancel()
+            raise
         format_video_name = f"『{video_info['title']}』"
         # TODO 不清楚b站回复和at时分P的展现机制，暂时遇到分P视频就跳过
         if len(video_info["pages"]) > 1:
+            if comments_task:
+                comments_task.cancel()
             _LOGGER.warning(f"任务{task.uuid}: 视频{format_video_name}分P，跳过处理")
             await self._set_err_end(msg="视频分P，跳过处理", task=task)
             return None
-        # 获取视频标签
-        video_tags_string = " ".join(f"#{tag['tag_name']}" for tag in await video.get_video_tags())
-        _LOGGER.debug("视频标签获取成功，开始获取视频评论")
-        # 获取视频评论
-        video_comments = (
-            await BiliComment.get_random_comment(video_info["aid"], self.credential) if if_get_comments else None
+        video_tags, _ = await asyncio.gather(
+            self._fetch_optional(
+                "video_tags",
+                video.get_video_tags(cid=video_info["cid"]),
+                settings.video_tags_timeout,
+                "视频标签",
+                default=[],
+            ),
+            # 只是预取，结果缓存在video对象里，获取字幕时直接用
+            self._fetch_optional(
+                "player_info",
+                video.get_video_subtitle(cid=video_info["cid"]),
+                settings.subtitle_url_timeout,
+                "字幕链接",
+            ),
         )
+        video_tags_string = " ".join(f"#{tag['tag_name']}" for tag in video_tags)
+        video_comments = await comments_task if comments_task else None
+        _LOGGER.debug("视频信息、评论、标签和字幕链接获取完成")
         return video, video_info, format_video_name, video_tags_string, video_comments
 
+    async def _fetch_optional(self, endpoint: str, coro, timeout: float, name: str, default=None):
+        """获取非必需的信息（经过限速器），超时或出错时返回默认值，不影响后续处理"""
+        try:
+            return await self.governor.call(endpoint, coro, timeout)
+        except TimeoutError:
+            self._LOGGER.warning(f"获取{name}超时（{timeout}s），不再等待")
+        except Exception as e:
+            self._LOGGER.warning(f"获取{name}失败：{e}，跳过")
+        return default
+
     async def _get_subtitle_from_bilibili(self, video: BiliVideo) -> str:
         """从bilibili获取字幕(返回的是纯字幕，不包含时间轴)"""
         _LOGGER = self._LOGGER
-        subtitle_url = await video.get_video_subtitle(page_index=0)
+        subtitle_url = await self.governor.call("player_info", video.get_video_subtitle(page_index=0))
         _LOGGER.debug("视频字幕获取成功，正在读取字幕")
         # 下载字幕
-        async with httpx.AsyncClient() as client:
-            resp = await client.get("https:" + subtitle_url, headers=HEADERS)
+        resp = await self.governor.call("subtitle_file", self.bili_http.client.get("https:" + subtitle_url))
         _LOGGER.debug("字幕获取成功，正在转换为纯字幕")
         # 转换字幕格式
+        cues = [subtitle["content"] for subtitle in resp.json()["body"]]
+        if self.config.transcript_settings.compress:
+            return self._compress_subtitle(cues)
         text = ""
-        for subtitle in resp.json()["body"]:
-            text += f"{subtitle['content']}\n"
+        for cue in cues:
+            text += f"{cue}\n"
         return text
 
-    async def _get_subtitle_from_asr(self, video: BiliVideo, _uuid: str, is_retry: bool = False) -> Optional[str]:
+    def _compress_subtitle(self, cues: list[str]) -> str:
+        """压缩字幕，省掉重复、啰嗦的部分"""
+        text, ratio = compress_transcript(cues, self.config.transcript_settings.drop_low_info)
+        self._LOGGER.info(f"字幕压缩完成，共{len(cues)}条，压缩后长度为原来的{ratio:.0%}")
+        return text
+
+    def _load_asr_checkpoint(self, _uuid: str) -> dict[int, str]:
+        """从任务记录里读出语音转写断点，没有就返回空字典"""
+        try:
+            return self.task_status_recorder.get_data_by_uuid(_uuid).asr_checkpoint or {}
+        except Exception:
+            return {}
+
+    def _save_asr_checkpoint(self, _uuid: str, checkpoint: dict[int, str]):
+        """每转完一个切片就把断点写回任务记录，进程挂掉重启后从这里接着转"""
+        self.task_status_recorder.update_record(_uuid, new_task_data=None, asr_checkpoint=checkpoint)
+
+    async def _asr_transcribe(self, audio_path: str, _uuid: str) -> str | None:
+        """调用asr转写，已经转写过的切片（断点）直接跳过"""
+        checkpoint = self._load_asr_checkpoint(_uuid)
+        if checkpoint:
+            self._LOGGER.info(f"任务{_uuid}：找到语音转写断点，已完成{len(checkpoint)}个切片，从断点继续转写")
+        return await self.asr.transcribe(
+            audio_path,
+            checkpoint=checkpoint,
+            on_checkpoint=lambda new_checkpoint: self._save_asr_checkpoint(_uuid, new_checkpoint),
+        )
+
+    async def _get_subtitle_from_asr(self, video: BiliVideo, _uuid: str, is_retry: bool = False) -> str | None:
         _LOGGER = self._LOGGER
         if self.asr is None:
             _LOGGER.warning("没有可用的asr，跳过处理")
             await self._set_err_end(_uuid=_uuid, msg="没有可用的asr，跳过处理")
+            return None
+        temp_dir = self.temp_dir
+        bvid = await video.bvid
+        # 临时文件按任务区分：预取和用户请求、总结和问答、不同进程可能同时在转写同一个视频，
+        # 共用文件名的话会互相复用、删除对方的音频和切片（切片文件名由音频文件名决定）
+        audio_path = f"{temp_dir}/{bvid} {_uuid} temp.mp3"
+        m4s_path = f"{temp_dir}/{bvid} {_uuid} temp.m4s"
         if is_retry:
             # 如果是重试，就默认已下载音频文件，直接开始转写
-            bvid = await video.bvid
-            audio_path = f"{self.temp_dir}/{bvid} temp.mp3"
             self.asr = self.asr_router.get_one()  # 重新获取一个，防止因为错误而被禁用，但调用端没及时更新
             if self.asr is None:
                 _LOGGER.warning("没有可用的asr，跳过处理")
-                await self._set_err_end(_uuid, "没有可用的asr，跳过处理")
-            text = await self.asr.transcribe(audio_path)
-            if text is None:
-                _LOGGER.warning("音频转写失败，报告并重试")
-                self.asr_router.report_error(self.asr.alias)
-                await self._get_subtitle_from_asr(video, _uuid, is_retry=True)  # 递归，应该不会爆栈
-            return text
-        _LOGGER.debug("正在获取视频音频流")
-        video_download_url = await video.get_video_download_url()
-        audio_url = video_download_url["dash"]["audio"][0]["baseUrl"]
-        _LOGGER.debug("视频下载链接获取成功，正在下载视频中的音频流")
-        bvid = await video.bvid
-        # 下载视频中的音频流
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(audio_url, headers=HEADERS)
-            temp_dir = self.temp_dir
+                # 彻底失败了，音频和切片不会再用到
+                remove_temp_files(audio_path, temp_dir)
+                await self._set_err_end(msg="没有可用的asr，跳过处理", _uuid=_uuid)
+                return None
+        elif self._load_asr_checkpoint(_uuid) and os.path.exists(audio_path):
+            # 有断点说明上次音频已经完整下载并开始切片转写了，不用重新下载
+            _LOGGER.debug("音频文件已存在，跳过下载")
+        else:
+            _LOGGER.debug("正在获取视频音频流")
+            video_download_url = await self.governor.call("download_url", video.get_video_download_url())
+            audio_url = video_download_url["dash"]["audio"][0]["baseUrl"]
+            _LOGGER.debug("视频下载链接获取成功，正在下载视频中的音频流")
+            # 下载视频中的音频流
+            resp = await self.governor.call("audio_stream", self.bili_http.client.get(audio_url))
             if not os.path.exists(temp_dir):
                 os.mkdir(temp_dir)
-            with open(f"{temp_dir}/{bvid} temp.m4s", "wb") as f:
+            with open(m4s_path, "wb") as f:
                 f.write(resp.content)
-        _LOGGER.debug("视频中的音频流下载成功，正在转换音频格式")
-        # 转换音频格式
-        (ffmpeg.input(f"{temp_dir}/{bvid} temp.m4s").output(f"{temp_dir}/{bvid} temp.mp3").run(overwrite_output=True))
-        _LOGGER.debug("音频格式转换成功，正在使用whisper转写音频")
-        # 使用whisper转写音频
-        audio_path = f"{temp_dir}/{bvid} temp.mp3"
-        text = await self.asr.transcribe(audio_path)
+            _LOGGER.debug("视频中的音频流下载成功，正在转换音频格式")
+            # 转换音频格式
+            (ffmpeg.input(m4s_path).output(audio_path).run(overwrite_output=True))
+            os.remove(m4s_path)
+        _LOGGER.debug("正在使用asr转写音频")
+        text = await self._asr_transcribe(audio_path, _uuid)
         if text is None:
             _LOGGER.warning("音频转写失败，报告并重试")
             self.asr_router.report_error(self.asr.alias)
-            await self._get_subtitle_from_asr(video, _uuid, is_retry=True)  # 递归，应该不会爆栈
+            return await self._get_subtitle_from_asr(video, _uuid, is_retry=True)  # 递归，应该不会爆栈
         _LOGGER.debug("音频转写成功，正在删除临时文件")
         # 删除临时文件
-        os.remove(f"{temp_dir}/{bvid} temp.m4s")
-        os.remove(f"{temp_dir}/{bvid} temp.mp3")
+        os.remove(audio_path)
         _LOGGER.debug("临时文件删除成功")
         return text
 
     async def _smart_get_subtitle(
         self, video: BiliVideo, _uuid: str, format_video_name: str, task: BiliGPTTask
-    ) -> Optional[str]:
-        """根据用户配置智能获取字幕"""
+    ) -> str | None:
+        """根据用户配置智能获取字幕，拿到的字幕会缓存下来，同一个视频（比如预取过的）下次直接用"""
         _LOGGER = self._LOGGER
-        subtitle_url = await video.get_video_subtitle(page_index=0)
+        cached = self.subtitle_cache.get(task.video_id)
+        if cached is not None:
+            _LOGGER.debug(f"视频{format_video_name}命中字幕缓存")
+            return cached
+        subtitle_url = await self.governor.call("player_info", video.get_video_subtitle(page_index=0))
         if subtitle_url is None:
             if self.asr is None:
                 _LOGGER.warning(f"视频{format_video_name}没有字幕，你没有可用的asr，跳过处理")
-                await self._set_err_end(_uuid, "视频没有字幕，你没有可用的asr，跳过处理")
+                await self._set_err_end(msg="视频没有字幕，你没有可用的asr，跳过处理", task=task)
+                return None
+            if self._deadline_status(task) != DeadlineStatus.NORMAL:
+                _LOGGER.warning(f"视频{format_video_name}没有字幕，任务{task.uuid}排队太久已经降级，不再做语音转写")
+                await self._set_err_end(
+                    msg="视频没有字幕，现在排队的任务太多了，来不及做语音转写，晚点再来试试吧", task=task
+                )
                 return None
             _LOGGER.warning(f"视频{format_video_name}没有字幕，开始使用asr转写，这可能会导致字幕质量下降")
             text = await self._get_subtitle_from_asr(video, _uuid)
+            if text is None:
+                return None
+            if self.config.transcript_settings.compress:
+                text = self._compress_subtitle(split_cues(text))
             task.subtitle = text
+            task.asr_checkpoint = None  # 完整字幕已经保存，断点没用了
             self.task_status_recorder.update_record(_uuid, new_task_data=task, use_whisper=True)
+            self.subtitle_cache.set(task.video_id, text, "asr")
             return text
         _LOGGER.debug(f"视频{format_video_name}有字幕，开始处理")
         text = await self._get_subtitle_from_bilibili(video)
+        self.subtitle_cache.set(task.video_id, text, "bilibili")
         return text
 
     def _create_record(self, task: BiliGPTTask) -> str:
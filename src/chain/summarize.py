@@ -3,14 +3,15 @@ import time
 import traceback
 
 import tenacity
-import yaml
 
 from src.bilibili.bili_session import BiliSession
 from src.chain.base_chain import BaseChain
 from src.llm.templates import Templates
 from src.models.task import BiliGPTTask, Chains, ProcessStages, SummarizeAiResponse
 from src.utils.callback import chain_callback
+from src.utils.json_repair import parse_llm_json
 from src.utils.logging import LOGGER
+from src.utils.prompt_utils import estimate_tokens
 
 _LOGGER = LOGGER.bind(name="summarize-chain")
 
@@ -23,7 +24,7 @@ class Summarize(BaseChain):
         match task.source_type:
             case "bili_private":
                 _LOGGER.debug("该消息是私信消息，继续处理")
-                await BiliSession.quick_send(self.credential, task, "视频已开始处理，你先别急")
+                await BiliSession.quick_send(self.credential, task, "视频已开始处理，你先别急", self.governor)
                 return True
             case "bili_comment":
                 _LOGGER.debug("该消息是评论消息，继续处理")
@@ -34,6 +35,9 @@ class Summarize(BaseChain):
             case "bili_up":
                 _LOGGER.debug("该消息是up更新消息，继续处理")
                 return True
+            case "prefetch":
+                _LOGGER.debug("该消息是预取任务，继续处理")
+                return True
         # if task["item"]["type"] != "reply" or task["item"]["business_id"] != 1:
         #     _LOGGER.warning(f"该消息目前并不支持，跳过处理")
         #     self._set_err_end(_uuid, "该消息目前并不支持，跳过处理")
@@ -54,8 +58,11 @@ class Summarize(BaseChain):
         for task in uncomplete_task:
             if task["process_stage"] != ProcessStages.END.value:
                 try:
+                    _task = BiliGPTTask.model_validate(task)
+                    if await self._shed_if_expired(_task):  # 排队太久的不再恢复
+                        continue
                     _LOGGER.debug(f"恢复uuid: {task['uuid']} 的任务")
-                    self.summarize_queue.put_nowait(BiliGPTTask.model_validate(task))
+                    self.summarize_queue.put_nowait(_task)
                 except Exception:
                     traceback.print_exc()
                     # TODO 这里除了打印日志，是不是还应该记录在视频状态中？
@@ -82,139 +89,190 @@ class Summarize(BaseChain):
 
                 # 从队列中获取摘要
                 task: BiliGPTTask = await self.summarize_queue.get()
-                _item_uuid = task.uuid
-                self._create_record(task)
-                _LOGGER.info(f"summarize处理链获取到任务了：{task.uuid}")
-                # 检查是否满足处理条件
-                if task.process_stage == ProcessStages.END:
-                    _LOGGER.info(f"任务{task.uuid}已经结束，获取下一个")
-                    continue
-                if not await self._precheck(task):
-                    continue
-                # 获取视频相关信息
-                # data = self.task_status_recorder.get_data_by_uuid(_item_uuid)
-                resp = await self._get_video_info(task)
-                if resp is None:
-                    continue
-                (
-                    video,
-                    video_info,
-                    format_video_name,
-                    video_tags_string,
-                    video_comments,
-                ) = resp
-                if task.process_stage in (
-                    ProcessStages.PREPROCESS,
-                    ProcessStages.WAITING_LLM_RESPONSE,
-                ):
-                    begin_time = time.perf_counter()
-                    if await self._is_cached_video(task, _item_uuid, video_info):
+                with self.summarize_queue.processing(task):  # 处理完（包括中途跳过）才从队列确认，崩溃重启后会重新处理
+                    _item_uuid = task.uuid
+                    self._create_record(task)
+                    _LOGGER.info(f"summarize处理链获取到任务了：{task.uuid}")
+                    # 检查是否满足处理条件
+                    if task.process_stage == ProcessStages.END:
+                        _LOGGER.info(f"任务{task.uuid}已经结束，获取下一个")
                         continue
-                    # 处理视频音频流和字幕
-                    _LOGGER.debug("视频信息获取成功，正在获取视频音频流和字幕")
-                    if task.subtitle is not None:
-                        text = task.subtitle
-                        _LOGGER.debug("使用字幕缓存，开始使用模板生成prompt")
-                    else:
-                        text = await self._smart_get_subtitle(video, _item_uuid, format_video_name, task)
-                        if text is None:
-                            continue
-                        task.subtitle = text
-                    _LOGGER.info(
-                        f"视频{format_video_name}音频流和字幕处理完成，共用时{time.perf_counter() - begin_time}s，开始调用LLM生成摘要"
-                    )
-                    self.task_status_recorder.update_record(
-                        _item_uuid,
-                        new_task_data=task,
-                        process_stage=ProcessStages.WAITING_LLM_RESPONSE,
-                    )
-                    llm = self.llm_router.get_one()
-                    if llm is None:
-                        _LOGGER.warning("没有可用的LLM，关闭系统")
-                        await self._set_err_end(msg="没有可用的LLM，被迫结束处理", task=task)
-                        self.stop_event.set()
+                    if await self._shed_if_expired(task):
                         continue
-                    prompt = llm.use_template(
-                        Templates.SUMMARIZE_USER,
-                        Templates.SUMMARIZE_SYSTEM,
-                        title=video_info["title"],
-                        tags=video_tags_string,
-                        comments=video_comments,
-                        subtitle=text,
-                        description=video_info["desc"],
-                    )
-                    _LOGGER.debug("prompt生成成功，开始调用llm")
-                    # 调用openai的Completion API
-                    response = await llm.completion(prompt)
-                    if response is None:
-                        _LOGGER.warning(f"任务{task.uuid}：ai未返回任何内容，请自行检查问题，跳过处理")
-                        await self._set_err_end(
-                            msg="AI未返回任何内容，我也不知道为什么，估计是调休了吧。换个视频或者等一小会儿再试一试。",
-                            task=task,
-                        )
-                        self.llm_router.report_error(llm.alias)
+                    if not await self._precheck(task):
                         continue
-                    answer, tokens = response
-                    self.now_tokens += tokens
-                    _LOGGER.debug(f"llm输出内容为：{answer}")
-                    _LOGGER.debug("调用llm成功，开始处理结果")
-                    task.process_result = answer
-                    task.process_stage = ProcessStages.WAITING_SEND
-                    self.task_status_recorder.update_record(_item_uuid, task)
-                if task.process_stage in (
-                    ProcessStages.WAITING_SEND,
-                    ProcessStages.WAITING_RETRY,
-                ):
-                    begin_time = time.perf_counter()
-                    answer = task.process_result
-                    # obj, _type = await video.get_video_obj()
-                    # 处理结果
-                    if answer:
-                        try:
-                            if task.process_stage == ProcessStages.WAITING_RETRY:
-                                raise Exception("触发重试")
-
-                            answer = answer.replace("False", "false")  # 解决一部分因为大小写问题导致的json解析失败
-                            answer = answer.replace("True", "true")
-
-                            ai_resp = yaml.safe_load(answer)
-                            ai_resp["score"] = str(ai_resp["score"])  # 预防返回的值类型为int,强转成str
-                            task.process_result = SummarizeAiResponse.model_validate(ai_resp)
-                            if task.process_result.if_no_need_summary is True:
-                                _LOGGER.warning(f"视频{format_video_name}被ai判定为不需要摘要，跳过处理")
-                                await BiliSession.quick_send(
-                                    self.credential,
-                                    task,
-                                    "AI觉得你的视频不需要处理，换个更有意义的视频再试试看吧！",
-                                )
-                                # await BiliSession.quick_send(
-                                #     self.credential, task, answer
-                                # )
-                                await self._set_noneed_end(task)
+                    # 获取视频相关信息
+                    # data = self.task_status_recorder.get_data_by_uuid(_item_uuid)
+                    resp = await self._get_video_info(task)
+                    if resp is None:
+                        continue
+                    (
+                        video,
+                        video_info,
+                        format_video_name,
+                        video_tags_string,
+                        video_comments,
+                    ) = resp
+                    if task.process_stage in (
+                        ProcessStages.PREPROCESS,
+                        ProcessStages.WAITING_LLM_RESPONSE,
+                    ):
+                        begin_time = time.perf_counter()
+                        if await self._is_cached_video(task, _item_uuid, video_info):
+                            continue
+                        # 处理视频音频流和字幕
+                        _LOGGER.debug("视频信息获取成功，正在获取视频音频流和字幕")
+                        if task.subtitle is not None:
+                            text = task.subtitle
+                            _LOGGER.debug("使用字幕缓存，开始使用模板生成prompt")
+                        else:
+                            text = await self._smart_get_subtitle(video, _item_uuid, format_video_name, task)
+                            if text is None:
                                 continue
-                            _LOGGER.info(
-                                f"ai返回内容解析正确，视频{format_video_name}摘要处理完成，共用时{time.perf_counter() - begin_time}s"
+                            task.subtitle = text
+                        _LOGGER.info(
+                            f"视频{format_video_name}音频流和字幕处理完成，共用时{time.perf_counter() - begin_time}s，开始调用LLM生成摘要"
+                        )
+                        self.task_status_recorder.update_record(
+                            _item_uuid,
+                            new_task_data=task,
+                            process_stage=ProcessStages.WAITING_LLM_RESPONSE,
+                        )
+                        llm = self.llm_router.get_one()
+                        if llm is None:
+                            _LOGGER.warning("没有可用的LLM，关闭系统")
+                            await self._set_err_end(msg="没有可用的LLM，被迫结束处理", task=task)
+                            self.stop_event.set()
+                            continue
+                        prompt_kwargs = {
+                            "title": video_info["title"],
+                            "tags": video_tags_string,
+                            "comments": video_comments,
+                            "subtitle": text,
+                            "description": video_info["desc"],
+                        }
+                        hedge_enabled = self.config.llm_settings.hedge.enable
+                        cascade = self.config.llm_settings.cascade
+                        if cascade.enable:
+                            skip_cheap = estimate_tokens(text) > cascade.max_cheap_tokens
+                            _LOGGER.debug(
+                                f"已启用级联调用，{'字幕太长，直接使用最强的一档' if skip_cheap else '先使用最便宜的一档'}"
                             )
-                            await self.finish(task)
-
-                        except Exception as e:
-                            _LOGGER.error(f"处理结果失败：{e}，大概是ai返回的格式不对，尝试修复")
-                            traceback.print_tb(e.__traceback__)
-                            self.task_status_recorder.update_record(
-                                _item_uuid,
-                                new_task_data=task,
-                                process_stage=ProcessStages.WAITING_RETRY,
+                            response = await self.llm_router.cascade_completion(
+                                Templates.SUMMARIZE_USER,
+                                Templates.SUMMARIZE_SYSTEM,
+                                validator=lambda _answer: self._parse_answer(_answer, record_stats=False) is not None,
+                                accept=self._is_confident,
+                                schema=SummarizeAiResponse,
+                                skip_cheap=skip_cheap,
+                                usage=task.llm_usage,
+                                **prompt_kwargs,
+                            )
+                        elif hedge_enabled:
+                            _LOGGER.debug("已启用对冲请求，交给LLM路由器调度")
+                            response = await self.llm_router.hedged_completion(
+                                Templates.SUMMARIZE_USER,
+                                Templates.SUMMARIZE_SYSTEM,
+                                validator=lambda _answer: self._parse_answer(_answer, record_stats=False) is not None,
+                                schema=SummarizeAiResponse,
+                                **prompt_kwargs,
+                            )
+                        else:
+                            prompt = llm.use_template(
+                                Templates.SUMMARIZE_USER, Templates.SUMMARIZE_SYSTEM, **prompt_kwargs
                             )
-                            await self.retry(
-                                answer,
-                                task,
-                                format_video_name,
-                                begin_time,
-                                video_info,
+                            _LOGGER.debug("prompt生成成功，开始调用llm")
+                            # 调用openai的Completion API
+                            response = await llm.completion(
+                                prompt,
+                                cache_validator=lambda _answer: (
+                                    self._parse_answer(_answer, record_stats=False) is not None
+                                ),
+                                **llm.structured_params(SummarizeAiResponse),
                             )
+                        if response is None:
+                            _LOGGER.warning(f"任务{task.uuid}：ai未返回任何内容，请自行检查问题，跳过处理")
+                            await self._set_err_end(
+                                msg="AI未返回任何内容，我也不知道为什么，估计是调休了吧。换个视频或者等一小会儿再试一试。",
+                                task=task,
+                            )
+                            if not (hedge_enabled or cascade.enable):
+                                self.llm_router.report_error(llm.alias)  # 对冲、级联模式下路由器已经自己报告过了
+                            continue
+                        answer, tokens = response
+                        self.now_tokens += tokens
+                        _LOGGER.debug(f"llm输出内容为：{answer}")
+                        _LOGGER.debug("调用llm成功，开始处理结果")
+                        task.process_result = answer
+                        task.process_stage = ProcessStages.WAITING_SEND
+                        self.task_status_recorder.update_record(_item_uuid, task)
+                    if task.process_stage in (
+                        ProcessStages.WAITING_SEND,
+                        ProcessStages.WAITING_RETRY,
+                    ):
+                        begin_time = time.perf_counter()
+                        answer = task.process_result
+                        # obj, _type = await video.get_video_obj()
+                        # 处理结果
+                        if answer:
+                            try:
+                                if task.process_stage == ProcessStages.WAITING_RETRY:
+                                    raise Exception("触发重试")
+
+                                parsed = self._parse_answer(answer)  # 先在本地修复，修不好再交给LLM重试
+                                if parsed is None:
+                                    raise Exception("ai返回内容本地修复失败")
+                                task.process_result = parsed
+                                if task.process_result.if_no_need_summary is True:
+                                    _LOGGER.warning(f"视频{format_video_name}被ai判定为不需要摘要，跳过处理")
+                                    if task.source_type != "prefetch":
+                                        await BiliSession.quick_send(
+                                            self.credential,
+                                            task,
+                                            "AI觉得你的视频不需要处理，换个更有意义的视频再试试看吧！",
+                                            self.governor,
+                                        )
+                                    # await BiliSession.quick_send(
+                                    #     self.credential, task, answer
+                                    # )
+                                    await self._set_noneed_end(task)
+                                    continue
+                                _LOGGER.info(
+                                    f"ai返回内容解析正确，视频{format_video_name}摘要处理完成，共用时{time.perf_counter() - begin_time}s"
+                                )
+                                await self.finish(task)
+
+                            except Exception as e:
+                                _LOGGER.error(f"处理结果失败：{e}，大概是ai返回的格式不对，尝试修复")
+                                traceback.print_tb(e.__traceback__)
+                                self.task_status_recorder.update_record(
+                                    _item_uuid,
+                                    new_task_data=task,
+                                    process_stage=ProcessStages.WAITING_RETRY,
+                                )
+                                await self.retry(
+                                    answer,
+                                    task,
+                                    format_video_name,
+                                    begin_time,
+                                    video_info,
+                                )
         except asyncio.CancelledError:
             _LOGGER.info("收到关闭信号，摘要处理链关闭")
 
+    @staticmethod
+    def _parse_answer(answer: str, record_stats: bool = True) -> SummarizeAiResponse | None:
+        """尝试把ai返回的内容解析为SummarizeAiResponse（格式有小毛病会先在本地修复），失败返回None"""
+        return parse_llm_json(answer, SummarizeAiResponse, record_stats)
+
+    def _is_confident(self, answer: str) -> bool:
+        """级联调用时判断便宜模型的结果能不能直接用：评分低于阈值就升级，评分不是数字的没法判断，直接用"""
+        parsed = self._parse_answer(answer, record_stats=False)
+        try:
+            return float(parsed.score) >= self.config.llm_settings.cascade.min_score
+        except (AttributeError, ValueError):
+            return True
+
     async def retry(self, ai_answer, task: BiliGPTTask, format_video_name, begin_time, video_info):
         """通过重试prompt让chatgpt重新构建json
 
@@ -234,7 +292,11 @@ class Summarize(BaseChain):
             self.stop_event.set()
             return False
         prompt = llm.use_template(Templates.SUMMARIZE_RETRY, input=ai_answer)
-        response = await llm.completion(prompt)
+        response = await llm.completion(
+            prompt,
+            cache_validator=lambda _answer: self._parse_answer(_answer, record_stats=False) is not None,
+            **llm.structured_params(SummarizeAiResponse),
+        )
         if response is None:
             _LOGGER.warning(f"视频{format_video_name}摘要生成失败，请自行检查问题，跳过处理")
             await self._set_err_end(
@@ -248,9 +310,10 @@ class Summarize(BaseChain):
         self.now_tokens += tokens
         if answer:
             try:
-                resp = yaml.safe_load(answer)
-                resp["score"] = str(resp["score"])
-                task.process_result = SummarizeAiResponse.model_validate(resp)
+                parsed = self._parse_answer(answer)
+                if parsed is None:
+                    raise Exception("重试后ai返回内容依旧无法解析")
+                task.process_result = parsed
                 if task.process_result.if_no_need_summary is True:
                     _LOGGER.warning(f"视频{format_video_name}被ai判定为不需要摘要，跳过处理")
                     await self._set_noneed_end(task)
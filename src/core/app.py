@@ -7,15 +7,23 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from injector import Module, provider, singleton
 
 from src.bilibili.bili_credential import BiliCredential
+from src.bilibili.bili_http import BiliHttp
+from src.bilibili.rate_governor import RateGovernor
 from src.core.routers.asr_router import ASRouter
 from src.core.routers.chain_router import ChainRouter
 from src.core.routers.llm_router import LLMRouter
 from src.models.config import Config
 from src.utils.cache import Cache
+from src.utils.completion_cache import CompletionCache
+from src.utils.durable_queue import DurableQueue
 from src.utils.exceptions import ConfigError
+from src.utils.leader_lease import LeaderLease
 from src.utils.logging import LOGGER
+from src.utils.question_cache import QuestionCache
 from src.utils.queue_manager import QueueManager
+from src.utils.subtitle_cache import SubtitleCache
 from src.utils.task_status_record import TaskStatusRecorder
+from src.utils.transcript_index import TranscriptIndex
 
 _LOGGER = LOGGER.bind(name="app")
 
@@ -58,25 +66,81 @@ class BiliGPT(Module):
 
     @singleton
     @provider
-    def provide_queue_manager(self) -> QueueManager:
-        _LOGGER.info("正在初始化队列管理器")
-        return QueueManager()
+    def provide_queue_manager(self, config: Config) -> QueueManager:
+        _LOGGER.info(f"正在初始化队列管理器，位置：{config.storage_settings.queue_db}")
+        return QueueManager(
+            config.storage_settings.queue_db,
+            config.queue_settings.visibility_timeout,
+            config.queue_settings.max_attempts,
+            config.queue_settings.priorities,
+            config.queue_settings.aging_interval,
+        )
+
+    @singleton
+    @provider
+    def provide_leader_lease(self, config: Config) -> LeaderLease:
+        _LOGGER.info("正在初始化主节点租约")
+        return LeaderLease(config.storage_settings.queue_db, config.queue_settings.leader_lease_ttl)
 
     @singleton
     @provider
     def provide_task_status_recorder(self, config: Config) -> TaskStatusRecorder:
-        _LOGGER.info(f"正在初始化任务状态管理器，位置：{config.storage_settings.task_status_records}")
-        return TaskStatusRecorder(config.storage_settings.task_status_records)
+        _LOGGER.info(f"正在初始化任务状态管理器，位置：{config.storage_settings.task_status_db}")
+        return TaskStatusRecorder(config.storage_settings.task_status_db, config.storage_settings.task_status_records)
 
     @singleton
     @provider
     def provide_cache(self, config: Config) -> Cache:
-        _LOGGER.info(f"正在初始化缓存，缓存路径为：{config.storage_settings.cache_path}")
-        return Cache(config.storage_settings.cache_path)
+        _LOGGER.info(f"正在初始化缓存，缓存路径为：{config.storage_settings.cache_db}")
+        return Cache(config.storage_settings.cache_db, config.storage_settings.cache_path)
+
+    @singleton
+    @provider
+    def provide_subtitle_cache(self, config: Config) -> SubtitleCache:
+        _LOGGER.info(f"正在初始化字幕缓存，位置：{config.storage_settings.subtitle_cache_db}")
+        settings = config.prefetch_settings
+        return SubtitleCache(
+            config.storage_settings.subtitle_cache_db,
+            ttl=int(settings.subtitle_cache_ttl_hours * 3600),
+            max_entries=settings.subtitle_cache_max_entries,
+        )
 
     @singleton
     @provider
-    def provide_credential(self, config: Config, scheduler: AsyncIOScheduler) -> BiliCredential:
+    def provide_completion_cache(self, config: Config) -> CompletionCache:
+        _LOGGER.info(f"正在初始化LLM调用缓存，缓存路径为：{config.storage_settings.completion_cache}")
+        settings = config.llm_settings.completion_cache
+        return CompletionCache(
+            config.storage_settings.completion_cache,
+            ttl=int(settings.ttl_hours * 3600),
+            max_entries=settings.max_entries,
+        )
+
+    @singleton
+    @provider
+    def provide_question_cache(self, config: Config) -> QuestionCache:
+        _LOGGER.info("正在初始化AskAI相似问题缓存")
+        settings = config.llm_settings.question_cache
+        return QuestionCache(
+            threshold=settings.threshold,
+            max_videos=settings.max_videos,
+            max_questions_per_video=settings.max_questions_per_video,
+        )
+
+    @singleton
+    @provider
+    def provide_transcript_index(self, config: Config) -> TranscriptIndex:
+        _LOGGER.info("正在初始化AskAI字幕检索索引")
+        settings = config.transcript_settings
+        return TranscriptIndex(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            max_videos=settings.index_max_videos,
+        )
+
+    @singleton
+    @provider
+    def provide_credential(self, config: Config, scheduler: AsyncIOScheduler, leader: LeaderLease) -> BiliCredential:
         _LOGGER.info("正在初始化cookie")
         return BiliCredential(
             SESSDATA=config.bilibili_cookie.SESSDATA,
@@ -85,8 +149,29 @@ class BiliGPT(Module):
             buvid3=config.bilibili_cookie.buvid3,
             ac_time_value=config.bilibili_cookie.ac_time_value,
             sched=scheduler,
+            db_path=config.storage_settings.queue_db,  # 和主节点租约放在同一个所有进程共用的库里
+            leader=leader,
         )
 
+    @singleton
+    @provider
+    def provide_bili_http(self, config: Config) -> BiliHttp:
+        _LOGGER.info("正在初始化b站共享http会话")
+        settings = config.bilibili_settings
+        return BiliHttp(
+            http2=settings.http2,
+            max_connections=settings.max_connections,
+            timeout=settings.request_timeout,
+            max_retries=settings.max_retries,
+            retry_budget_ratio=settings.retry_budget_ratio,
+        )
+
+    @singleton
+    @provider
+    def provide_rate_governor(self) -> RateGovernor:
+        _LOGGER.info("正在初始化b站接口限速器")
+        return RateGovernor()
+
     @singleton
     @provider
     def provide_asr_router(self, config: Config, llm_router: LLMRouter) -> ASRouter:
@@ -97,9 +182,9 @@ class BiliGPT(Module):
 
     @singleton
     @provider
-    def provide_llm_router(self, config: Config) -> LLMRouter:
+    def provide_llm_router(self, config: Config, completion_cache: CompletionCache) -> LLMRouter:
         _LOGGER.info("正在初始化LLM路由器")
-        router = LLMRouter(config)
+        router = LLMRouter(config, completion_cache)
         router.load_from_dir()
         return router
 
@@ -117,7 +202,7 @@ class BiliGPT(Module):
         return AsyncIOScheduler(timezone="Asia/Shanghai")
 
     @provider
-    def provide_queue(self, queue_manager: QueueManager, queue_name: str) -> asyncio.Queue:
+    def provide_queue(self, queue_manager: QueueManager, queue_name: str) -> DurableQueue:
         _LOGGER.info(f"正在初始化队列 {queue_name}")
         return queue_manager.get_queue(queue_name)
 
@@ -1,7 +1,6 @@
 import inspect
 import os
 import traceback
-from typing import Optional
 
 from injector import inject
 
@@ -9,6 +8,7 @@ from src.asr.asr_base import ASRBase
 from src.core.routers.llm_router import LLMRouter
 from src.models.config import Config
 from src.utils.logging import LOGGER
+from src.utils.rate_limiter import ProviderLimiter
 
 _LOGGER = LOGGER.bind(name="ASR-Router")
 
@@ -51,6 +51,12 @@ class ASRouter:
             enabled = _config["enable"]
             if priority is None or enabled is None:
                 raise ValueError
+            _asr.limiter = ProviderLimiter(
+                _asr.alias,
+                rpm=_config.get("rpm", 0),
+                tpm=_config.get("tpm", 0),
+                max_concurrency=_config.get("max_concurrency", 0),
+            )
             # 设置属性
             self.asr_dict[_asr.alias] = {
                 "priority": priority,
@@ -98,7 +104,7 @@ class ASRouter:
             )
         )
 
-    def get_one(self) -> Optional[ASRBase]:
+    def get_one(self) -> ASRBase | None:
         """根据优先级获取一个可用的ASR子类，如果所有都不可用则返回None"""
         self.order()
         for asr in self.asr_dict.values():
@@ -4,6 +4,7 @@ from injector import inject
 
 from src.models.config import Config
 from src.models.task import AskAICommandParams, BiliGPTTask, Chains
+from src.utils.durable_queue import DurableQueue
 from src.utils.logging import LOGGER
 from src.utils.queue_manager import QueueManager
 
@@ -23,6 +24,20 @@ class ChainRouter:
         self.summarize_queue = self.queue_manager.get_queue("summarize")
         self.ask_ai_queue = self.queue_manager.get_queue("ask_ai")
 
+    async def _admit(self, task: BiliGPTTask, queue: DurableQueue) -> bool:
+        """准入控制：预计排队时间太长时不再接这个任务，并告诉用户晚点再来"""
+        wait = queue.projected_wait(task.source_type)
+        if wait <= self.config.queue_settings.admission_max_wait:
+            return True
+        _LOGGER.warning(f"任务{task.uuid}：{queue.name}队列预计要排队{wait:.0f}秒，超过上限，拒绝该任务")
+        task.process_result = f"现在排队的任务太多了（预计要等{wait / 60:.0f}分钟），这次先不处理了，晚点再来找我吧~"
+        match task.source_type:
+            case "bili_comment":
+                await self.queue_manager.get_queue("reply").put(task)
+            case "bili_private":
+                await self.queue_manager.get_queue("private").put(task)
+        return False
+
     async def dispatch_a_task(self, task: BiliGPTTask):
         content: str = task.source_command
         _LOGGER.info(f"开始处理消息，原始消息内容为：{content}")
@@ -35,7 +50,8 @@ class ChainRouter:
                 _LOGGER.info(f"检测到关键字 {keyword} ，放入【总结】队列")
                 task.chain = Chains.SUMMARIZE
                 _LOGGER.debug(task)
-                await self.summarize_queue.put(task)
+                if await self._admit(task, self.summarize_queue):
+                    await self.summarize_queue.put(task)
                 return
             case content if any(keyword in content for keyword in ask_ai_keyword):
                 keyword = next(keyword for keyword in ask_ai_keyword if keyword in content)
@@ -49,7 +65,8 @@ class ChainRouter:
                     return
                 task.chain = Chains.ASK_AI
                 _LOGGER.debug(task)
-                await self.ask_ai_queue.put(task)
+                if await self._admit(task, self.ask_ai_queue):
+                    await self.ask_ai_queue.put(task)
                 return
             case _:
                 _LOGGER.debug("没有检测到关键字，跳过")
@@ -1,13 +1,22 @@
+import asyncio
+import datetime
 import inspect
 import os
+import time
 import traceback
-from typing import Optional
+from collections import deque
+from collections.abc import Callable
 
 from injector import inject
+from pydantic import BaseModel
 
 from src.llm.llm_base import LLMBase
+from src.llm.templates import Templates
 from src.models.config import Config
+from src.models.task import LLMUsage
+from src.utils.completion_cache import CompletionCache
 from src.utils.logging import LOGGER
+from src.utils.rate_limiter import ProviderLimiter
 
 _LOGGER = LOGGER.bind(name="LLM-Router")
 
@@ -16,10 +25,14 @@ class LLMRouter:
     """LLM路由器，用于加载所有LLM子类并进行合理路由"""
 
     @inject
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, completion_cache: CompletionCache = None):
         self.config = config
+        self.completion_cache = completion_cache
         self._llm_dict = {}
         self.max_err_times = 10  # TODO i know i know，硬编码很不优雅，但这种选项开放给用户似乎也没必要
+        self._latency_history: dict[str, deque] = {}  # 每个LLM最近若干次成功调用的耗时，用于计算对冲等待时间
+        self._hedge_day = None
+        self._hedge_used = 0
 
     def load_from_dir(self, py_style_path: str = "src.llm"):
         """
@@ -49,12 +62,21 @@ class LLMRouter:
             enabled = _config["enable"]
             if priority is None or enabled is None:
                 raise ValueError
+            _asr.limiter = ProviderLimiter(
+                _asr.alias,
+                rpm=_config.get("rpm", 0),
+                tpm=_config.get("tpm", 0),
+                max_concurrency=_config.get("max_concurrency", 0),
+            )
+            if self.completion_cache is not None and self.config.llm_settings.completion_cache.enable:
+                _asr.completion_cache = self.completion_cache
             # 设置属性
             self.llm_dict[_asr.alias] = {
                 "priority": priority,
                 "enabled": enabled,
                 "prepared": False,
                 "err_times": 0,
+                "tier": _config.get("tier", 0),
                 "obj": self.get(_asr.alias),
             }
         except Exception as e:
@@ -96,17 +118,207 @@ class LLMRouter:
             )
         )
 
-    def get_one(self) -> Optional[LLMBase]:
-        """根据优先级获取一个可用的LLM子类，如果所有都不可用则返回None"""
+    def get_one(self, tier: int = None) -> LLMBase | None:
+        """根据优先级获取一个可用的LLM子类（指定tier时只在这一档里选），如果所有都不可用则返回None"""
+        available = self.get_available()
+        if tier is not None:
+            available = [llm for llm in available if self.tier_of(llm) == tier]
+        return available[0] if available else None
+
+    def tier_of(self, llm: LLMBase) -> int:
+        """获取LLM的档次"""
+        return self.llm_dict[llm.alias].get("tier", 0)
+
+    def tiers(self) -> list[int]:
+        """当前有可用LLM的所有档次，从便宜到强排序"""
+        return sorted({self.tier_of(llm) for llm in self.get_available()})
+
+    def get_available(self) -> list[LLMBase]:
+        """按优先级返回所有可用的LLM子类（会顺便初始化还没初始化的）"""
         self.order()
+        available = []
         for llm in self.llm_dict.values():
             if llm["enabled"] and llm["err_times"] <= 10:
                 if not llm["prepared"]:
                     _LOGGER.info(f"正在初始化 {llm['obj'].alias}")
                     llm["obj"].prepare()
                     llm["prepared"] = True
-                return llm["obj"]
-        return None
+                available.append(llm["obj"])
+        return available
+
+    def record_latency(self, name: str, seconds: float):
+        """记录一次成功调用的耗时"""
+        self._latency_history.setdefault(name, deque(maxlen=100)).append(seconds)
+
+    def _hedge_delay(self, name: str) -> float:
+        """根据该LLM的历史耗时分位数计算发起对冲前要等待多久"""
+        hedge = self.config.llm_settings.hedge
+        history = sorted(self._latency_history.get(name, ()))
+        if len(history) < 5:
+            delay = hedge.default_delay
+        else:
+            delay = history[min(len(history) - 1, int(len(history) * hedge.percentile))]
+        return min(max(delay, hedge.min_delay), hedge.max_delay)
+
+    def _take_hedge_budget(self) -> bool:
+        """消耗一次当天的对冲预算，预算用完返回False"""
+        today = datetime.date.today()
+        if self._hedge_day != today:
+            self._hedge_day = today
+            self._hedge_used = 0
+        if self._hedge_used >= self.config.llm_settings.hedge.daily_budget:
+            return False
+        self._hedge_used += 1
+        return True
+
+    async def hedged_completion(
+        self,
+        user_template: Templates,
+        system_template: Templates = None,
+        validator: Callable[[str], bool] = None,
+        schema: type[BaseModel] = None,
+        **kwargs,
+    ) -> tuple[str, int] | None:
+        """
+        带对冲的completion：先请求优先级最高的LLM，超过其历史耗时分位数还没返回，就把同一个prompt发给下一个LLM，
+        最先返回合法结果的胜出，其余请求直接取消（已经预扣的TPM额度不退回，对冲请求照样算进预算）。出错的LLM会被自动report_error，并立即换下一个顶上
+
+        :param user_template: 用户模板
+        :param system_template: 系统模板
+        :param validator: 校验LLM返回内容是否合法，不合法的结果只有在没有其他结果时才会被采用
+        :param schema: 期望的返回结构，支持结构化输出的LLM会直接按这个结构返回
+        :param kwargs: 模板参数
+        :return: 和LLMBase.completion一样，返回生成的文本和token总数 或 None
+        """
+        backups = self.get_available()
+        if not backups:
+            return None
+        running: dict[asyncio.Task, tuple[LLMBase, float]] = {}
+        fallback = None
+
+        def launch():
+            llm = backups.pop(0)
+            prompt = llm.use_template(user_template, system_template, **kwargs)
+            structured = llm.structured_params(schema) if schema else {}
+            running[asyncio.create_task(llm.completion(prompt, cache_validator=validator, **structured))] = (
+                llm,
+                time.perf_counter(),
+            )
+
+        launch()
+        try:
+            while running:
+                timeout = None
+                if backups and self.config.llm_settings.hedge.enable:
+                    last_llm, last_start = list(running.values())[-1]
+                    timeout = max(0.0, last_start + self._hedge_delay(last_llm.alias) - time.perf_counter())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if self._take_hedge_budget():
+                        _LOGGER.info(
+                            f"{list(running.values())[-1][0].alias} 迟迟没有返回，向 {backups[0].alias} 发起对冲请求"
+                        )
+                        launch()
+                    else:
+                        _LOGGER.warning("今日对冲预算已用完，继续等待当前请求")
+                        backups.clear()
+                    continue
+                for finished in done:
+                    llm, start = running.pop(finished)
+                    response = None if finished.exception() else finished.result()
+                    if response is None:
+                        self.report_error(llm.alias)
+                        if not running and backups:
+                            launch()
+                        continue
+                    self.record_latency(llm.alias, time.perf_counter() - start)
+                    if validator is None or validator(response[0]):
+                        _LOGGER.info(f"{llm.alias} 最先返回合法结果，用时{time.perf_counter() - start:.2f}s")
+                        return response
+                    _LOGGER.warning(f"{llm.alias} 返回的结果不合法，继续等待其他LLM")
+                    fallback = fallback or response
+                    if not running and backups:
+                        launch()
+            return fallback
+        finally:
+            # 输掉的请求取消掉并等它们真正结束：异步的LLM会断开连接，限流器的并发名额也要等它们退出后才归还
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def cascade_completion(
+        self,
+        user_template: Templates,
+        system_template: Templates = None,
+        validator: Callable[[str], bool] = None,
+        accept: Callable[[str], bool] = None,
+        schema: type[BaseModel] = None,
+        skip_cheap: bool = False,
+        usage: list[LLMUsage] = None,
+        **kwargs,
+    ) -> tuple[str, int] | None:
+        """
+        级联调用：先请求最便宜一档里优先级最高的LLM，结果不合法或者质量不够时升级到更强的一档，直到最强的一档
+
+        :param user_template: 用户模板
+        :param system_template: 系统模板
+        :param validator: 校验LLM返回内容是否合法，不合法就升级
+        :param accept: 合法的结果是否可以直接采用（比如模型自己给的评分够不够高），不采用就升级
+        :param schema: 期望的返回结构，支持结构化输出的LLM会直接按这个结构返回
+        :param skip_cheap: 直接从最强的一档开始（比如字幕太长，便宜的模型处理不好）
+        :param usage: 传入列表的话，每一档调用的token数、耗时和结果会追加进去
+        :param kwargs: 模板参数
+        :return: 和LLMBase.completion一样，返回生成的文本和token总数 或 None。都没通过时返回最后一个合法的结果，
+                 没有合法的结果就返回第一个不合法的结果，交给调用方的重试逻辑处理
+        """
+        tiers = self.tiers()
+        if skip_cheap:
+            tiers = tiers[-1:]
+        fallback = None
+        fallback_valid = False
+        for tier in tiers:
+            llm = self.get_one(tier)
+            if llm is None:  # 这一档的LLM刚好在上一档调用时被禁用了
+                continue
+            prompt = llm.use_template(user_template, system_template, **kwargs)
+            structured = llm.structured_params(schema) if schema else {}
+            start = time.perf_counter()
+            response = await llm.completion(prompt, cache_validator=validator, **structured)
+            latency = time.perf_counter() - start
+            if response is None:
+                self.report_error(llm.alias)
+                outcome = "error"
+            else:
+                self.record_latency(llm.alias, latency)
+                if validator is not None and not validator(response[0]):
+                    outcome = "invalid"
+                elif accept is not None and not accept(response[0]):
+                    outcome = "low_score"
+                else:
+                    outcome = "accepted"
+            if usage is not None:
+                usage.append(
+                    LLMUsage(
+                        tier=tier,
+                        llm=llm.alias,
+                        tokens=response[1] if response else 0,
+                        latency=latency,
+                        outcome=outcome,
+                    )
+                )
+            if outcome == "accepted":
+                _LOGGER.info(f"级联调用：第{tier}档的 {llm.alias} 给出了可以采用的结果，用时{latency:.2f}s")
+                return response
+            if outcome == "low_score" or (outcome == "invalid" and fallback is None):
+                fallback = response
+                fallback_valid = fallback_valid or outcome == "low_score"
+            if tier != tiers[-1]:
+                _LOGGER.info(f"级联调用：第{tier}档的 {llm.alias} 结果为{outcome}，升级到更强的一档")
+        if fallback is not None:
+            _LOGGER.warning(
+                f"级联调用：所有档次都没有给出满意的结果，采用{'合法' if fallback_valid else '不合法'}的结果"
+            )
+        return fallback
 
     def report_error(self, name: str):
         """报告一个LLM子类的错误"""
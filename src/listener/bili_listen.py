@@ -1,7 +1,9 @@
 """监听bilibili平台的私信、at消息"""
 
 import asyncio
+import json
 import os
+import random
 import re
 import time
 import traceback
@@ -14,12 +16,17 @@ from injector import inject
 
 from src.bilibili.bili_credential import BiliCredential
 from src.bilibili.bili_video import BiliVideo
+from src.bilibili.rate_governor import RateGovernor
 from src.core.routers.chain_router import ChainRouter
+from src.listener.prefetcher import Prefetcher
+from src.listener.up_schedule import HISTORY_SIZE, UpSchedule, merge_pubtimes
 from src.models.config import Config
 from src.models.task import BiliAtSpecialAttributes, BiliGPTTask
+from src.utils.file_tools import read_file, save_file
+from src.utils.leader_lease import LeaderLease
 from src.utils.logging import LOGGER
 from src.utils.queue_manager import QueueManager
-from src.utils.up_video_cache import get_up_file, load_cache, set_cache
+from src.utils.up_video_cache import get_up_file, load_cache, save_cache
 
 _LOGGER = LOGGER.bind(name="bilibili-listener")
 
@@ -34,12 +41,20 @@ class Listen:
         config: Config,
         schedule: AsyncIOScheduler,
         chain_router: ChainRouter,
+        governor: RateGovernor,
+        leader: LeaderLease,
+        prefetcher: Prefetcher,
     ):
         self.sess = None
+        self.prefetcher = prefetcher
+        self.governor = governor
+        self.leader = leader
+        self._leading = False
         self.credential = credential
         self.summarize_queue = queue_manager.get_queue("summarize")
         self.evaluate_queue = queue_manager.get_queue("evaluate")
-        self.last_at_time = int(time.time())  # 当前时间作为初始时间戳
+        self.at_cursor = self._load_at_cursor()  # 已经处理到的at消息位置(at_time, id)，持久化保存，重启后不会漏
+        self.at_interval = 20.0  # at消息轮询间隔（秒），会根据消息量自动调整
         self.sched = schedule
         self.user_sessions = {}  # 存储用户状态和视频信息
         self.config = config
@@ -50,47 +65,99 @@ class Listen:
         self.chain_router = chain_router
         self.uids = {}
         self.video_cache = {}
+        settings = config.bilibili_settings
+        self.up_schedule = UpSchedule(
+            default_interval=settings.up_default_interval * 60,
+            min_interval=settings.up_min_interval * 60,
+            max_interval=settings.up_max_interval * 60,
+            budget_per_hour=settings.up_poll_budget,
+            tick=settings.up_schedule_tick * 60,
+        )
+
+    def _load_at_cursor(self) -> tuple[int, int]:
+        """读取已处理到的at消息位置(at_time, id)，没有记录时从当前时间开始，不处理以前的消息"""
+        try:
+            content = read_file(self.config.storage_settings.at_cursor)
+            if content:
+                cursor = json.loads(content)
+                return cursor["at_time"], cursor["id"]
+        except Exception:
+            traceback.print_exc()
+            _LOGGER.error("读取at消息游标失败，从当前时间开始拉取")
+        return int(time.time()), 0
+
+    def _save_at_cursor(self):
+        at_time, _id = self.at_cursor
+        save_file(json.dumps({"at_time": at_time, "id": _id}), self.config.storage_settings.at_cursor)
+
+    def _is_leader(self) -> bool:
+        """多副本运行时只有主节点轮询b站；刚成为主节点时重新读取at消息游标，之前的主节点可能已经往前处理了"""
+        if not self.leader.is_leader:
+            self._leading = False
+            return False
+        if not self._leading:
+            self.at_cursor = self._load_at_cursor()
+            self._leading = True
+        return True
+
+    async def _fetch_at_page(self, last_id: int = None, at_time: int = None) -> dict:
+        await self.governor.acquire("at")
+        try:
+            data: dict = await session.get_at(self.credential, last_uid=last_id, at_time=at_time)
+        except Exception as e:
+            self.governor.report_exception("at", e)
+            raise
+        self.governor.success("at")
+        return data
 
     async def listen_at(self):
-        # global run_time
-        data: dict = await session.get_at(self.credential)
-        _LOGGER.debug(f"获取at消息成功，内容为：{data}")
-
-        # if len(data["items"]) != 0:
-        #     if run_time > 2:
-        #         return
-        #     _LOGGER.warning(f"目前处于debug状态，将直接处理第一条at消息")
-        #     await self.dispatch_task(data["items"][0])
-        #     run_time += 1
-        #     return
-
-        # 判断是否有新消息
-        if len(data["items"]) == 0:
-            _LOGGER.debug("没有新消息，返回")
-            return
-        if self.last_at_time >= data["items"][0]["at_time"]:
-            _LOGGER.debug(
-                f"last_at_time{self.last_at_time}大于或等于当前最新消息的at_time{data['items'][0]['at_time']}，返回"
-            )
+        """从最新的at消息开始往前翻页，直到遇到已经处理过的位置，保证一次性来很多at也不会漏"""
+        if not self._is_leader():
             return
-
+        settings = self.config.bilibili_settings
         new_items = []
-        for item in reversed(data["items"]):
-            if item["at_time"] > self.last_at_time:
-                _LOGGER.debug(f"at_time{item['at_time']}大于last_at_time{self.last_at_time}，放入新消息队列")
-                # item["user"] = data["items"]["user"]
+        last_id = at_time = None  # 从最新的一页开始
+        for _ in range(settings.at_max_pages):
+            data = await self._fetch_at_page(last_id, at_time)
+            _LOGGER.debug(f"获取at消息成功，内容为：{data}")
+            reached = False
+            for item in data["items"]:
+                if (item["at_time"], item["id"]) <= self.at_cursor:
+                    reached = True
+                    break
                 new_items.append(item)
+            cursor = data.get("cursor") or {}
+            if reached or cursor.get("is_end", True) or not data["items"]:
+                break
+            _LOGGER.debug(f"这一页的at消息都是新的，继续往前翻页，游标为{cursor}")
+            last_id, at_time = cursor["id"], cursor["time"]
+        else:
+            _LOGGER.warning(f"已经往前翻了{settings.at_max_pages}页，还没翻到上次处理的位置，更早的消息放弃处理")
+
+        self._adjust_at_interval(len(new_items))
         if len(new_items) == 0:
             _LOGGER.debug("没有新消息，返回")
             return
         _LOGGER.info(f"检测到{len(new_items)}条新消息，开始处理")
-        for item in new_items:
+        for item in reversed(new_items):  # 从旧到新处理，每处理一条就推进一次游标
             task_metadata = await self.build_task_from_at_msg(item)
-            if task_metadata is None:
-                continue
-            await self.chain_router.dispatch_a_task(task_metadata)
-
-        self.last_at_time = data["items"][0]["at_time"]
+            if task_metadata is not None:
+                self.prefetcher.note_mention(task_metadata.video_id)
+                await self.chain_router.dispatch_a_task(task_metadata)
+            self.at_cursor = (item["at_time"], item["id"])
+            self._save_at_cursor()
+
+    def _adjust_at_interval(self, new_count: int):
+        """有新消息就缩短轮询间隔，一直没有消息就逐渐放宽"""
+        settings = self.config.bilibili_settings
+        if new_count:
+            interval = max(settings.at_min_interval, self.at_interval / 2)
+        else:
+            interval = min(settings.at_max_interval, self.at_interval * 1.25)
+        if abs(interval - self.at_interval) >= 1:
+            _LOGGER.debug(f"at消息轮询间隔调整为{interval:.0f}秒")
+            self.at_interval = interval
+            self.sched.reschedule_job("listen_at", trigger="interval", seconds=interval)
 
     async def build_task_from_at_msg(self, msg: dict) -> BiliGPTTask | None:
         # print(msg)
@@ -122,67 +189,107 @@ class Listen:
         self.sched.add_job(
             self.listen_at,
             trigger="interval",
-            seconds=20,  # 有新任务都会一次性提交，时间无所谓
+            seconds=self.at_interval,  # 会根据消息量自动调整
             id="listen_at",
-            max_instances=3,
+            max_instances=1,  # 翻页拉取期间不能再启动一个，否则会重复处理
             next_run_time=datetime.now(),
         )
         # self.sched.start()
-        _LOGGER.info("[定时任务]侦听at消息定时任务注册成功， 每20秒检查一次")
+        _LOGGER.info(
+            f"[定时任务]侦听at消息定时任务注册成功， 每{self.at_interval:.0f}秒检查一次（会根据消息量自动调整）"
+        )
 
     def start_video_mission(self):
+        tick = self.config.bilibili_settings.up_schedule_tick
         self.sched.add_job(
             self.async_video_list_mission,
             trigger="interval",
-            minutes=60,  # minutes=60,
+            minutes=tick,
             id="video_list_mission",
-            max_instances=3,
+            max_instances=1,  # 上一轮还没扫完就不开新的一轮，避免重复派发
             next_run_time=datetime.now(),
         )
-        _LOGGER.info("[定时任务]侦听up视频更新任务注册成功， 每60分钟检查一次")
+        _LOGGER.info(f"[定时任务]侦听up视频更新任务注册成功， 每{tick:g}分钟检查一次到期的UP（按各UP投稿频率安排）")
 
     async def async_video_list_mission(self):
-        _LOGGER.info("开始执行获取UP的最新视频")
-        self.video_cache = load_cache(self.config.storage_settings.up_video_cache)
+        """并发检查到期的UP的最新视频，单个UP出错不影响其他UP，实际请求速度由限速器控制"""
+        if not self._is_leader():
+            return
         self.uids = get_up_file(self.config.storage_settings.up_file)
-        for item in self.uids:
+        self.video_cache = load_cache(self.config.storage_settings.up_video_cache) or {}
+        self.up_schedule.restore(self.video_cache)
+        due = self.up_schedule.due(self.uids)
+        if not due:
+            _LOGGER.debug("本轮没有需要检查的UP")
+            return
+        _LOGGER.info(f"开始执行获取UP的最新视频，本轮检查{len(due)}/{len(self.uids)}个UP")
+        begin_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.config.bilibili_settings.up_scan_concurrency)
+        try:
+            results = await asyncio.gather(*(self._check_up_update(item, semaphore) for item in due))
+        finally:
+            # 最新视频、投稿时间记录和调度状态一轮只写一次文件
+            for item in due:
+                self.video_cache.setdefault(str(item["uid"]), {}).update(self.up_schedule.state(item["uid"]))
+            save_cache(self.config.storage_settings.up_video_cache, self.video_cache)
+        _LOGGER.info(
+            f"UP视频更新检查完成，共{len(due)}个UP，其中{results.count(True)}个有更新，"
+            f"{results.count(None)}个检查失败，用时{time.perf_counter() - begin_time:.1f}秒"
+        )
+
+    async def _check_up_update(self, item: dict, semaphore: asyncio.Semaphore) -> bool | None:
+        """
+        检查单个UP有没有更新视频，有的话派发任务
+
+        :return: 有更新返回True，没有更新返回False，出错返回None
+        """
+        # 随机错开每个UP的检查时间，避免每轮检查的请求都挤在同一时刻
+        uid = str(item["uid"])
+        cached = self.video_cache.get(uid, {})
+        pubtimes = cached.get("pubtimes", [])
+        # 投稿时间记录不够时多拉几条视频，用来估计这个UP的投稿频率
+        page_size = 1 if len(pubtimes) >= 3 else HISTORY_SIZE
+        await asyncio.sleep(random.uniform(0, self.config.bilibili_settings.up_scan_jitter))
+        async with semaphore:
             u = user.User(uid=item["uid"])
+            await self.governor.acquire("up_video_list")
             try:
-                media_list = await u.get_media_list(ps=1, desc=True)
-            except Exception:
+                media_list = await u.get_media_list(ps=page_size, desc=True)
+            except Exception as e:
+                self.governor.report_exception("up_video_list", e)
+                self.up_schedule.retry_later(uid)
                 traceback.print_exc()
                 _LOGGER.error(f"在获取 uid{item} 的视频列表时出错！")
                 return None
-            media = media_list["media_list"][0]
-            bv_id = media["bv_id"]
-            _LOGGER.info(f"当前视频的bvid：{bv_id}")
-            oid = media["id"]
-            _LOGGER.info(f"当前视频的oid：{oid}")
-            if str(item["uid"]) in self.video_cache:
-                cache_bvid = self.video_cache[str(item["uid"])]["bv_id"]
-                _LOGGER.info(f"缓存文件中的bvid：{cache_bvid}")
-                if cache_bvid != bv_id:
-                    _LOGGER.info(f"up有视频更新，视频信息为：\n 作者：{item['username']} 标题：{media['title']}")
-                    # 将视频信息传递给消息队列
-                    task_metadata = await self.build_task_from_at_mission(media)
-                    if task_metadata is None:
-                        continue
-                    await self.chain_router.dispatch_a_task(task_metadata)
-                    set_cache(
-                        self.config.storage_settings.up_video_cache,
-                        self.video_cache,
-                        {"bv_id": bv_id, "oid": oid},
-                        str(item["uid"]),
-                    )
-
-                else:
-                    _LOGGER.info("up没有视频更新")
-
-            else:
-                _LOGGER.info("缓存文件为空，第一次写入数据")
-                # self.set_cache({'bv_id': media, 'oid': oid}, str(item['uid']))
-            _LOGGER.info("休息20秒")
-            await asyncio.sleep(20)
+            self.governor.success("up_video_list")
+        if not media_list.get("media_list"):
+            _LOGGER.debug(f"uid{item['uid']}还没有投稿视频")
+            self.up_schedule.record(uid, pubtimes)
+            return False
+        media = media_list["media_list"][0]
+        bv_id = media["bv_id"]
+        oid = media["id"]
+        new_pubtimes = merge_pubtimes(pubtimes, [m["pubtime"] for m in media_list["media_list"] if m.get("pubtime")])
+        self.up_schedule.record(uid, new_pubtimes)
+        entry = {"bv_id": bv_id, "oid": oid, "pubtimes": new_pubtimes}
+        _LOGGER.debug(f"uid{item['uid']}当前最新视频的bvid：{bv_id}，oid：{oid}")
+        if "bv_id" not in cached:
+            _LOGGER.info(f"缓存中没有uid{item['uid']}的记录，第一次写入数据")
+            self.video_cache[uid] = entry
+            return False
+        if cached["bv_id"] == bv_id:
+            _LOGGER.debug(f"uid{item['uid']}没有视频更新")
+            self.video_cache[uid] = entry  # 旧版本缓存没有投稿时间记录，顺便补上
+            return False
+        _LOGGER.info(f"up有视频更新，视频信息为：\n 作者：{item['username']} 标题：{media['title']}")
+        # 将视频信息传递给消息队列
+        task_metadata = await self.build_task_from_at_mission(media)
+        if task_metadata is None:
+            self.up_schedule.retry_later(uid)
+            return None
+        await self.chain_router.dispatch_a_task(task_metadata)
+        self.video_cache[uid] = entry
+        return True
 
     async def build_task_from_at_mission(self, msg: dict) -> BiliGPTTask | None:
         # print(msg)
@@ -0,0 +1,159 @@
+"""预取：总结、问答队列空着的时候，提前总结可能会被问到的视频（顺便把字幕转写好），用户来问时直接命中缓存"""
+
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bilibili_api import hot
+from injector import inject
+
+from src.bilibili.rate_governor import RateGovernor
+from src.models.config import Config
+from src.models.task import BiliGPTTask, Chains
+from src.utils.cache import Cache
+from src.utils.leader_lease import LeaderLease
+from src.utils.logging import LOGGER
+from src.utils.queue_manager import QueueManager
+from src.utils.up_video_cache import load_cache
+
+_LOGGER = LOGGER.bind(name="prefetcher")
+
+RETRY_AFTER = 86400  # 预取过但没有写入缓存（出错、AI觉得不需要总结）的视频多久以后才再试（秒）
+
+
+class Prefetcher:
+    @inject
+    def __init__(
+        self,
+        config: Config,
+        queue_manager: QueueManager,
+        cache: Cache,
+        governor: RateGovernor,
+        leader: LeaderLease,
+        schedule: AsyncIOScheduler,
+    ):
+        self.config = config
+        self.settings = config.prefetch_settings
+        self.summarize_queue = queue_manager.get_queue("summarize")
+        self.ask_ai_queue = queue_manager.get_queue("ask_ai")
+        self.cache = cache
+        self.governor = governor
+        self.leader = leader
+        self.sched = schedule
+        self._mentions: dict[str, deque[float]] = {}  # bvid -> 窗口内每次被at的时间
+        self._tried: dict[str, float] = {}  # bvid -> 上次放入预取任务的时间
+
+    def start(self):
+        self.sched.add_job(
+            self.prefetch,
+            trigger="interval",
+            minutes=self.settings.interval,
+            id="prefetch",
+            max_instances=1,
+            next_run_time=datetime.now(),
+        )
+        _LOGGER.info(
+            f"[定时任务]预取任务注册成功，每{self.settings.interval:g}分钟检查一次，预取来源：{self.settings.feeds}"
+        )
+
+    def note_mention(self, bvid: str):
+        """记一次at，用来发现被at次数突然变多的视频"""
+        if "mentions" not in self.settings.feeds:
+            return
+        now = time.time()
+        self._mentions.setdefault(bvid, deque()).append(now)
+        self._expire_mentions(now)
+
+    def _expire_mentions(self, now: float):
+        deadline = now - self.settings.mention_window
+        for bvid in list(self._mentions):
+            times = self._mentions[bvid]
+            while times and times[0] < deadline:
+                times.popleft()
+            if not times:
+                del self._mentions[bvid]
+
+    def _is_idle(self) -> bool:
+        """总结、问答队列里都没有任务（包括正在处理的）时才算空闲"""
+        return self.summarize_queue.qsize() == 0 and self.ask_ai_queue.qsize() == 0
+
+    def _should_prefetch(self, bvid: str, now: float) -> bool:
+        if self.cache.get_cache(key=bvid, chain=Chains.SUMMARIZE.value) is not None:
+            return False
+        return now - self._tried.get(bvid, 0) > RETRY_AFTER
+
+    def _from_up(self) -> list[str]:
+        """关注的UP的最新视频，最近投稿的排在前面（第一次检查到的UP的最新视频不会触发自动总结，靠这里补上）"""
+        video_cache = load_cache(self.config.storage_settings.up_video_cache) or {}
+        entries = [entry for entry in video_cache.values() if entry.get("bv_id")]
+        entries.sort(key=lambda entry: max(entry.get("pubtimes") or [0]), reverse=True)
+        return [entry["bv_id"] for entry in entries]
+
+    async def _from_popular(self) -> list[str]:
+        """热门视频"""
+        await self.governor.acquire("popular")
+        try:
+            data = await hot.get_hot_videos(ps=self.settings.popular_count)
+        except Exception as e:
+            self.governor.report_exception("popular", e)
+            _LOGGER.error(f"获取热门视频失败：{e}，跳过这个来源")
+            return []
+        self.governor.success("popular")
+        return [item["bvid"] for item in data.get("list", []) if item.get("bvid")]
+
+    def _from_mentions(self) -> list[str]:
+        """窗口内被at次数达到阈值的视频，次数多的排在前面"""
+        self._expire_mentions(time.time())
+        counts = [(len(times), bvid) for bvid, times in self._mentions.items()]
+        return [bvid for count, bvid in sorted(counts, reverse=True) if count >= self.settings.mention_threshold]
+
+    async def _candidates(self, feed: str) -> list[str]:
+        match feed:
+            case "up":
+                return self._from_up()
+            case "popular":
+                return await self._from_popular()
+            case "mentions":
+                return self._from_mentions()
+        return []
+
+    def _build_task(self, bvid: str, feed: str) -> BiliGPTTask:
+        return BiliGPTTask.model_validate(
+            {
+                "source_type": "prefetch",
+                "raw_task_data": {"feed": feed},
+                "sender_id": self.config.bilibili_cookie.dedeuserid,
+                "video_url": f"https://www.bilibili.com/video/{bvid}",
+                "video_id": bvid,
+                "source_command": f"预取（来源：{feed}）",
+                "chain": Chains.SUMMARIZE,
+                "uuid": str(uuid.uuid5(uuid.NAMESPACE_URL, f"prefetch:{bvid}")),  # 同一个视频在队列里只会有一个
+            }
+        )
+
+    async def prefetch(self):
+        """队列空闲时按配置的来源顺序挑几个还没缓存的视频，以最低优先级放进总结队列"""
+        if not self.leader.is_leader:
+            return
+        if not self._is_idle():
+            _LOGGER.debug("处理队列里还有任务，本轮不预取")
+            return
+        now = time.time()
+        self._tried = {bvid: tried_at for bvid, tried_at in self._tried.items() if now - tried_at <= RETRY_AFTER}
+        picked: list[tuple[str, str]] = []
+        for feed in self.settings.feeds:
+            if len(picked) >= self.settings.max_per_round:
+                break
+            for bvid in await self._candidates(feed):
+                if len(picked) >= self.settings.max_per_round:
+                    break
+                if bvid in (p[0] for p in picked) or not self._should_prefetch(bvid, now):
+                    continue
+                picked.append((bvid, feed))
+        for bvid, feed in picked:
+            self._tried[bvid] = now
+            self.summarize_queue.put_nowait(self._build_task(bvid, feed))
+        if picked:
+            _LOGGER.info(f"LLM空闲，放入{len(picked)}个预取任务：{picked}")
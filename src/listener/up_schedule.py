@@ -0,0 +1,111 @@
+"""根据每个UP的历史投稿间隔安排检查频率：勤快的UP多查，常年不更新的UP少查，总请求量不超过预算
+
+每个UP的下次检查时间和检查间隔跟投稿时间记录一起保存在up_video_cache里，重启后接着用，不会全部退回默认间隔
+"""
+
+import random
+import statistics
+import time
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="up-schedule")
+
+HISTORY_SIZE = 10  # 每个UP最多记录多少次投稿时间
+CHECKS_PER_GAP = 4  # 在一个典型投稿间隔内检查几次，越大发现新视频越快，请求也越多
+DORMANT_FACTOR = 3  # 距离上次投稿超过典型间隔的几倍就认为UP进入了休眠期，检查间隔翻倍
+
+
+class UpSchedule:
+    def __init__(
+        self,
+        default_interval: float,
+        min_interval: float,
+        max_interval: float,
+        budget_per_hour: int,
+        tick: float,
+    ):
+        """
+        :param default_interval: 没有足够投稿记录时的检查间隔（秒）
+        :param min_interval: 检查间隔下限（秒）
+        :param max_interval: 检查间隔上限（秒）
+        :param budget_per_hour: 每小时最多检查多少次
+        :param tick: 调度器多久运行一次（秒），用于把每小时预算分摊到每一轮
+        """
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_per_hour = budget_per_hour
+        self.tick = tick
+        self._next_check: dict[str, float] = {}
+        self._interval: dict[str, float] = {}
+
+    def interval_for(self, pubtimes: list[int], now: float = None) -> float:
+        """根据投稿时间记录计算检查间隔"""
+        now = now or time.time()
+        if len(pubtimes) < 2:
+            return self.default_interval
+        ordered = sorted(pubtimes)
+        gaps = [b - a for a, b in zip(ordered, ordered[1:], strict=False) if b > a]
+        if not gaps:
+            return self.default_interval
+        typical_gap = statistics.median(gaps)
+        interval = typical_gap / CHECKS_PER_GAP
+        if now - ordered[-1] > typical_gap * DORMANT_FACTOR:
+            interval *= 2
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def due(self, uids: list[dict], now: float = None) -> list[dict]:
+        """
+        选出这一轮要检查的UP
+
+        :param uids: up.json里的UP列表
+        :return: 到期的UP，按逾期程度排序，数量不超过这一轮的预算
+        """
+        now = now or time.time()
+        for item in uids:
+            uid = str(item["uid"])
+            if uid not in self._next_check:
+                # 第一次见到的UP随机分散到一个默认间隔内，避免启动时一起检查
+                self._next_check[uid] = now + random.uniform(0, min(self.default_interval, self.tick * 2))
+        due = [item for item in uids if self._next_check[str(item["uid"])] <= now]
+        due.sort(key=lambda item: self._overdue(str(item["uid"]), now), reverse=True)
+        budget = max(1, int(self.budget_per_hour * self.tick / 3600))
+        if len(due) > budget:
+            _LOGGER.info(f"本轮有{len(due)}个UP到期，超出预算，只检查最久没查的{budget}个")
+        return due[:budget]
+
+    def _overdue(self, uid: str, now: float) -> float:
+        """逾期了几个检查间隔"""
+        return (now - self._next_check[uid]) / self._interval.get(uid, self.default_interval)
+
+    def restore(self, video_cache: dict):
+        """从up_video_cache里恢复还没加载过的UP的调度状态"""
+        for uid, entry in video_cache.items():
+            if uid not in self._next_check and "next_check" in entry:
+                self._next_check[uid] = entry["next_check"]
+                self._interval[uid] = entry.get("interval", self.default_interval)
+
+    def state(self, uid) -> dict:
+        """UP当前的调度状态，用来保存到up_video_cache"""
+        uid = str(uid)
+        if uid not in self._next_check:
+            return {}
+        return {"next_check": self._next_check[uid], "interval": self._interval.get(uid, self.default_interval)}
+
+    def record(self, uid, pubtimes: list[int], now: float = None):
+        """检查完一个UP后调用，根据它的投稿记录安排下一次检查"""
+        now = now or time.time()
+        interval = self.interval_for(pubtimes, now)
+        self._interval[str(uid)] = interval
+        # 加一点抖动，避免一批UP总是在同一轮被检查
+        self._next_check[str(uid)] = now + interval * random.uniform(0.9, 1.1)
+
+    def retry_later(self, uid, now: float = None):
+        """检查失败，下一轮再试"""
+        self._next_check[str(uid)] = (now or time.time()) + self.tick
+
+
+def merge_pubtimes(old: list[int], new: list[int]) -> list[int]:
+    """合并投稿时间记录，去重并只保留最近的HISTORY_SIZE条"""
+    return sorted(set(old) | set(new))[-HISTORY_SIZE:]
@@ -1,5 +1,4 @@
 import traceback
-from typing import Tuple
 
 import anthropic
 
@@ -16,7 +15,7 @@ class AiproxyClaude(LLMBase):
         mask_key = self.config.LLMs.aiproxy_claude.api_key[:-5] + "*****"
         _LOGGER.info(f"初始化AIProxyClaude，api_key为{mask_key}，api端点为{self.config.LLMs.aiproxy_claude.api_base}")
 
-    async def completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
+    async def completion(self, prompt, **kwargs) -> tuple[str, int] | None:
         """调用claude的Completion API
         :param prompt: 输入的文本（请确保格式化为openai的prompt格式）
         :param kwargs: 其他参数
@@ -1,9 +1,7 @@
-import asyncio
 import traceback
-from functools import partial
-from typing import Tuple
 
 import openai
+from pydantic import BaseModel
 
 from src.llm.llm_base import LLMBase
 from src.utils.logging import LOGGER
@@ -17,20 +15,40 @@ class Openai(LLMBase):
         self.openai.api_base = self.config.LLMs.openai.api_base
         self.openai.api_key = self.config.LLMs.openai.api_key
 
-    def _sync_completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
+    def structured_params(self, schema: type[BaseModel]) -> dict:
+        """开启structured_output后，通过function calling强制模型按schema返回"""
+        if not self.config.LLMs.openai.structured_output:
+            return {}
+        return {
+            "functions": [
+                {
+                    "name": schema.__name__,
+                    "description": "按要求的格式提交结果",
+                    "parameters": schema.model_json_schema(),
+                }
+            ],
+            "function_call": {"name": schema.__name__},
+        }
+
+    async def completion(self, prompt, **kwargs) -> tuple[str, int] | None:
         """调用openai的Completion API
+        用异步接口而不是在线程池里跑同步接口：对冲请求输掉后被取消时，HTTP请求会跟着断开，不会在后台接着跑、接着花token
         :param prompt: 输入的文本（请确保格式化为openai的prompt格式）
         :param kwargs: 其他参数
         :return: 返回生成的文本和token总数 或 None
         """
         try:
             model = self.config.LLMs.openai.model
-            resp = self.openai.ChatCompletion.create(model=model, messages=prompt, **kwargs)
+            resp = await self.openai.ChatCompletion.acreate(model=model, messages=prompt, **kwargs)
             _LOGGER.debug(f"调用openai的Completion API成功，API返回结果为：{resp}")
             _LOGGER.info(
                 f"调用openai的Completion API成功，本次调用中，prompt+response的长度为{resp['usage']['total_tokens']}"
             )
-            resp_msg = resp["choices"][0]["message"]["content"]
+            message = resp["choices"][0]["message"]
+            if message.get("function_call"):
+                # 结构化输出模式下，结果在function_call的参数里
+                return message["function_call"]["arguments"], resp["usage"]["total_tokens"]
+            resp_msg = message["content"]
             if resp_msg.startswith("```json"):
                 resp_msg = resp_msg[7:]
             if resp_msg.endswith("```"):
@@ -43,14 +61,3 @@ class Openai(LLMBase):
             _LOGGER.error(f"调用openai的Completion API失败：{e}")
             traceback.print_tb(e.__traceback__)
             return None
-
-    async def completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
-        """调用openai的Completion API
-        :param prompt: 输入的文本（请确保格式化为openai的prompt格式）
-        :param kwargs: 其他参数
-        :return: 返回生成的文本和token总数 或 None
-        """
-        loop = asyncio.get_event_loop()
-        bound_func = partial(self._sync_completion, prompt, **kwargs)
-        res = await loop.run_in_executor(None, bound_func)
-        return res
@@ -1,14 +1,19 @@
 """llm对接的基础类"""
 
 import abc
+import functools
 import re
 import traceback
-from typing import Tuple
+from collections.abc import Callable
+
+from pydantic import BaseModel
 
 from src.llm.templates import Templates
 from src.models.config import Config
+from src.utils.completion_cache import CompletionCache
 from src.utils.logging import LOGGER
-from src.utils.prompt_utils import build_openai_style_messages, parse_prompt
+from src.utils.prompt_utils import build_openai_style_messages, estimate_tokens, parse_prompt
+from src.utils.rate_limiter import ProviderLimiter
 
 _LOGGER = LOGGER.bind(name="llm_base")
 
@@ -16,9 +21,58 @@ _LOGGER = LOGGER.bind(name="llm_base")
 class LLMBase:
     """实现这个类，即可轻松对接其他的LLM模型"""
 
+    limiter: ProviderLimiter | None = None  # 限流器，由LLM路由器在加载时根据配置注入
+    completion_cache: CompletionCache | None = None  # 调用结果缓存，由LLM路由器在加载时根据配置注入
+
     def __init__(self, config: Config):
         self.config = config
 
+    def __init_subclass__(cls, **kwargs):
+        """子类实现的completion会被自动包上一层，统一处理缓存和限流，插件开发者不需要关心"""
+        super().__init_subclass__(**kwargs)
+        raw_completion = cls.__dict__.get("completion")
+        if raw_completion is None:
+            return
+
+        @functools.wraps(raw_completion)
+        async def completion(self, prompt, **_kwargs):
+            return await self._wrapped_completion(raw_completion, prompt, **_kwargs)
+
+        cls.completion = completion
+
+    async def _wrapped_completion(
+        self, raw_completion, prompt, cache_validator: Callable[[str], bool] = None, **kwargs
+    ) -> tuple[str, int] | None:
+        """
+        所有子类completion的实际入口：先查缓存，没命中再排队等限流额度，最后调用子类的completion
+
+        :param cache_validator: 调用方可以传入，只有通过校验的结果才会被缓存，避免把格式错误的回答缓存下来反复用
+        """
+        cache_key = None
+        if self.completion_cache is not None:
+            cache_key = self.completion_cache.make_key(self.alias, self.model_name, prompt, kwargs)
+            cached = self.completion_cache.get(cache_key)
+            if cached is not None:
+                _LOGGER.info(f"{self.alias}：相同的prompt已经调用过，直接使用缓存结果")
+                return cached
+        if self.limiter is None:
+            response = await raw_completion(self, prompt, **kwargs)
+        else:
+            estimated_tokens = estimate_tokens(prompt)
+            async with self.limiter.limit(estimated_tokens):
+                response = await raw_completion(self, prompt, **kwargs)
+            if response is not None:
+                self.limiter.settle(estimated_tokens, response[1])
+        if response is not None and cache_key is not None and (cache_validator is None or cache_validator(response[0])):
+            self.completion_cache.set(cache_key, *response)
+        return response
+
+    @property
+    def model_name(self) -> str:
+        """当前使用的模型名，默认从self.config.LLMs中与alias同名的配置里读取"""
+        _config = getattr(self.config.LLMs, self.alias, None)
+        return str(getattr(_config, "model", None) or getattr(_config, "domain", ""))
+
     def __new__(cls, *args, **kwargs):
         """将类名转换为alias"""
         instance = super().__new__(cls)
@@ -37,16 +91,26 @@ class LLMBase:
         pass
 
     @abc.abstractmethod
-    async def completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
+    async def completion(self, prompt, **kwargs) -> tuple[str, int] | None:
         """使用LLM生成文本（如果出错的话需要在这里自己捕捉错误并返回None）
         请确保整个过程为 **异步**，否则会阻塞整个程序
+        缓存和限流由基类统一处理，这里只管调用
         :param prompt: 最终的输入文本，确保格式化过
         :param kwargs: 其他参数
         :return: 返回生成的文本和token总数 或 None
         """
         pass
 
-    def _sync_completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
+    def structured_params(self, schema: type[BaseModel]) -> dict:
+        """如果你的LLM支持结构化输出（json mode、function calling、语法约束等），请重写这个方法
+        返回的参数会原样传给completion，让LLM直接按schema返回json，completion里记得把结构化的结果当作文本返回
+        不支持的话保持默认即可，调用方会照常解析自由文本
+        :param schema: 期望的返回结构，比如SummarizeAiResponse
+        :return: 传给completion的额外参数
+        """
+        return {}
+
+    def _sync_completion(self, prompt, **kwargs) -> tuple[str, int] | None:
         """如果你的调用方式为同步，请先在这里实现，然后在completion中使用线程池调用
         :param prompt: 最终的输入文本，确保格式化过
         :param kwargs: 其他参数
@@ -5,7 +5,6 @@ import json
 import traceback
 from datetime import datetime
 from time import mktime
-from typing import Tuple
 from urllib.parse import urlencode, urlparse
 from wsgiref.handlers import format_date_time
 
@@ -89,7 +88,7 @@ class Spark(LLMBase):
                 return 0
             return 1
 
-    async def completion(self, prompt, **kwargs) -> Tuple[str, int] | None:
+    async def completion(self, prompt, **kwargs) -> tuple[str, int] | None:
         try:
             self._answer_temp = ""
             self._once_total_tokens = 0
@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from pydantic import BaseModel, ConfigDict, Field, field_validator
 
@@ -39,6 +40,13 @@ class Openai(BaseModel):
     api_key: str
     model: str = "gpt-3.5-turbo-16k"
     api_base: str = Field(default="https://api.openai.com/v1")
+    rpm: int = 0  # 每分钟最多请求数，0为不限制
+    tpm: int = 0  # 每分钟最多token数，0为不限制
+    max_concurrency: int = 0  # 最大同时请求数，0为不限制
+    tier: int = Field(default=0, ge=0)  # 模型档次，0最便宜，数字越大越强，启用级联调用时从低档往高档升级
+    structured_output: bool = (
+        False  # 使用function calling让模型直接按结构返回，需要模型支持（gpt-3.5-turbo-0613及之后）
+    )
 
     # noinspection PyMethodParameters
     @field_validator("*", mode="after")
@@ -56,6 +64,10 @@ class AiproxyClaude(BaseModel):
     api_key: str
     model: str = "claude-instant-1"
     api_base: str = Field(default="https://api.aiproxy.io/")
+    rpm: int = 0  # 每分钟最多请求数，0为不限制
+    tpm: int = 0  # 每分钟最多token数，0为不限制
+    max_concurrency: int = 0  # 最大同时请求数，0为不限制
+    tier: int = Field(default=0, ge=0)  # 模型档次，0最便宜，数字越大越强，启用级联调用时从低档往高档升级
 
     # noinspection PyMethodParameters
     @field_validator("*", mode="after")
@@ -83,6 +95,10 @@ class Spark(BaseModel):
     api_secret: str
     spark_url: str = Field(default="wss://spark-api.xf-yun.com/v3.5/chat")  # 默认3.5版本
     domain: str = Field(default="generalv3.5")  # 默认3.5
+    rpm: int = 0  # 每分钟最多请求数，0为不限制
+    tpm: int = 0  # 每分钟最多token数，0为不限制
+    max_concurrency: int = 0  # 最大同时请求数，0为不限制
+    tier: int = Field(default=0, ge=0)  # 模型档次，0最便宜，数字越大越强，启用级联调用时从低档往高档升级
 
     @field_validator("*", mode="after")
     def check_required_fields(cls, value, values):
@@ -107,6 +123,8 @@ class OpenaiWhisper(BaseModel):
     model: str = "whisper-1"
     api_base: str = Field(default="https://api.openai.com/v1")
     after_process: bool = False
+    rpm: int = 0  # 每分钟最多请求数（音频每个切片算一次请求），0为不限制
+    max_concurrency: int = 0  # 最大同时请求数，0为不限制
 
     # noinspection PyMethodParameters
     @field_validator("api_key", mode="after")
@@ -135,6 +153,7 @@ class LocalWhisper(BaseModel):
         validate_default=True,
     )
     after_process: bool = False
+    max_concurrency: int = 1  # 最大同时转写数，本地模型很吃资源，默认一次只转一个
 
     # noinspection PyMethodParameters
     @field_validator(
@@ -172,6 +191,30 @@ class StorageSettings(BaseModel):
     queue_save_dir: str = Field(default_factory=lambda: os.getenv("DOCKER_QUEUE_DIR"), validate_default=True)
     up_video_cache: str = Field(default_factory=lambda: os.getenv("DOCKER_UP_VIDEO_CACHE"), validate_default=True)
     up_file: str = Field(default_factory=lambda: os.getenv("DOCKER_UP_FILE"), validate_default=True)
+    completion_cache: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_COMPLETION_CACHE_FILE", "./data/completion_cache.db"),
+        validate_default=True,
+    )
+    at_cursor: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_AT_CURSOR_FILE", "./data/at_cursor.json"),
+        validate_default=True,
+    )
+    queue_db: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_QUEUE_DB_FILE", "./data/queue.db"),
+        validate_default=True,
+    )
+    task_status_db: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_RECORDS_DB_FILE", "./data/records.db"),
+        validate_default=True,
+    )
+    cache_db: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_CACHE_DB_FILE", "./data/cache.db"),
+        validate_default=True,
+    )
+    subtitle_cache_db: str = Field(
+        default_factory=lambda: os.getenv("DOCKER_SUBTITLE_CACHE_DB_FILE", "./data/subtitles.db"),
+        validate_default=True,
+    )
 
     # noinspection PyMethodParameters
     @field_validator("*", mode="after")
@@ -191,6 +234,140 @@ class BilibiliNickName(BaseModel):
         return value
 
 
+class HedgeSettings(BaseModel):
+    """对冲请求设置：主LLM迟迟不返回时，把同一个prompt再发给下一个LLM，谁先给出合法结果就用谁"""
+
+    enable: bool = False
+    percentile: float = Field(default=0.95, gt=0, lt=1)  # 主LLM耗时超过其历史耗时的该分位数时发起对冲
+    min_delay: float = 10  # 对冲等待时间下限（秒）
+    max_delay: float = 120  # 对冲等待时间上限（秒）
+    default_delay: float = 60  # 历史耗时样本不足时使用的等待时间（秒）
+    daily_budget: int = 50  # 每天最多发起多少次对冲请求，防止费用失控
+
+
+class CompletionCacheSettings(BaseModel):
+    """LLM调用结果缓存设置，完全相同的prompt直接返回上次的结果，不再花token"""
+
+    enable: bool = True
+    ttl_hours: float = 72  # 缓存有效期（小时）
+    max_entries: int = 2000  # 最多缓存多少条
+
+
+class QuestionCacheSettings(BaseModel):
+    """AskAI相似问题缓存设置，同一个视频下换个说法问同一个问题时直接复用之前的回答"""
+
+    enable: bool = True
+    threshold: float = Field(default=0.75, gt=0, le=1)  # 相似度阈值，越高越保守
+    max_videos: int = 500  # 最多记录多少个视频
+    max_questions_per_video: int = 50  # 每个视频最多记录多少个问题
+
+
+class CascadeSettings(BaseModel):
+    """级联调用设置：总结先交给便宜的一档模型，结果不合法或评分太低再升级到更强的一档"""
+
+    enable: bool = False
+    min_score: float = Field(default=60, ge=0, le=100)  # 模型给自己打的分（满分100）低于这个值就升级到更强的一档
+    max_cheap_tokens: int = Field(default=8000, ge=0)  # 字幕估算超过这么多token就直接用最强的一档
+
+
+class LLMSettings(BaseModel):
+    hedge: HedgeSettings = Field(default_factory=HedgeSettings)
+    cascade: CascadeSettings = Field(default_factory=CascadeSettings)
+    completion_cache: CompletionCacheSettings = Field(default_factory=CompletionCacheSettings)
+    question_cache: QuestionCacheSettings = Field(default_factory=QuestionCacheSettings)
+
+
+class BilibiliSettings(BaseModel):
+    """b站接口调用相关设置"""
+
+    video_info_timeout: float = 10  # 获取视频信息的超时时间（秒），这个拿不到就没法处理了
+    video_tags_timeout: float = 5  # 获取视频标签的超时时间（秒），超时就不带标签
+    video_comments_timeout: float = 5  # 获取视频评论的超时时间（秒），超时就不带评论
+    subtitle_url_timeout: float = 5  # 获取字幕链接的超时时间（秒），超时会在获取字幕时再试一次
+    http2: bool = True  # 是否启用HTTP/2，需要安装h2（pip install httpx[http2]）
+    max_connections: int = 20  # 连接池大小
+    request_timeout: float = 15  # 单次请求超时时间（秒）
+    max_retries: int = 3  # 网络错误、5xx、429时单个请求最多重试几次（只重试GET）
+    retry_budget_ratio: float = Field(default=0.2, ge=0, le=1)  # 重试总量最多占请求量的比例，防止b站出问题时重试风暴
+    comment_concurrency: int = Field(
+        default=3, ge=1
+    )  # 最多同时处理几个视频的评论回复（同一个视频下的回复仍然按顺序发）
+    comment_max_length: int = Field(default=1000, gt=50)  # 单条评论的最大长度，超出的部分会以楼中楼的形式接在后面
+    private_max_length: int = Field(default=500, gt=50)  # 单条私信的最大长度，超出的部分会按句子切成几条发
+    at_min_interval: float = Field(default=5, gt=0)  # at消息轮询间隔下限（秒），消息多的时候会逐渐缩短到这个值
+    at_max_interval: float = Field(default=60, gt=0)  # at消息轮询间隔上限（秒），一直没有消息时会逐渐放宽到这个值
+    at_max_pages: int = Field(default=20, ge=1)  # 单次轮询最多往前翻几页，防止游标丢失时一口气翻到底
+    up_scan_concurrency: int = Field(default=5, ge=1)  # 检查UP视频更新时最多同时检查几个UP
+    up_scan_jitter: float = Field(default=10, ge=0)  # 每个UP的检查时间随机错开多少秒以内
+    up_schedule_tick: float = Field(default=5, gt=0)  # 每隔多少分钟看一次哪些UP该检查了
+    up_default_interval: float = Field(default=60, gt=0)  # 投稿记录不够时每个UP的检查间隔（分钟）
+    up_min_interval: float = Field(default=10, gt=0)  # 最勤快的UP最短多久检查一次（分钟）
+    up_max_interval: float = Field(default=720, gt=0)  # 不怎么更新的UP最长多久检查一次（分钟）
+    up_poll_budget: int = Field(default=120, ge=1)  # 每小时最多检查多少次UP视频列表
+
+
+class QueueSettings(BaseModel):
+    """任务队列相关设置"""
+
+    visibility_timeout: float = Field(default=300, gt=0)  # 处理进程多久没续约就把它手上的任务交给别的进程（秒）
+    max_attempts: int = Field(default=3, ge=1)  # 同一个任务最多处理几次，一直失败就丢弃
+    priorities: dict[str, int] = Field(
+        default_factory=lambda: {"bili_private": 0, "bili_comment": 0, "api": 1, "bili_up": 2, "prefetch": 9}
+    )  # 各任务来源的优先级，越小越优先，同一优先级内按提交者轮流处理
+    aging_interval: float = Field(default=600, gt=0)  # 任务每排队这么多秒优先级提升一级，自动总结不会一直被插队
+    soft_deadlines: dict[str, int] = Field(
+        default_factory=lambda: {
+            "bili_private": 1800,
+            "bili_comment": 1800,
+            "api": 600,
+            "bili_up": 7200,
+            "prefetch": 1800,
+        }
+    )  # 任务创建后超过这么多秒还没处理就降级：只用现成的字幕，不再做语音转写
+    hard_deadlines: dict[str, int] = Field(
+        default_factory=lambda: {
+            "bili_private": 21600,
+            "bili_comment": 21600,
+            "api": 3600,
+            "bili_up": 86400,
+            "prefetch": 3600,
+        }
+    )  # 任务创建后超过这么多秒还没处理就直接放弃
+    admission_max_wait: float = Field(default=3600, gt=0)  # 预计排队时间超过这么多秒就不再接新任务
+    leader_lease_ttl: float = Field(
+        default=30, gt=0
+    )  # 运行多个副本时主节点租约的有效期（秒），主节点挂掉后最多这么久热备就会接手轮询
+
+
+class PrefetchSettings(BaseModel):
+    """预取设置：LLM空闲时提前总结可能会被问到的视频，之后用户来问时直接命中缓存"""
+
+    enable: bool = False  # 是否启用预取（会额外花token）
+    feeds: list[Literal["up", "popular", "mentions"]] = Field(
+        default_factory=lambda: ["up", "mentions"]
+    )  # 预取哪些视频：关注的UP的最新视频、热门视频、被at次数突然变多的视频
+    interval: float = Field(default=10, gt=0)  # 每隔多少分钟看一次要不要预取（分钟）
+    max_per_round: int = Field(default=2, ge=1)  # 每次最多放入几个预取任务，只在处理队列为空时才放
+    popular_count: int = Field(default=20, ge=1)  # 从热门视频里取前多少个
+    mention_window: float = Field(default=3600, gt=0)  # 统计at次数的时间窗口（秒）
+    mention_threshold: int = Field(default=3, ge=1)  # 窗口内被at了这么多次的视频认为是正在变热的视频
+    subtitle_cache_ttl_hours: float = Field(default=168, gt=0)  # 字幕缓存有效期（小时），字幕缓存不启用预取也会用
+    subtitle_cache_max_entries: int = Field(default=1000, ge=1)  # 最多缓存多少个视频的字幕
+
+
+class TranscriptSettings(BaseModel):
+    """字幕处理设置"""
+
+    compress: bool = True  # 送进prompt之前压缩字幕：合并成句子、去掉重复的字幕条和纯语气词
+    drop_low_info: bool = False  # 压缩时顺便去掉信息量很低的字幕条（比如“对对对对”），可能会误删很短但有用的内容
+    retrieval: bool = True  # AskAI只把和问题相关的几段字幕放进prompt，长视频提问更快更省
+    retrieval_min_length: int = Field(default=3000, ge=0)  # 字幕超过这么多字才检索，短字幕直接整段放进prompt
+    chunk_size: int = Field(default=400, gt=0)  # 检索时把字幕切成多少字一块
+    chunk_overlap: int = Field(default=50, ge=0)  # 相邻两块大约重叠多少字
+    top_k: int = Field(default=4, gt=0)  # 每个问题取最相关的几块
+    index_max_videos: int = Field(default=200, gt=0)  # 最多在内存里缓存多少个视频的字幕索引
+
+
 class Config(BaseModel):
     """配置文件模型"""
 
@@ -200,4 +377,9 @@ class Config(BaseModel):
     LLMs: LLMs
     ASRs: ASRs
     storage_settings: StorageSettings
+    llm_settings: LLMSettings = Field(default_factory=LLMSettings)
+    bilibili_settings: BilibiliSettings = Field(default_factory=BilibiliSettings)
+    queue_settings: QueueSettings = Field(default_factory=QueueSettings)
+    prefetch_settings: PrefetchSettings = Field(default_factory=PrefetchSettings)
+    transcript_settings: TranscriptSettings = Field(default_factory=TranscriptSettings)
     debug_mode: bool = True
@@ -2,7 +2,7 @@
 import time
 import uuid
 from enum import Enum
-from typing import Annotated, List, Optional, Union
+from typing import Annotated
 
 from pydantic import BaseModel, Field, StringConstraints, field_validator
 
@@ -90,6 +90,17 @@ class EndReasons(Enum):
     NORMAL = "正常结束"  # 正常结束
     ERROR = "视频在处理过程中出现致命错误或多次重试失败，详细见具体的msg"  # 错误结束
     NONEED = "AI认为该视频不需要被处理，可能是因为内容无意义"  # AI认为这个视频不需要处理
+    EXPIRED = "任务排队太久，超过了截止时间，回复已经没有意义"  # 超过截止时间被放弃
+
+
+class LLMUsage(BaseModel):
+    """一次LLM调用的用量记录"""
+
+    tier: int  # 模型档次
+    llm: str  # LLM的alias
+    tokens: int = 0  # 消耗的token数，调用失败为0
+    latency: float  # 耗时（秒）
+    outcome: str  # accepted: 采用；invalid: 格式不对；low_score: 评分太低；error: 调用失败
 
 
 class BiliAtSpecialAttributes(BaseModel):
@@ -99,7 +110,7 @@ class BiliAtSpecialAttributes(BaseModel):
     target_id: int  # 上一级评论id， 二级评论指向的就是root_id，三级评论指向的是二级评论的id
     root_id: int  # 暂时还没出现过
     native_uri: str  # 评论链接，包含根评论id和父评论id
-    at_details: List[dict]  # at的人的信息，常规的个人信息dict
+    at_details: list[dict]  # at的人的信息，常规的个人信息dict
 
 
 class AskAICommandParams(BaseModel):
@@ -111,29 +122,34 @@ class AskAICommandParams(BaseModel):
 class BiliGPTTask(BaseModel):
     """单任务全生命周期的数据模型 用于替代其他所有的已有类型"""
 
-    source_type: Annotated[str, StringConstraints(pattern=r"^(bili_comment|bili_private|api|bili_up)$")]  # type: ignore # 设置task的获取来源
+    source_type: Annotated[str, StringConstraints(pattern=r"^(bili_comment|bili_private|api|bili_up|prefetch)$")]  # type: ignore # 设置task的获取来源
     raw_task_data: dict  # 原始的task数据，包含所有信息
-    sender_id: int  # task提交者的id，用于统计。来自b站的task就是uid，其他来源的task要自己定义
+    sender_id: int  # task提交者的id，用于统计。来自b站的task就是uid（预取任务是自己的uid），其他来源的task要自己定义
     # video_title: str  # 视频标题
     video_url: str  # 视频链接
     video_id: str  # bvid
     source_command: str  # 用户发送的原始指令（eg. "总结一下" "问一下：xxxxxxx"）
     # mission: bool = Field(default=False)  # 用户AT还是自发检测的标志
-    command_params: Optional[AskAICommandParams] = None  # 用户原始指令经解析后的参数
-    source_extra_attr: Optional[BiliAtSpecialAttributes] = None  # 在获取到task时附加的其他原始参数（比如评论id等）
-    process_result: Optional[Union[SummarizeAiResponse, AskAIResponse, str, dict]] = (
+    command_params: AskAICommandParams | None = None  # 用户原始指令经解析后的参数
+    source_extra_attr: BiliAtSpecialAttributes | None = None  # 在获取到task时附加的其他原始参数（比如评论id等）
+    process_result: SummarizeAiResponse | AskAIResponse | str | dict | None = (
         None  # 最终处理结果，根据不同的处理链会有不同的结果 （dict的存在是一个历史遗留问题，不想解决了，再拉一坨）
     )
-    subtitle: Optional[str] = None  # 该视频字幕，与之前不同的是，现在不管是什么方式得到的字幕都要保存下来
-    process_stage: Optional[ProcessStages] = Field(default=ProcessStages.PREPROCESS)  # 视频处理阶段
-    chain: Optional[Chains] = None  # 视频处理事件，即对应的处理链
-    uuid: Optional[str] = Field(default=str(uuid.uuid4()))  # 该任务的uuid4
-    gmt_create: int = Field(default=int(time.time()))  # 任务创建时间戳，默认为当前时间戳
+    subtitle: str | None = None  # 该视频字幕，与之前不同的是，现在不管是什么方式得到的字幕都要保存下来
+    asr_checkpoint: dict[int, str] | None = None  # 语音转写断点（切片序号 -> 转写结果），重启后只转写剩下的切片
+    reply_progress: dict[str, int] | None = (
+        None  # 分段评论的进度（root: 第一段的rpid，sent: 已发出几段），重新投递时接着发
+    )
+    process_stage: ProcessStages | None = Field(default=ProcessStages.PREPROCESS)  # 视频处理阶段
+    chain: Chains | None = None  # 视频处理事件，即对应的处理链
+    uuid: str | None = Field(default_factory=lambda: str(uuid.uuid4()))  # 该任务的uuid4
+    gmt_create: int = Field(default_factory=lambda: int(time.time()))  # 任务创建时间戳，默认为当前时间戳
     gmt_start_process: int = Field(default=0)  # 任务开始处理时间，不同于上方的gmt_create，这个是真正开始处理的时间
     gmt_retry_start: int = Field(default=0)  # 如果该任务被重试，就在开始重试时填写该属性
     gmt_end: int = Field(default=0)  # 任务彻底结束时间
-    error_msg: Optional[str] = None  # 更详细的错误信息
-    end_reason: Optional[EndReasons] = None  # 任务结束原因
+    error_msg: str | None = None  # 更详细的错误信息
+    end_reason: EndReasons | None = None  # 任务结束原因
+    llm_usage: list[LLMUsage] = Field(default_factory=list)  # 级联调用时每一档的token数和耗时
 
 
 # class AtItem(TypedDict):
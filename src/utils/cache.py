@@ -1,81 +1,90 @@
 """管理视频处理后缓存"""
 
+import contextlib
 import json
+import os
 
 from src.utils.exceptions import LoadJsonError
-from src.utils.file_tools import read_file, save_file
+from src.utils.file_tools import open_sqlite
 from src.utils.logging import LOGGER
 
 _LOGGER = LOGGER.bind(name="cache")
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    chain TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,  -- json
+    PRIMARY KEY (chain, key)
+);
+"""
+
 
 class Cache:
-    def __init__(self, cache_path: str):
-        self.cache_path = cache_path
-        self.cache = {}
-        self.load_cache()
+    """视频处理结果缓存，按 (处理链, bvid) 保存在SQLite里，多个进程同时读写也不会互相覆盖"""
+
+    def __init__(self, db_path: str, legacy_file_path: str = None):
+        """
+        :param db_path: 缓存数据库位置
+        :param legacy_file_path: 旧版本的json缓存文件，存在的话会迁移到数据库
+        """
+        self.db_path = db_path
+        self.conn = open_sqlite(db_path)
+        self.conn.executescript(_SCHEMA)
+        if legacy_file_path:
+            self._migrate(legacy_file_path)
 
-    def load_cache(self):
-        """加载缓存"""
-        # try:
-        #     if not os.path.exists(self.cache_path):
-        #         os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
-        #         with open(self.cache_path, "w", encoding="utf-8") as f:
-        #             json.dump({}, f, ensure_ascii=False, indent=4)
-        #     with open(self.cache_path, encoding="utf-8") as f:
-        #         self.cache = json.load(f)
-        # except Exception as e:
-        #     _LOGGER.error(f"加载缓存失败：{e}，尝试删除缓存文件并重试")
-        #     traceback.print_exc()
-        #     self.cache = {}
-        #     if os.path.exists(self.cache_path):
-        #         os.remove(self.cache_path)
-        #     _LOGGER.info("已删除缓存文件")
-        #     self.save_cache()
-        #     _LOGGER.info("已重新创建缓存文件")
-        #     self.load_cache()
+    def _migrate(self, file_path: str):
+        """把旧版本json文件里的缓存迁移到数据库，迁移完把文件改名，避免重复迁移"""
         try:
-            content = read_file(self.cache_path)
-            if content:
-                self.cache = json.loads(content)
-            else:
-                self.cache = {}
-                self.save_cache()
+            with open(file_path, encoding="utf-8") as f:
+                content = f.read()
+            cache = json.loads(content) if content else {}
+        except FileNotFoundError:
+            return  # 没有旧文件，或者已经被其他进程迁移了
         except Exception as e:
             raise LoadJsonError("在读取缓存文件时出现问题！程序已停止运行，请自行检查问题所在") from e
-
-    def save_cache(self):
-        """保存缓存"""
-        # try:
-        #     with open(self.cache_path, "w", encoding="utf-8") as f:
-        #         json.dump(self.cache, f, ensure_ascii=False, indent=4)
-        # except Exception as e:
-        #     _LOGGER.error(f"保存缓存失败：{e}")
-        #     traceback.print_exc()
-        save_file(json.dumps(self.cache, ensure_ascii=False, indent=4), self.cache_path)
+        count = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for chain, entries in cache.items():
+                for key, value in entries.items():
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO cache (chain, key, value) VALUES (?, ?, ?)",
+                        (chain, key, json.dumps(value, ensure_ascii=False)),
+                    )
+                    count += 1
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        with contextlib.suppress(FileNotFoundError):
+            os.replace(file_path, file_path + ".migrated")
+        _LOGGER.info(f"已把{count}条旧版本的缓存迁移到数据库{self.db_path}")
 
     def get_cache(self, key: str, chain: str):
         """获取缓存"""
-        return self.cache.get(chain, {}).get(key)
+        row = self.conn.execute("SELECT value FROM cache WHERE chain = ? AND key = ?", (chain, key)).fetchone()
+        return json.loads(row[0]) if row else None
 
     def set_cache(self, key: str, value, chain: str):
         """设置缓存"""
-        if chain not in self.cache:
-            self.cache[chain] = {}
-
-        self.cache[chain][key] = value
-        self.save_cache()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache (chain, key, value) VALUES (?, ?, ?)",
+            (chain, key, json.dumps(value, ensure_ascii=False)),
+        )
 
     def delete_cache(self, key: str):
-        """删除缓存"""
-        self.cache.pop(key)
-        self.save_cache()
+        """删除缓存（一整个处理链的）"""
+        self.conn.execute("DELETE FROM cache WHERE chain = ?", (key,))
 
     def clear_cache(self):
         """清空缓存"""
-        self.cache = {}
-        self.save_cache()
+        self.conn.execute("DELETE FROM cache")
 
     def get_all_cache(self):
         """获取所有缓存"""
-        return self.cache
+        cache = {}
+        for chain, key, value in self.conn.execute("SELECT chain, key, value FROM cache"):
+            cache.setdefault(chain, {})[key] = json.loads(value)
+        return cache
@@ -0,0 +1,114 @@
+"""LLM调用结果缓存，以 (后端, 模型, 规范化后的prompt哈希, 调用参数) 为键，带过期时间和数量上限
+
+缓存保存在SQLite里，每次读写只动一行，多个进程共用也不会互相覆盖
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from src.utils.file_tools import open_sqlite
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="completion-cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    expire_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used);
+"""
+
+
+class CompletionCache:
+    def __init__(self, cache_path: str, ttl: int, max_entries: int):
+        """
+        :param cache_path: 缓存数据库位置
+        :param ttl: 缓存有效期（秒）
+        :param max_entries: 最多缓存多少条，超出后淘汰最久没用过的
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        """打开缓存数据库，文件损坏（或者是旧版本的json缓存）就挪到一边重新建一个，缓存丢了无所谓，不能让程序停下"""
+        try:
+            return self._connect()
+        except sqlite3.DatabaseError as e:
+            _LOGGER.error(f"LLM调用缓存{self.cache_path}无法读取：{e}，已改名为{self.cache_path}.corrupt，从空缓存开始")
+            for suffix in ("-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.cache_path + suffix)
+            os.replace(self.cache_path, self.cache_path + ".corrupt")
+            return self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = open_sqlite(self.cache_path)
+        try:
+            conn.executescript(_SCHEMA)
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def _normalize(text) -> str:
+        """去掉多余空白，避免只有空格、换行不同的prompt被当成不同的请求"""
+        return re.sub(r"\s+", " ", str(text)).strip()
+
+    @staticmethod
+    def make_key(backend: str, model: str, prompt, params: dict) -> str:
+        """
+        生成缓存键
+        :param backend: 后端alias
+        :param model: 模型名
+        :param prompt: 最终prompt（openai格式的消息列表或字符串）
+        :param params: 调用completion时传入的其他参数
+        :return: 缓存键
+        """
+        if isinstance(prompt, list):
+            normalized = [
+                [message.get("role"), CompletionCache._normalize(message.get("content"))] for message in prompt
+            ]
+        else:
+            normalized = CompletionCache._normalize(prompt)
+        prompt_hash = hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
+        raw_key = json.dumps([backend, model, prompt_hash, params], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple[str, int] | None:
+        """获取缓存，命中时返回的token数为0，因为这次确实没花钱"""
+        now = time.time()
+        row = self.conn.execute("SELECT answer FROM completions WHERE key = ? AND expire_at > ?", (key, now)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        _LOGGER.debug(f"LLM调用缓存命中，当前命中{self.hits}次，未命中{self.misses}次")
+        return row[0], 0
+
+    def set(self, key: str, answer: str, tokens: int):
+        """设置缓存，顺便清理过期和超出数量的"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO completions (key, answer, tokens, expire_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, answer, tokens, now + self.ttl, now),
+        )
+        self.conn.execute("DELETE FROM completions WHERE expire_at <= ?", (now,))
+        self.conn.execute(
+            "DELETE FROM completions WHERE key NOT IN (SELECT key FROM completions ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
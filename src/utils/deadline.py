@@ -0,0 +1,32 @@
+"""任务截止时间：排队太久的任务降级处理或直接放弃，把算力留给还来得及回复的任务"""
+
+import time
+from enum import Enum
+
+from src.models.task import BiliGPTTask
+
+
+class DeadlineStatus(Enum):
+    NORMAL = "normal"  # 正常处理
+    DEGRADED = "degraded"  # 过了软截止时间，只用现成的字幕，不再做耗时的语音转写
+    EXPIRED = "expired"  # 过了硬截止时间，回复已经没有意义，直接放弃
+
+
+def check_deadline(
+    task: BiliGPTTask, soft_deadlines: dict[str, int], hard_deadlines: dict[str, int], now: float = None
+) -> DeadlineStatus:
+    """
+    根据任务创建到现在的时间判断任务该怎么处理
+
+    :param task: 任务
+    :param soft_deadlines: 任务来源(source_type) -> 软截止时间（秒），没列出的来源不限制
+    :param hard_deadlines: 任务来源(source_type) -> 硬截止时间（秒），没列出的来源不限制
+    """
+    age = (now or time.time()) - task.gmt_create
+    hard = hard_deadlines.get(task.source_type)
+    if hard is not None and age > hard:
+        return DeadlineStatus.EXPIRED
+    soft = soft_deadlines.get(task.source_type)
+    if soft is not None and age > soft:
+        return DeadlineStatus.DEGRADED
+    return DeadlineStatus.NORMAL
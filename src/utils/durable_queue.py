@@ -0,0 +1,313 @@
+"""基于SQLite的持久化任务队列：任务入队即落盘，取出后要确认（ack）才删除，进程崩溃或被杀也不会丢任务
+
+出队顺序不是简单的先进先出：按任务来源分优先级（交互式的评论、私信优先于自动总结），等得越久优先级越高（防止饿死），
+同一优先级内按提交者轮流出队，每人每轮一个任务（一个人刷屏不会挤占其他人），轮到谁记在数据库里，多个进程一起取也是轮流的
+"""
+
+import asyncio
+import contextlib
+import sqlite3
+import time
+
+from src.models.task import BiliGPTTask
+from src.utils.file_tools import open_sqlite
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="durable-queue")
+
+_EWMA_ALPHA = 0.2  # 平均处理时间的平滑系数，越大越看重最近的任务
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',  -- ready: 等待取出 leased: 已被取出、还没确认
+    visible_at REAL NOT NULL DEFAULT 0,  -- 在这个时间之前不会被取出（租约到期时间或重试延迟）
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,  -- 优先级，越小越优先
+    sender_id TEXT NOT NULL DEFAULT '',  -- 提交者，用于轮流出队
+    UNIQUE (queue, uuid)
+);
+CREATE TABLE IF NOT EXISTS queue_stats (
+    queue TEXT PRIMARY KEY,
+    service_time REAL NOT NULL  -- 处理一个任务平均要多久（指数加权移动平均），所有进程共用
+);
+CREATE TABLE IF NOT EXISTS queue_cursors (
+    queue TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    sender_id TEXT NOT NULL,  -- 这个优先级上次轮到的提交者，所有进程共用，多个进程一起取任务也是按提交者轮流
+    PRIMARY KEY (queue, priority)
+);
+"""
+
+# 后来加上的列，旧数据库打开时补上
+_ADDED_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "sender_id": "TEXT NOT NULL DEFAULT ''",
+}
+
+# 索引用到了后来加上的列，要等补完列再建
+# idx_tasks_priority: 每个优先级最早的任务；idx_tasks_sender: 同一优先级里按提交者轮流
+_INDEXES = """
+DROP INDEX IF EXISTS idx_tasks_queue;
+CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks (queue, priority, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_sender ON tasks (queue, priority, sender_id, id);
+"""
+
+
+def open_queue_db(path: str) -> sqlite3.Connection:
+    """打开队列数据库，不存在则创建"""
+    conn = open_sqlite(path)
+    conn.executescript(_SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+    for column, definition in _ADDED_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+    conn.executescript(_INDEXES)
+    return conn
+
+
+def release_leases(conn: sqlite3.Connection) -> int:
+    """
+    把所有已取出但没确认的任务放回队列（单进程运行时启动时调用，上次运行中断时正在处理的任务会马上重新处理）
+    多进程运行时不能调用，否则会抢走其他进程正在处理的任务，这时崩溃进程的任务等租约到期后自然会被重新取出
+    """
+    return conn.execute("UPDATE tasks SET state = 'ready', visible_at = 0 WHERE state = 'leased'").rowcount
+
+
+class DurableQueue:
+    """接口与asyncio.Queue保持一致（put/get/qsize/empty），另外多了ack/nack"""
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        name: str,
+        visibility_timeout: float = 300,
+        max_attempts: int = 3,
+        retry_delay: float = 60,
+        poll_interval: float = 1,
+        priorities: dict[str, int] = None,
+        aging_interval: float = 600,
+    ):
+        """
+        :param conn: 队列数据库连接
+        :param name: 队列名
+        :param visibility_timeout: 任务取出后多久没确认就重新投递（秒）
+        :param max_attempts: 同一个任务最多投递几次，超过就丢弃，防止一个有毒的任务反复把处理链搞崩
+        :param retry_delay: 处理失败（nack）后多久重新投递（秒）
+        :param poll_interval: 队列为空时多久查一次数据库（秒），用于发现到期的重试任务
+        :param priorities: 任务来源(source_type) -> 优先级，越小越优先，没列出的来源优先级为1
+        :param aging_interval: 任务每等待这么多秒优先级提升一级
+        """
+        self.conn = conn
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.priorities = priorities or {}
+        self.aging_interval = aging_interval
+        # 可能出现的优先级：配置里的，加上队列里已有的（配置改过的话旧任务还是原来的优先级）
+        self._priority_levels = sorted(
+            {*self.priorities.values(), 1}
+            | {row[0] for row in conn.execute("SELECT DISTINCT priority FROM tasks WHERE queue = ?", (name,))}
+        )
+        self._has_items = asyncio.Event()
+        self._leased: dict[str, float] = {}  # 本进程取出还没确认的任务及取出时间，租约到期也不会再投递给自己
+
+    def put_nowait(self, task: BiliGPTTask) -> bool:
+        """入队，同一个uuid的任务已经在队列里时忽略，返回是否真的入队了"""
+        inserted = self.conn.execute(
+            "INSERT OR IGNORE INTO tasks (queue, uuid, payload, created_at, priority, sender_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.name,
+                task.uuid,
+                task.model_dump_json(),
+                time.time(),
+                self.priorities.get(task.source_type, 1),
+                str(task.sender_id),
+            ),
+        ).rowcount
+        if inserted:
+            self._has_items.set()
+        else:
+            _LOGGER.debug(f"[{self.name}] 任务{task.uuid}已经在队列中，忽略")
+        return bool(inserted)
+
+    async def put(self, task: BiliGPTTask) -> bool:
+        return self.put_nowait(task)
+
+    def get_nowait(self) -> BiliGPTTask:
+        """取出一个任务，没有可取的任务时抛出asyncio.QueueEmpty"""
+        while True:
+            now = time.time()
+            task_id = self._pick(now)
+            if task_id is None:
+                raise asyncio.QueueEmpty
+            row = self.conn.execute(
+                "UPDATE tasks SET state = 'leased', visible_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND visible_at <= ? RETURNING uuid, payload, attempts",
+                (now + self.visibility_timeout, task_id, now),
+            ).fetchone()
+            if row is None:
+                continue  # 被别的进程抢先取走了
+            _uuid, payload, attempts = row
+            if _uuid in self._leased:
+                # 本进程还在处理，只是处理得久，上面已经续上了租约，这次不算投递
+                self.conn.execute(
+                    "UPDATE tasks SET attempts = attempts - 1 WHERE queue = ? AND uuid = ?", (self.name, _uuid)
+                )
+                continue
+            if attempts > self.max_attempts:
+                _LOGGER.error(f"[{self.name}] 任务{_uuid}已经投递了{attempts - 1}次都没处理成功，丢弃")
+                self._delete(_uuid)
+                continue
+            try:
+                task = BiliGPTTask.model_validate_json(payload)
+            except Exception:
+                _LOGGER.exception(f"[{self.name}] 任务{_uuid}数据损坏，丢弃")
+                self._delete(_uuid)
+                continue
+            self._leased[_uuid] = time.monotonic()
+            return task
+
+    def _pick(self, now: float) -> int | None:
+        """
+        选出下一个要出队的任务id：先选（算上等待时间后）优先级最高的一级，再在这一级里按提交者轮流
+        只走索引，不扫整个队列：每个优先级只看最早的一个可取任务（等得最久，提升得最多），
+        同一优先级里提交者按sender_id排好，从上次轮到的提交者往后找下一个有可取任务的
+        """
+        best = None  # (算上等待时间后的优先级, 最早的任务创建时间, 原优先级)
+        for priority in self._priority_levels:
+            row = self.conn.execute(
+                "SELECT created_at FROM tasks WHERE queue = ? AND priority = ? AND visible_at <= ? ORDER BY id LIMIT 1",
+                (self.name, priority, now),
+            ).fetchone()
+            if row is None:
+                continue
+            level = max(0, priority - int((now - row[0]) // self.aging_interval))
+            if best is None or (level, row[0]) < best[:2]:  # 提升到同一级的，等得久的先出
+                best = (level, row[0], priority)
+        if best is None:
+            return None
+        priority = best[2]
+        cursor = self.conn.execute(
+            "SELECT sender_id FROM queue_cursors WHERE queue = ? AND priority = ?", (self.name, priority)
+        ).fetchone()
+        # 后面没有提交者了就从头开始
+        row = (cursor is not None and self._next_sender(priority, now, cursor[0])) or self._next_sender(priority, now)
+        if row is None:
+            return None  # 刚好被别的进程取光了
+        task_id, sender_id = row
+        self.conn.execute(
+            "INSERT OR REPLACE INTO queue_cursors (queue, priority, sender_id) VALUES (?, ?, ?)",
+            (self.name, priority, sender_id),
+        )
+        return task_id
+
+    def _next_sender(self, priority: int, now: float, after: str = None) -> tuple[int, str] | None:
+        """
+        同一优先级里sender_id排在after后面（after为None时从头找）的第一个有可取任务的提交者
+
+        :return: (他最早的可取任务id, sender_id)，找不到返回None
+        """
+        condition, params = ("AND sender_id > ? ", (after,)) if after is not None else ("", ())
+        return self.conn.execute(
+            f"SELECT id, sender_id FROM tasks WHERE queue = ? AND priority = ? {condition}AND visible_at <= ? "
+            "ORDER BY sender_id, id LIMIT 1",
+            (self.name, priority, *params, now),
+        ).fetchone()
+
+    async def get(self) -> BiliGPTTask:
+        """取出一个任务，没有就等待"""
+        while True:
+            self._has_items.clear()
+            with contextlib.suppress(asyncio.QueueEmpty):
+                return self.get_nowait()
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._has_items.wait(), self.poll_interval)
+
+    def ack(self, task: BiliGPTTask):
+        """确认任务处理完成，从队列删除"""
+        started = self._leased.get(task.uuid)
+        if started is not None:
+            self.conn.execute(
+                "INSERT INTO queue_stats (queue, service_time) VALUES (?, ?) ON CONFLICT (queue) "
+                "DO UPDATE SET service_time = ? * excluded.service_time + ? * service_time",
+                (self.name, time.monotonic() - started, _EWMA_ALPHA, 1 - _EWMA_ALPHA),
+            )
+        self._delete(task.uuid)
+
+    @property
+    def service_time(self) -> float | None:
+        """处理一个任务平均要多久，还没有统计数据时返回None"""
+        row = self.conn.execute("SELECT service_time FROM queue_stats WHERE queue = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def heartbeat(self):
+        """给本进程正在处理的任务续租约，处理得再久也不会被别的进程重复取走；进程崩溃后停止续约，租约到期任务就会被重新取出"""
+        visible_at = time.time() + self.visibility_timeout
+        self.conn.executemany(
+            "UPDATE tasks SET visible_at = ? WHERE queue = ? AND uuid = ? AND state = 'leased'",
+            [(visible_at, self.name, _uuid) for _uuid in self._leased],
+        )
+
+    def projected_wait(self, source_type: str) -> float:
+        """
+        估计一个新任务要排队多久：排在它前面（优先级不低于它）的任务数 × 平均处理时间 ÷ 同时在处理的消费者数，
+        还没有统计数据时返回0
+        消费者数用租约还没到期的任务数估计：有积压时每个消费者（所有进程的）手上都正好有一个任务
+        """
+        if self.service_time is None:
+            return 0.0
+        now = time.time()
+        ahead, workers = self.conn.execute(
+            "SELECT COUNT(CASE WHEN priority <= ? THEN 1 END), COUNT(CASE WHEN state = 'leased' AND visible_at > ? THEN 1 END) "
+            "FROM tasks WHERE queue = ?",
+            (self.priorities.get(source_type, 1), now, self.name),
+        ).fetchone()
+        return ahead * self.service_time / max(1, workers)
+
+    def nack(self, task: BiliGPTTask, delay: float = None):
+        """任务处理失败，放回队列，delay秒后重新投递"""
+        delay = self.retry_delay if delay is None else delay
+        self.conn.execute(
+            "UPDATE tasks SET state = 'ready', visible_at = ? WHERE queue = ? AND uuid = ?",
+            (time.time() + delay, self.name, task.uuid),
+        )
+        self._leased.pop(task.uuid, None)
+
+    def update(self, task: BiliGPTTask):
+        """把任务的最新数据（比如处理进度）写回队列，放回队列重新投递时拿到的就是这份数据"""
+        self.conn.execute(
+            "UPDATE tasks SET payload = ? WHERE queue = ? AND uuid = ?",
+            (task.model_dump_json(), self.name, task.uuid),
+        )
+
+    @contextlib.contextmanager
+    def processing(self, task: BiliGPTTask):
+        """
+        包住一个任务的处理过程：正常结束（包括中途continue跳过）就确认；抛出异常就放回队列稍后重试；
+        被取消（关闭程序）时什么都不做，下次启动时会重新处理
+        """
+        try:
+            yield task
+        except Exception:
+            self.nack(task)
+            raise
+        self.ack(task)
+
+    def _delete(self, _uuid: str):
+        self.conn.execute("DELETE FROM tasks WHERE queue = ? AND uuid = ?", (self.name, _uuid))
+        self._leased.pop(_uuid, None)
+
+    def qsize(self) -> int:
+        """队列中的任务数（包括已取出还没确认的）"""
+        return self.conn.execute("SELECT COUNT(*) FROM tasks WHERE queue = ?", (self.name,)).fetchone()[0]
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
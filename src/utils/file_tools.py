@@ -1,4 +1,5 @@
 import os
+import sqlite3
 import traceback
 
 from src.utils.logging import LOGGER
@@ -51,3 +52,18 @@ def save_file(content: str, file_path: str, mode: str = "w", encoding: str = "ut
         _LOGGER.error("在读取文件时发生意料外的问题，返回空值")
         traceback.print_exc()
         return False
+
+
+def open_sqlite(file_path: str) -> sqlite3.Connection:
+    """
+    打开一个SQLite数据库，不存在就创建，开启WAL以便多个进程同时读写
+    :param file_path:
+    :return: 自动提交模式的连接，需要事务时自己BEGIN
+    """
+    dir_path = os.path.dirname(file_path)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    conn = sqlite3.connect(file_path, isolation_level=None, timeout=10)  # 其他进程正在写时最多等10秒
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
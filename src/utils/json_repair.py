@@ -0,0 +1,139 @@
+"""AI返回的JSON经常只是有点小毛病（代码块包裹、少了个右括号、中文引号、字符串里直接换行……）
+在花一整轮LLM调用去重试之前，先用本地规则修一修，能修好就不用重试了
+"""
+
+import json
+import re
+from collections import Counter
+from typing import TypeVar
+
+import yaml
+from pydantic import BaseModel
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="json-repair")
+
+T = TypeVar("T", bound=BaseModel)
+
+REPAIR_STATS = Counter()  # direct：直接解析成功 repaired：本地修复后成功 failed：修不好，需要交给LLM重试
+
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _load(text: str):
+    """先按JSON解析，不行再按yaml解析（能兼容单引号、Python风格的True/False）"""
+    try:
+        return json.loads(text)
+    except Exception:
+        return yaml.safe_load(text)
+
+
+def repair_json(text: str) -> str:
+    """
+    按常见的错误逐个修复，返回修复后的文本（不保证一定是合法JSON）
+
+    :param text: AI返回的原始内容
+    :return: 修复后的文本
+    """
+    text = text.strip()
+    # 去掉markdown代码块
+    text = re.sub(r"^```[a-zA-Z]*\s*", "", text)
+    text = re.sub(r"\s*```$", "", text)
+    # 只保留第一个{之后的内容，前后的废话不要
+    start = text.find("{")
+    if start == -1:
+        return text
+    end = text.rfind("}")
+    text = text[start : end + 1] if end > start else text[start:]
+    # 全文都没有英文双引号，说明AI把结构用的引号也写成了中文引号
+    if '"' not in text:
+        text = text.translate(str.maketrans({"“": '"', "”": '"'}))
+
+    result = []
+    stack = []
+    in_string = False
+    escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                # 后面紧跟的不是, : } ]，说明这是字符串内容里没转义的引号
+                rest = text[i + 1 :].lstrip()
+                if rest and rest[0] not in ",:}]":
+                    result.append('\\"')
+                    i += 1
+                    continue
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            elif char == "\r":
+                char = "\\r"
+            elif char == "\t":
+                char = "\\t"
+            result.append(char)
+        else:
+            if char == '"':
+                in_string = True
+            elif char in "{[":
+                stack.append("}" if char == "{" else "]")
+            elif char in "}]":
+                # 去掉末尾多余的逗号
+                while result and result[-1] in " \n\r\t":
+                    result.pop()
+                if result and result[-1] == ",":
+                    result.pop()
+                if stack:
+                    stack.pop()
+            else:
+                literal = next((key for key in _PYTHON_LITERALS if text.startswith(key, i)), None)
+                if literal:
+                    result.append(_PYTHON_LITERALS[literal])
+                    i += len(literal)
+                    continue
+            result.append(char)
+        i += 1
+
+    if in_string:
+        result.append('"')
+    while result and result[-1] in " \n\r\t,":
+        result.pop()
+    result.extend(reversed(stack))
+    return "".join(result)
+
+
+def parse_llm_json(text: str, model: type[T], record_stats: bool = True) -> T | None:
+    """
+    把AI返回的内容解析为指定的pydantic模型，直接解析失败就先本地修复再解析，修复结果会被计数
+
+    :param text: AI返回的原始内容
+    :param model: 目标模型，比如SummarizeAiResponse
+    :param record_stats: 是否计入修复统计，缓存校验、级联判断这些只是“看一眼”的解析要传False，
+        同一个回答只在最终解析时计一次
+    :return: 模型实例，修不好就返回None（这时候再去找LLM重试）
+    """
+    if not text:
+        return None
+    try:
+        result = model.model_validate(_load(text))
+        if record_stats:
+            REPAIR_STATS["direct"] += 1
+        return result
+    except Exception:
+        pass
+    try:
+        result = model.model_validate(_load(repair_json(text)))
+        if record_stats:
+            REPAIR_STATS["repaired"] += 1
+            _LOGGER.info(f"ai返回的内容格式有误，本地修复成功，当前修复统计：{dict(REPAIR_STATS)}")
+        return result
+    except Exception:
+        if record_stats:
+            REPAIR_STATS["failed"] += 1
+            _LOGGER.warning(f"ai返回的内容格式有误，本地修复失败，当前修复统计：{dict(REPAIR_STATS)}")
+        return None
@@ -0,0 +1,102 @@
+"""按key分道的任务分发器：同一个key的任务严格按提交顺序一个一个处理，不同key之间并发处理，总并发数有上限"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="keyed-dispatcher")
+
+
+class KeyedDispatcher:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[object], Awaitable],
+        max_concurrency: int,
+        lag_warning: float = 600,
+        max_pending: int = None,
+    ):
+        """
+        :param name: 分发器名字，用于日志
+        :param handler: 处理单个任务的协程函数，抛出的异常会被记录，不影响同一道里后面的任务
+        :param max_concurrency: 最多同时处理多少个任务
+        :param lag_warning: 任务排队超过多少秒时打印警告
+        :param max_pending: 手上最多压着多少个任务（包括正在处理的），默认是max_concurrency的两倍，
+            调用方在取新任务前先wait_for_room()，多出来的任务留在持久化队列里，别的进程也能领走
+        """
+        self.name = name
+        self.handler = handler
+        self.lag_warning = lag_warning
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lanes: dict[Hashable, deque] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+        self._recent_lags: deque = deque(maxlen=200)
+        self.max_pending = max_pending or max_concurrency * 2
+        self._room = asyncio.Event()  # 有任务处理完时设置，唤醒等着取新任务的调用方
+        self.processed = 0
+
+    def submit(self, key: Hashable, item):
+        """提交一个任务，立即返回"""
+        self._lanes.setdefault(key, deque()).append((time.monotonic(), item))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._run_lane(key))
+
+    async def _run_lane(self, key: Hashable):
+        lane = self._lanes[key]
+        try:
+            while lane:
+                enqueue_time, item = lane[0]
+                async with self._semaphore:
+                    lag = time.monotonic() - enqueue_time
+                    self._recent_lags.append(lag)
+                    if lag > self.lag_warning:
+                        _LOGGER.warning(f"[{self.name}] 任务排队了{lag:.0f}秒才开始处理，积压比较严重")
+                    try:
+                        await self.handler(item)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        _LOGGER.exception(f"[{self.name}] 处理任务时出现错误，跳过该任务")
+                    self.processed += 1
+                lane.popleft()
+                self._room.set()
+        finally:
+            if not lane:
+                del self._lanes[key]
+            del self._workers[key]
+
+    async def wait_for_room(self):
+        """等到手上的任务数低于max_pending"""
+        while self.pending >= self.max_pending:
+            self._room.clear()
+            await self._room.wait()
+
+    @property
+    def pending(self) -> int:
+        """还没处理完的任务数（包括正在处理的）"""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    @property
+    def oldest_age(self) -> float:
+        """排队最久的任务已经等了多少秒"""
+        now = time.monotonic()
+        return max((now - lane[0][0] for lane in self._lanes.values() if lane), default=0.0)
+
+    def log_metrics(self):
+        """打印积压情况"""
+        lags = sorted(self._recent_lags)
+        p95 = lags[int(len(lags) * 0.95)] if lags else 0.0
+        _LOGGER.info(
+            f"[{self.name}] 积压{self.pending}个任务（{len(self._lanes)}道），最久的已等待{self.oldest_age:.0f}秒；"
+            f"已处理{self.processed}个，最近排队时间p95为{p95:.0f}秒"
+        )
+
+    async def close(self):
+        """取消所有正在处理的任务"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
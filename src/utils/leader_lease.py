@@ -0,0 +1,66 @@
+"""主节点选举：同时运行多个副本时，只有拿到租约的副本轮询b站，其他副本热备，主节点挂掉租约到期后由热备接手"""
+
+import os
+import socket
+import time
+import uuid
+
+from src.utils.file_tools import open_sqlite
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="leader-lease")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leader_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LeaderLease:
+    def __init__(self, db_path: str, ttl: float, name: str = "poller"):
+        """
+        :param db_path: 租约数据库位置，所有副本要用同一个文件
+        :param ttl: 租约有效期（秒），主节点挂掉后最多这么久就会有热备接手，续约间隔是它的三分之一
+        :param name: 租约名，不同的租约互不影响
+        """
+        self.conn = open_sqlite(db_path)
+        self.conn.executescript(_SCHEMA)
+        self.ttl = ttl
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._expires_at = 0.0  # 自己持有的租约什么时候到期，没持有时为0
+
+    @property
+    def is_leader(self) -> bool:
+        """自己是否是主节点（租约还没到期）"""
+        return self._expires_at > time.time()
+
+    def renew(self) -> bool:
+        """续约，没人持有或租约已经到期时抢过来，返回自己是否是主节点"""
+        was_leader = self.is_leader
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO leader_lease (name, holder, expires_at) VALUES (?, ?, ?) ON CONFLICT (name) "
+            "DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leader_lease.holder = excluded.holder OR leader_lease.expires_at < ?",
+            (self.name, self.holder, now + self.ttl, now),
+        )
+        holder, expires_at = self.conn.execute(
+            "SELECT holder, expires_at FROM leader_lease WHERE name = ?", (self.name,)
+        ).fetchone()
+        self._expires_at = expires_at if holder == self.holder else 0.0
+        if self.is_leader and not was_leader:
+            _LOGGER.info(f"[{self.name}] 成为主节点（{self.holder}），开始轮询b站")
+        elif was_leader and not self.is_leader:
+            _LOGGER.warning(f"[{self.name}] 租约被{holder}抢走，转为热备")
+        return self.is_leader
+
+    def release(self):
+        """主动释放租约（正常关闭时调用），热备下次续约时就能接手，不用等租约到期"""
+        if self.is_leader:
+            self.conn.execute("DELETE FROM leader_lease WHERE name = ? AND holder = ?", (self.name, self.holder))
+            _LOGGER.info(f"[{self.name}] 已释放主节点租约")
+        self._expires_at = 0.0
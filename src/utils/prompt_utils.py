@@ -18,3 +18,13 @@ def build_openai_style_messages(user_msg, system_msg=None, user_keyword="user",
         messages.append({"role": system_keyword, "content": system_msg})
     messages.append({"role": user_keyword, "content": user_msg})
     return messages
+
+
+def estimate_tokens(prompt) -> int:
+    """粗略估算prompt的token数（中文差不多一个字一个token），只用于限流预估，不求精确
+    :param prompt: openai格式的消息列表或字符串
+    :return: 估算的token数
+    """
+    if isinstance(prompt, list):
+        return sum(len(str(message.get("content", ""))) for message in prompt)
+    return len(str(prompt))
@@ -0,0 +1,153 @@
+"""AskAI问题的近似去重缓存：同一个视频下换个说法问同一个问题，直接复用之前的回答，不再调用LLM
+
+纯CPU实现：问题先做简单的规范化（同义词替换、去掉语气词），再按字符的1-gram和2-gram生成MinHash签名，
+用签名估算Jaccard相似度，超过阈值的再逐字比对：两个问题只差语气词、“的”“了”这种虚词时才算同一个问题，
+差了“没有”“华为/苹果”这种实词的一律不算（字面很像但问的不是一回事）。问题里的数字不一样时也不算
+"""
+
+import difflib
+import hashlib
+import re
+from collections import OrderedDict, deque
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="question-cache")
+
+NUM_PERM = 64  # MinHash签名长度
+_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _PRIME | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME,
+    )
+    for i in range(NUM_PERM)
+]
+
+# 把常见的不同说法统一成一种，提高换个说法问同一个问题时的相似度
+SYNONYMS = (
+    ("主要内容是", "讲了"),
+    ("内容是", "讲了"),
+    ("讲的是", "讲了"),
+    ("说的是", "讲了"),
+    ("说了", "讲了"),
+    ("在讲", "讲了"),
+    ("啥", "什么"),
+    ("咋", "怎么"),
+)
+_CN_DIGITS = "零一二三四五六七八九十百千万两"
+# 阿拉伯数字，以及“第三十八”“三十八分钟”这种明显是数字的中文数字（不匹配“一个”“一下”里的“一”）
+_NUMBER = re.compile(
+    rf"\d+(?:\.\d+)?|第[{_CN_DIGITS}]+|[{_CN_DIGITS}]+(?=分钟|分|秒|小时|点|元|块|岁|年|月|号|集|期|倍|次)"
+)
+FILLERS = ("请问", "问一下", "一下", "这个视频", "这期视频", "视频里", "视频", "up主", "呢", "吗", "呀", "啊", "吧")
+
+# 两个问题只差这些字的话仍然算同一个问题
+NEUTRAL_WORDS = ("到底", "究竟", "具体", "一下", "的", "地", "得", "了", "是", "个", "那", "这", "都", "就", "还", "又")
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题：转小写、去标点空白、同义词替换、去语气词"""
+    text = re.sub(r"[\W_]+", "", question.lower())
+    for old, new in SYNONYMS:
+        text = text.replace(old, new)
+    for filler in FILLERS:
+        text = text.replace(filler, "")
+    return text
+
+
+def extract_numbers(question: str) -> tuple[str, ...]:
+    """取出问题里的数字，顺序无关"""
+    return tuple(sorted(_NUMBER.findall(question.lower())))
+
+
+def _is_neutral(text: str) -> bool:
+    for word in NEUTRAL_WORDS:
+        text = text.replace(word, "")
+    return not text
+
+
+def only_neutral_differs(a: str, b: str) -> bool:
+    """两个规范化后的问题是否只差虚词"""
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return all(
+        _is_neutral(a[i1:i2]) and _is_neutral(b[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    )
+
+
+def minhash(text: str) -> tuple[int, ...]:
+    """计算MinHash签名（字符1-gram + 2-gram）"""
+    shingles = set(text) | {text[i : i + 2] for i in range(len(text) - 1)}
+    if not shingles:
+        return ()
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a: tuple[int, ...], sig_b: tuple[int, ...]) -> float:
+    """用两个MinHash签名估算Jaccard相似度"""
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(a == b for a, b in zip(sig_a, sig_b, strict=True)) / NUM_PERM
+
+
+class QuestionCache:
+    """按video_id分组保存问过的问题和回答，视频数、每个视频的问题数都有上限，超出时淘汰最久的"""
+
+    def __init__(self, threshold: float, max_videos: int, max_questions_per_video: int):
+        self.threshold = threshold
+        self.max_videos = max_videos
+        self.max_questions_per_video = max_questions_per_video
+        self._videos: OrderedDict[str, deque] = OrderedDict()
+
+    def lookup(self, video_id: str, question: str) -> dict | None:
+        """
+        查找相似的问题
+        :param video_id: bvid
+        :param question: 用户问题
+        :return: 相似度最高且超过阈值的那个问题的回答，没有则返回None
+        """
+        entries = self._videos.get(video_id)
+        if not entries:
+            return None
+        normalized = normalize_question(question)
+        signature = minhash(normalized)
+        numbers = extract_numbers(question)
+        best_score, best_entry = 0.0, None
+        for entry in entries:
+            if entry["numbers"] != numbers:  # 只差一个数字的问题（第37分钟、第38分钟）字面上很像，但问的不是一回事
+                continue
+            if not only_neutral_differs(normalized, entry["normalized"]):  # 差了实词（没有、华为/苹果）
+                continue
+            score = similarity(signature, entry["signature"])
+            if score > best_score:
+                best_score, best_entry = score, entry
+        if best_entry is None or best_score < self.threshold:
+            return None
+        self._videos.move_to_end(video_id)
+        _LOGGER.info(
+            f"问题「{question}」与之前的问题「{best_entry['question']}」相似度为{best_score:.2f}，直接复用回答"
+        )
+        return best_entry["response"]
+
+    def add(self, video_id: str, question: str, response: dict):
+        """记录一个问题和它的回答"""
+        normalized = normalize_question(question)
+        signature = minhash(normalized)
+        if not signature:
+            return
+        entries = self._videos.setdefault(video_id, deque(maxlen=self.max_questions_per_video))
+        entries.append(
+            {
+                "question": question,
+                "normalized": normalized,
+                "signature": signature,
+                "numbers": extract_numbers(question),
+                "response": response,
+            }
+        )
+        self._videos.move_to_end(video_id)
+        while len(self._videos) > self.max_videos:
+            self._videos.popitem(last=False)
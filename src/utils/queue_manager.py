@@ -1,9 +1,8 @@
-import asyncio
 import json
 import traceback
-from copy import deepcopy
 
 from src.models.task import BiliGPTTask
+from src.utils.durable_queue import DurableQueue, open_queue_db, release_leases
 from src.utils.file_tools import read_file, save_file
 from src.utils.logging import LOGGER
 
@@ -11,17 +10,36 @@ _LOGGER = LOGGER
 
 
 class QueueManager:
-    """队列管理器"""
+    """队列管理器，所有队列都保存在同一个SQLite数据库里"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        db_path: str,
+        visibility_timeout: float = 300,
+        max_attempts: int = 3,
+        priorities: dict[str, int] = None,
+        aging_interval: float = 600,
+    ):
         _LOGGER.debug("初始化队列管理器")
-        self.queues = {}
+        self.conn = open_queue_db(db_path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.priorities = priorities
+        self.aging_interval = aging_interval
+        self.queues: dict[str, DurableQueue] = {}
         self.saved_queue = {}
 
-    def get_queue(self, queue_name: str) -> asyncio.Queue:
+    def get_queue(self, queue_name: str) -> DurableQueue:
         if queue_name not in self.queues:
             _LOGGER.debug(f"正在创建{queue_name}队列")
-            self.queues[queue_name] = asyncio.Queue()
+            self.queues[queue_name] = DurableQueue(
+                self.conn,
+                queue_name,
+                self.visibility_timeout,
+                self.max_attempts,
+                priorities=self.priorities,
+                aging_interval=self.aging_interval,
+            )
         return self.queues.get(queue_name)
 
     def _save(self, file_path: str):
@@ -31,55 +49,45 @@ class QueueManager:
     def _load(self, file_path: str):
         try:
             content = read_file(file_path)
-            if not content:
-                self.saved_queue = json.loads(content)
-            else:
-                self.saved_queue = {}
-                self._save(file_path)
+            self.saved_queue = json.loads(content) if content else {}
         except Exception:
             _LOGGER.error("在读取已保存的队列文件中出现问题！暂时跳过恢复，但不影响使用，请自行检查！")
             traceback.print_exc()
             self.saved_queue = {}
 
-    def safe_close_queue(self, queue_name: str, saved_json_path: str):
+    def recover_queue(self, saved_json_path: str, release_leases_now: bool = True):
         """
-        安全关闭队列（会对队列中任务进行保存）
-        :param queue_name: 队列名
-        :param saved_json_path: 保存位置
-        :return:
-        """
-        queue_list = []
-        queue = self.get_queue(queue_name)
-        while not queue.empty():
-            item: BiliGPTTask = queue.get_nowait()
-            queue_list.append(item)
-        _LOGGER.debug(f"共保存了{len(queue_list)}条数据！")
-        self.saved_queue[queue_name] = queue_list
-        self._save(saved_json_path)
-
-    def safe_close_all_queues(self, saved_json_path: str):
-        """
-        保存所有的队列(我建议使用这个)
-        :param saved_json_path:
-        :return:
-        """
-        for queue in list(self.saved_queue.keys()):
-            _LOGGER.debug(f"保存{queue}队列的任务")
-            self.safe_close_queue(queue, saved_json_path)
-
-    def recover_queue(self, saved_json_path: str):
-        """
-        恢复保存在文件中的任务信息
-        :param saved_json_path:
+        启动时调用：把上次运行中取出但没处理完的任务放回队列，并把旧版本保存在json文件里的任务迁移到数据库
+        :param saved_json_path: 旧版本的队列保存位置
+        :param release_leases_now: 是否马上放回上次没处理完的任务，多进程运行时要传False（等租约到期自然放回）
         :return:
         """
+        if release_leases_now:
+            released = release_leases(self.conn)
+            if released:
+                _LOGGER.info(f"上次运行中断时有{released}个任务正在处理，已放回队列")
         self._load(saved_json_path)
-        _queue_dict = deepcopy(self.saved_queue)
-        for queue_name in list(self.saved_queue.keys()):
-            _LOGGER.debug(f"开始恢复{queue_name}")
+        if not self.saved_queue:
+            return
+        for queue_name, tasks in self.saved_queue.items():
+            _LOGGER.debug(f"开始迁移{queue_name}队列的{len(tasks)}个任务")
             queue = self.get_queue(queue_name)
-            for task in self.saved_queue[queue_name]:
-                queue.put_nowait(task)
-            del _queue_dict[queue_name]
-        self.saved_queue = _queue_dict
+            for task in tasks:
+                try:
+                    queue.put_nowait(BiliGPTTask.model_validate(task))
+                except Exception:
+                    traceback.print_exc()
+                    _LOGGER.error(f"迁移{queue_name}队列的任务时出现错误，跳过该任务")
+        self.saved_queue = {}
         self._save(saved_json_path)
+
+    def heartbeat(self):
+        """给本进程正在处理的所有任务续租约，需要定时调用（间隔要比visibility_timeout短）"""
+        for queue in self.queues.values():
+            queue.heartbeat()
+
+    def close(self):
+        """关闭队列数据库，队列里的任务已经实时保存，下次启动时继续处理"""
+        for name, queue in self.queues.items():
+            _LOGGER.debug(f"{name}队列还有{queue.qsize()}个任务")
+        self.conn.close()
@@ -0,0 +1,82 @@
+"""给LLM/ASR后端用的令牌桶限流器，额度不够时排队等待，而不是撞上429再报错"""
+
+import asyncio
+import contextlib
+import time
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="rate-limiter")
+
+BURST_RATIO = 0.1  # 桶容量只取每分钟额度的1/10，避免突发请求一下打满额度后整整停顿一分钟，吞吐来回震荡
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，令牌不够就排队等"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        """
+        取走amount个令牌，不够就等
+        单次需求超过桶容量时（比如一个很长的prompt），等到桶满后直接透支，后面的请求会多等一会儿补上
+        """
+        async with self._lock:  # asyncio.Lock是先来先服务的，排队的请求不会被插队
+            need = min(amount, self.capacity)
+            self._refill()
+            while self._tokens < need:
+                await asyncio.sleep((need - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, amount: float):
+        """按实际用量修正，amount为正表示比预估多用了，为负表示预估多了要退回"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class ProviderLimiter:
+    """单个后端的限流器，包含RPM、TPM两个令牌桶和一个最大并发数信号量，值为0的项不做限制"""
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0, max_concurrency: int = 0):
+        self.name = name
+        self.rpm_bucket = TokenBucket(rpm / 60, max(1.0, rpm * BURST_RATIO)) if rpm > 0 else None
+        self.tpm_bucket = TokenBucket(tpm / 60, max(1.0, tpm * BURST_RATIO)) if tpm > 0 else None
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+
+    @contextlib.asynccontextmanager
+    async def limit(self, tokens: int = 0):
+        """
+        在这个上下文里发起一次请求
+
+        :param tokens: 预估这次请求会消耗的token数，请求结束后记得用settle按实际用量修正
+        """
+        begin = time.perf_counter()
+        async with self.semaphore if self.semaphore else contextlib.nullcontext():
+            if self.rpm_bucket:
+                await self.rpm_bucket.acquire()
+            if self.tpm_bucket and tokens > 0:
+                await self.tpm_bucket.acquire(tokens)
+            waited = time.perf_counter() - begin
+            if waited > 1:
+                _LOGGER.debug(f"{self.name} 触发限流，排队等待了{waited:.2f}s")
+            yield
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """请求结束后，用实际消耗的token数修正TPM令牌桶"""
+        if self.tpm_bucket and actual_tokens:
+            self.tpm_bucket.adjust(actual_tokens - estimated_tokens)
@@ -0,0 +1,52 @@
+"""视频字幕缓存，按bvid保存拿到的字幕（尤其是语音转写出来的），总结和问答、预取和用户请求之间共用"""
+
+import time
+
+from src.utils.file_tools import open_sqlite
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="subtitle-cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subtitles (
+    bvid TEXT PRIMARY KEY,
+    subtitle TEXT NOT NULL,
+    source TEXT NOT NULL,  -- bilibili: b站自带字幕；asr: 语音转写
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subtitles_created ON subtitles (created_at);
+"""
+
+
+class SubtitleCache:
+    def __init__(self, db_path: str, ttl: int, max_entries: int):
+        """
+        :param db_path: 缓存数据库位置，多个进程共用
+        :param ttl: 缓存有效期（秒）
+        :param max_entries: 最多缓存多少个视频，超出后淘汰最早缓存的
+        """
+        self.conn = open_sqlite(db_path)
+        self.conn.executescript(_SCHEMA)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, bvid: str) -> str | None:
+        """获取字幕，没有或已过期返回None"""
+        row = self.conn.execute(
+            "SELECT subtitle FROM subtitles WHERE bvid = ? AND created_at > ?", (bvid, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, bvid: str, subtitle: str, source: str):
+        """保存字幕，顺便清理过期和超出数量的"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO subtitles (bvid, subtitle, source, created_at) VALUES (?, ?, ?, ?)",
+            (bvid, subtitle, source, now),
+        )
+        self.conn.execute("DELETE FROM subtitles WHERE created_at <= ?", (now - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM subtitles WHERE bvid NOT IN (SELECT bvid FROM subtitles ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        _LOGGER.debug(f"已缓存视频{bvid}的字幕（来源：{source}）")
@@ -1,54 +1,74 @@
+import contextlib
 import enum
 import json
-from typing import Union
+import os
 
 from src.models.task import BiliGPTTask, Chains, ProcessStages
 from src.utils.exceptions import LoadJsonError
-from src.utils.file_tools import read_file, save_file
+from src.utils.file_tools import open_sqlite
 from src.utils.logging import LOGGER
 
 _LOGGER = LOGGER.bind(name="task-status-record")
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    uuid TEXT PRIMARY KEY,
+    chain TEXT,
+    process_stage TEXT,
+    data TEXT NOT NULL  -- 完整的任务数据（json）
+);
+CREATE INDEX IF NOT EXISTS idx_records_chain ON records (chain, process_stage);
+"""
+
 
 class TaskStatusRecorder:
-    """视频状态记录器"""
+    """视频状态记录器，记录保存在SQLite里，多个进程（监听器和多个处理进程）可以同时读写"""
 
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.video_records = {}
-        self.load()
+    def __init__(self, db_path: str, legacy_file_path: str = None):
+        """
+        :param db_path: 记录数据库位置
+        :param legacy_file_path: 旧版本的json记录文件，存在的话会迁移到数据库
+        """
+        self.db_path = db_path
+        self.conn = open_sqlite(db_path)
+        self.conn.executescript(_SCHEMA)
+        if legacy_file_path:
+            self._migrate(legacy_file_path)
 
-    def load(self):
-        # if os.path.exists(self.file_path):
-        #     with open(self.file_path, encoding="utf-8") as f:
-        #         if os.path.getsize(self.file_path) == 0:
-        #             self.video_records = {}
-        #         else:
-        #             self.video_records = json.load(f)
-        # else:
-        #     self.video_records = {}
-        #     self.save()
+    def _migrate(self, file_path: str):
+        """把旧版本json文件里的记录迁移到数据库，迁移完把文件改名，避免重复迁移"""
         try:
-            content = read_file(self.file_path)
-            if content:
-                self.video_records = json.loads(content)
-            else:
-                self.video_records = {}
-                self.save()
+            with open(file_path, encoding="utf-8") as f:
+                content = f.read()
+            records = json.loads(content) if content else {}
+        except FileNotFoundError:
+            return  # 没有旧文件，或者已经被其他进程迁移了
         except Exception as e:
             raise LoadJsonError("在读取视频记录文件时出现问题！程序已停止运行，请自行检查问题所在") from e
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for _uuid, record in records.items():
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO records (uuid, chain, process_stage, data) VALUES (?, ?, ?, ?)",
+                    (_uuid, record.get("chain"), record.get("process_stage"), json.dumps(record, ensure_ascii=False)),
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        with contextlib.suppress(FileNotFoundError):
+            os.replace(file_path, file_path + ".migrated")
+        _LOGGER.info(f"已把{len(records)}条旧版本的任务记录迁移到数据库{self.db_path}")
 
-    # except Exception as e:
-    #     _LOGGER.error(f"读取视频状态记录文件失败，错误信息为{e}，恢复为初始文件")
-    #     self.video_records = {}
-    #     # with open(self.file_path, "w", encoding="utf-8") as f:
-    #     #     json.dump(self.video_records, f, ensure_ascii=False, indent=4)
-    #     save_file(json.dumps(self.video_records), self.file_path)
+    def _save_record(self, _uuid: str, record: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO records (uuid, chain, process_stage, data) VALUES (?, ?, ?, ?)",
+            (_uuid, record.get("chain"), record.get("process_stage"), json.dumps(record, ensure_ascii=False)),
+        )
 
-    def save(self):
-        # with open(self.file_path, "w", encoding="utf-8") as f:
-        #     json.dump(self.video_records, f, ensure_ascii=False, indent=4)
-        save_file(json.dumps(self.video_records, ensure_ascii=False, indent=4), self.file_path)
+    def _load_record(self, _uuid: str) -> dict | None:
+        row = self.conn.execute("SELECT data FROM records WHERE uuid = ?", (_uuid,)).fetchone()
+        return json.loads(row[0]) if row else None
 
     def get_record_by_stage(
         self,
@@ -59,52 +79,48 @@ class TaskStatusRecorder:
         根据stage获取记录
         当stage为None时，返回所有记录
         """
-        records = []
         if stage is None:
-            for record in self.video_records.values():
-                if record["chain"] == chain.value:
-                    records.append(record)
-            return records
-        for record in self.video_records.values():
-            if record["process_stage"] == stage.value and record["chain"] == chain.value:
-                records.append(record)
-        return records
+            rows = self.conn.execute("SELECT data FROM records WHERE chain = ?", (chain.value,))
+        else:
+            rows = self.conn.execute(
+                "SELECT data FROM records WHERE chain = ? AND process_stage = ?", (chain.value, stage.value)
+            )
+        return [json.loads(row[0]) for row in rows]
 
     def create_record(self, item: BiliGPTTask):
-        """创建一条记录，返回一条uuid，可以根据uuid修改记录"""
-        self.video_records[str(item.uuid)] = item.model_dump(mode="json")
-        # del self.video_records[item.uuid]["raw_task_data"]["video_event"]["content"]
-        self.save()
+        """创建一条记录，返回一条uuid，可以根据uuid修改记录
+        任务被重新投递（比如崩溃重启）时已有记录里的转写断点会保留下来"""
+        record = item.model_dump(mode="json")
+        if record.get("asr_checkpoint") is None:
+            old_record = self._load_record(str(item.uuid))
+            if old_record is not None:
+                record["asr_checkpoint"] = old_record.get("asr_checkpoint")
+        self._save_record(str(item.uuid), record)
         return item.uuid
 
-    def update_record(self, _uuid: str, new_task_data: Union[BiliGPTTask, None], **kwargs) -> bool:
+    def update_record(self, _uuid: str, new_task_data: BiliGPTTask | None, **kwargs) -> bool:
         """根据uuid更新记录"""
-        # record: BiliGPTTask = self.video_records[_uuid]
         _uuid = str(_uuid)
-        if new_task_data is not None:
-            self.video_records[_uuid] = new_task_data.model_dump(mode="json")
-            # del self.video_records[_uuid]["raw_task_data"]["video_event"]["content"]
-        if self.video_records[_uuid] is None:
-            return False
-        for key, _value in kwargs.items():
-            if isinstance(_value, enum.Enum):
-                _value = _value.value
-            if key == "process_stage":
-                self.video_records[_uuid]["process_stage"] = _value
-            if key in self.video_records[_uuid]:
-                self.video_records[_uuid][key] = _value
-            else:
-                _LOGGER.warning(f"尝试更新不存在的字段：{key}，跳过")
-        self.save()
+        self.conn.execute("BEGIN IMMEDIATE")  # 读改写期间不让其他进程插进来
+        try:
+            record = new_task_data.model_dump(mode="json") if new_task_data is not None else self._load_record(_uuid)
+            if record is None:
+                self.conn.execute("ROLLBACK")
+                return False
+            for key, _value in kwargs.items():
+                if isinstance(_value, enum.Enum):
+                    _value = _value.value
+                if key in record:
+                    record[key] = _value
+                else:
+                    _LOGGER.warning(f"尝试更新不存在的字段：{key}，跳过")
+            self._save_record(_uuid, record)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
         return True
 
-    # def get_uuid_by_data(self, data: BiliGPTTask):
-    #     """根据data获取uuid"""
-    #     for _uuid, record in self.tasks.items():
-    #         if record["data"] == data:
-    #             return _uuid
-    #     return None
-
     def get_data_by_uuid(self, _uuid: str) -> BiliGPTTask:
         """根据uuid获取data"""
-        return self.video_records[_uuid]
+        return BiliGPTTask.model_validate(self._load_record(str(_uuid)))
@@ -0,0 +1,45 @@
+"""发送前按长度切分回复内容，尽量在句子边界切，避免撞上b站的字数墙"""
+
+import re
+
+# 换行、句末标点；英文句号后面要跟空白才算，不会把3.5、网址切开
+_SENTENCE_END = re.compile(r"(?<=[\n。！？!?…])|(?<=\.)(?=\s)")
+_CLAUSE_END = re.compile(r"(?<=[；;，,、])")  # 一句话太长时退而求其次，在分句标点处切
+
+
+def _segments(text: str, limit: int) -> list[str]:
+    """把文本拆成不超过limit的最小片段（保留标点和换行），优先按句子拆，其次按分句，最后硬切"""
+    segments = []
+    for sentence in filter(None, _SENTENCE_END.split(text)):
+        if len(sentence) <= limit:
+            segments.append(sentence)
+            continue
+        for clause in filter(None, _CLAUSE_END.split(sentence)):
+            segments.extend(clause[i : i + limit] for i in range(0, len(clause), limit))
+    return segments
+
+
+def split_text(text: str, limit: int, numbered: bool = False) -> list[str]:
+    """
+    把回复内容切成若干段，每段都不超过limit
+
+    :param text: 回复内容
+    :param limit: 单条消息的最大长度
+    :param numbered: 切成多段时是否在每段末尾加上（1/3）这样的序号，序号的长度也算在limit里
+    :return: 切好的片段列表
+    """
+    text = text.strip()
+    if len(text) <= limit:
+        return [text]
+    if numbered:
+        limit -= 8  # 给序号留的位置，比如"（12/13）"
+    chunks = [""]
+    for segment in _segments(text, limit):
+        if len(chunks[-1]) + len(segment) <= limit:
+            chunks[-1] += segment
+        else:
+            chunks.append(segment)
+    chunks = [chunk.strip() for chunk in chunks if chunk.strip()]
+    if numbered and len(chunks) > 1:
+        return [f"{chunk}（{index}/{len(chunks)}）" for index, chunk in enumerate(chunks, 1)]
+    return chunks
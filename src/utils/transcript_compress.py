@@ -0,0 +1,126 @@
+"""字幕压缩：送进prompt之前把字幕里重复、啰嗦的部分去掉，少花token，LLM也回得更快
+
+全部是确定性的文本处理，同样的字幕压缩结果总是一样的（不会让LLM调用缓存失效）：
+1. 规范化空白和标点，把“哈哈哈哈哈哈”这种长串重复字缩短（数字不动）
+2. 去掉纯语气词的字幕条
+3. 去掉和最近几条完全相同、几乎相同或者被包含的字幕条（b站字幕常见的重复短句、语音转写切片重叠部分转出来的重复内容），
+   后一条是前一条的扩写（“今天我们” -> “今天我们来聊聊”）时只保留后一条
+4. 把零碎的字幕条合并成句子，一句一行
+5. （可选）去掉信息量很低的字幕条
+"""
+
+import re
+
+DEDUPE_WINDOW = 8  # 和最近多少条比较是否重复
+NEAR_DUPLICATE = 0.8  # 字符2-gram的Jaccard相似度超过这个值就认为是重复
+MAX_SENTENCE_LENGTH = 80  # 合并字幕条时一句话最长多少字，超过就换行
+FILLERS = (
+    "嗯",
+    "啊",
+    "呃",
+    "额",
+    "哦",
+    "噢",
+    "唉",
+    "诶",
+    "欸",
+    "哎",
+    "那个",
+    "就是",
+    "然后",
+    "对",
+    "好",
+    "哈",
+    "呀",
+    "吧",
+    "嘛",
+)
+
+_SENTENCE_END = "。！？!?…"
+_FILLER_ONLY = re.compile(rf"^(?:{'|'.join(FILLERS)}|[\s\W_])+$")
+_REPEATED_CHAR = re.compile(r"([^\W\d_])\1{3,}")  # 同一个字连续出现4次以上（数字不算，“10000”不能被改掉）
+_REPEATED_PUNCT = re.compile(r"([，,。.！!？?～~、；;])\1+")
+_ASR_SPLIT = re.compile(r"(?<=[。！？!?…；;，,\n])|\s+")  # 语音转写结果按标点和空白拆成字幕条
+
+
+def split_cues(text: str) -> list[str]:
+    """把一整段字幕（比如语音转写的结果）拆成一条条的短句"""
+    return [cue for cue in _ASR_SPLIT.split(text) if cue and cue.strip()]
+
+
+def _normalize(cue: str) -> str:
+    cue = re.sub(r"\s+", " ", cue).strip()
+    cue = _REPEATED_CHAR.sub(r"\1\1\1", cue)
+    return _REPEATED_PUNCT.sub(r"\1", cue)
+
+
+def _plain(text: str) -> str:
+    """去掉标点空白、转小写，只用来比较是否重复"""
+    return re.sub(r"[\W_]+", "", text.lower())
+
+
+def _bigrams(plain: str) -> set[str]:
+    return {plain[i : i + 2] for i in range(len(plain) - 1)} or {plain}
+
+
+def _is_duplicate(plain: str, recent: list[str]) -> bool:
+    grams = _bigrams(plain)
+    for other in recent:
+        if plain in other:
+            return True
+        other_grams = _bigrams(other)
+        if len(grams & other_grams) / len(grams | other_grams) >= NEAR_DUPLICATE:
+            return True
+    return False
+
+
+def _is_low_info(plain: str) -> bool:
+    """信息量很低的字幕条：只有一个字，或者翻来覆去就那几个字（“这这这”“对对对对”）"""
+    return len(plain) < 2 or len(set(plain)) / len(plain) < 0.4
+
+
+def _join(left: str, right: str) -> str:
+    """把两条字幕接起来，中文之间补逗号，英文单词之间补空格"""
+    if not left:
+        return right
+    if left[-1] in _SENTENCE_END + "，,；;：:":
+        return left + right
+    if left[-1].isascii() and left[-1].isalnum() and right[0].isascii() and right[0].isalnum():
+        return f"{left} {right}"
+    return f"{left}，{right}"
+
+
+def compress_transcript(cues: list[str], drop_low_info: bool = False) -> tuple[str, float]:
+    """
+    压缩字幕
+
+    :param cues: 一条条的字幕（b站字幕的每一条，或者split_cues拆出来的语音转写结果）
+    :param drop_low_info: 是否去掉信息量很低的字幕条（可能会误删很短但有用的内容，默认不开）
+    :return: (压缩后的字幕，一句一行, 压缩后长度占原长度的比例)
+    """
+    original_length = sum(len(cue) for cue in cues) + max(len(cues) - 1, 0)  # 原来是一条一行拼起来的
+    kept: list[str] = []
+    recent: list[str] = []
+    for cue in cues:
+        cue = _normalize(cue)
+        if not cue or _FILLER_ONLY.match(cue):
+            continue
+        plain = _plain(cue)
+        if not plain or _is_duplicate(plain, recent) or (drop_low_info and _is_low_info(plain)):
+            continue
+        if recent and recent[-1] in plain:  # 后一条是前一条的扩写，只留后一条
+            kept.pop()
+            recent.pop()
+        recent = (recent + [plain])[-DEDUPE_WINDOW:]
+        kept.append(cue)
+
+    sentences = [""]
+    for cue in kept:
+        if sentences[-1] and len(sentences[-1]) + len(cue) > MAX_SENTENCE_LENGTH:
+            sentences.append("")
+        sentences[-1] = _join(sentences[-1], cue)
+        if cue[-1] in _SENTENCE_END:
+            sentences.append("")
+    text = "\n".join(sentence for sentence in sentences if sentence)
+    ratio = len(text) / original_length if original_length else 1.0
+    return text, ratio
@@ -0,0 +1,152 @@
+"""字幕检索：把长字幕切成小块建BM25索引，AskAI只把和问题相关的几块放进prompt，长视频提问的耗时和花费基本不变
+
+纯CPU实现：中文按字符2-gram、英文和数字按单词切词，不需要分词库和向量模型。索引按视频缓存在内存里，
+同一个视频被反复提问时不用重新建索引
+"""
+
+import hashlib
+import math
+import re
+from collections import Counter, OrderedDict
+
+from src.utils.logging import LOGGER
+
+_LOGGER = LOGGER.bind(name="transcript-index")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+_WORD = re.compile(r"[a-z0-9]+|[^\W\da-z_]+")  # 英文、数字单词，或者一段连续的中文（其他文字）
+# 提问时的套话，和视频内容无关。检索前从问题里去掉，不然“这个视频主要讲了什么”会命中字幕里碰巧有“视频”“讲了”的那几块，
+# 笼统的问题就拿不到均匀分布的字幕了
+# 长的写在前面，先匹配
+_STOP_PHRASE = re.compile(
+    r"这[个期]视频|视频|这[个期]|up主|主要|[讲说]了什么|讲的是什么|[讲说][了的]|什么|内容|总结一下|总结|概括|一下|请问"
+    r"|是?啥|怎么样?|[吗呢吧的了是]"
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """英文、数字按单词，中文按字符2-gram（单个字的词保留单字）"""
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def strip_question(question: str) -> str:
+    """去掉问题里的套话，换成空格，前后的字不会拼成新的2-gram"""
+    return _STOP_PHRASE.sub(" ", question.lower())
+
+
+def chunk_transcript(text: str, chunk_size: int, overlap: int) -> list[str]:
+    """
+    按行把字幕拼成不超过chunk_size的块，相邻的块重叠overlap个字左右，避免答案刚好被切在两块中间
+
+    :param text: 字幕，一句一行（压缩后的字幕就是这样）
+    :param chunk_size: 每块最多多少字，单独一行就超过的会被硬切
+    :param overlap: 相邻两块大约重叠多少字
+    """
+    lines = []
+    for line in filter(None, (line.strip() for line in text.splitlines())):
+        lines.extend(line[i : i + chunk_size] for i in range(0, len(line), chunk_size))
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end = start
+        length = 0
+        while end < len(lines) and (end == start or length + 1 + len(lines[end]) <= chunk_size):
+            length += len(lines[end]) + (end > start)  # 算上换行
+            end += 1
+        chunks.append("\n".join(lines[start:end]))
+        if end >= len(lines):
+            break
+        # 下一块从末尾往回数overlap个字左右的那一行开始，但至少要往前走一行
+        back = end
+        tail = 0
+        while back - 1 > start and tail + len(lines[back - 1]) <= overlap:
+            back -= 1
+            tail += len(lines[back])
+        start = back
+    return chunks
+
+
+def spread(total: int, count: int) -> list[int]:
+    """从total块里均匀地挑count块（包括第一块和最后一块）"""
+    if total <= count:
+        return list(range(total))
+    if count == 1:
+        return [0]
+    return sorted({round(i * (total - 1) / (count - 1)) for i in range(count)})
+
+
+class BM25Index:
+    """一个视频字幕的BM25索引"""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks = chunks
+        self.term_freqs = [Counter(tokenize(chunk)) for chunk in chunks]
+        self.lengths = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        doc_freqs = Counter(term for freqs in self.term_freqs for term in freqs)
+        self.idf = {term: math.log(1 + (len(chunks) - freq + 0.5) / (freq + 0.5)) for term, freq in doc_freqs.items()}
+
+    def score(self, query: str) -> list[float]:
+        """每一块和问题的相关度"""
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for freqs, length in zip(self.term_freqs, self.lengths, strict=True):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            scores.append(
+                sum(
+                    self.idf[term] * freqs[term] * (BM25_K1 + 1) / (freqs[term] + norm) for term in terms if freqs[term]
+                )
+            )
+        return scores
+
+    def search(self, query: str, top_k: int) -> list[int]:
+        """返回最相关的top_k块的序号（按在字幕里的先后顺序排好），和问题一点都不沾边的块不会返回"""
+        scores = self.score(query)
+        ranked = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+        return sorted(index for index in ranked[:top_k] if scores[index] > 0)
+
+
+class TranscriptIndex:
+    def __init__(self, chunk_size: int, chunk_overlap: int, max_videos: int):
+        """
+        :param chunk_size: 每块最多多少字
+        :param chunk_overlap: 相邻两块大约重叠多少字
+        :param max_videos: 最多缓存多少个视频的索引，超出后淘汰最久没用过的
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_videos = max_videos
+        self._indexes: OrderedDict[str, tuple[str, BM25Index]] = OrderedDict()  # video_id -> (字幕哈希, 索引)
+
+    def get_index(self, video_id: str, subtitle: str) -> BM25Index:
+        """获取视频字幕的索引，没有缓存或者字幕变了就重新建"""
+        digest = hashlib.sha1(subtitle.encode("utf-8")).hexdigest()
+        cached = self._indexes.get(video_id)
+        if cached is not None and cached[0] == digest:
+            self._indexes.move_to_end(video_id)
+            return cached[1]
+        index = BM25Index(chunk_transcript(subtitle, self.chunk_size, self.chunk_overlap))
+        self._indexes[video_id] = (digest, index)
+        self._indexes.move_to_end(video_id)
+        while len(self._indexes) > self.max_videos:
+            self._indexes.popitem(last=False)
+        _LOGGER.debug(f"已为视频{video_id}的字幕建立索引，共{len(index.chunks)}块")
+        return index
+
+    def retrieve(self, video_id: str, subtitle: str, question: str, top_k: int) -> list[str]:
+        """
+        取出和问题最相关的几块字幕，按在字幕里的先后顺序返回
+
+        :return: 相关的字幕块。去掉套话后一块都不相关时（问题太笼统，比如“讲了什么”“总结一下”）
+            返回均匀分布在整个字幕里的top_k块，不然回答只会覆盖视频的某一段
+        """
+        index = self.get_index(video_id, subtitle)
+        hits = index.search(strip_question(question), top_k) or spread(len(index.chunks), top_k)
+        return [index.chunks[i] for i in hits]
@@ -26,6 +26,10 @@ def set_cache(file_path, cache, data: dict, key: str):
     save_file(json.dumps(cache, ensure_ascii=False, indent=4), file_path)
 
 
+def save_cache(file_path, cache):
+    save_file(json.dumps(cache, ensure_ascii=False, indent=4), file_path)
+
+
 def get_up_file(file_path):
     with open(file_path, encoding="utf-8") as f:
         up_list = json.loads(f.read())
@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+from src.asr.asr_base import ASRBase, merge_overlap, remove_temp_files
+
+
+def test_merge_overlap_drops_text_transcribed_twice():
+    prev = "大家好，今天我们来聊一聊显卡。首先看一下这张显卡的外观设计"
+    text = "看一下这张显卡的外观设计，它采用了三风扇方案"
+    assert merge_overlap(prev, text) == "大家好，今天我们来聊一聊显卡。首先看一下这张显卡的外观设计，它采用了三风扇方案"
+
+
+def test_merge_overlap_tolerates_different_punctuation():
+    prev = "and that is why the battery lasts all day."
+    text = " that is why the battery lasts all day, so let's move on"
+    assert merge_overlap(prev, text) == "and that is why the battery lasts all day, so let's move on"
+
+
+def test_merge_overlap_without_common_text_concatenates():
+    assert merge_overlap("第一段的结尾", "第二段开头") == "第一段的结尾第二段开头"
+
+
+class _FakeASR(ASRBase):
+    def __init__(self, segments: list[str], texts: list[str | None]):
+        self.segments = segments
+        self.texts = texts
+
+    def _cut_audio(self, audio_path):
+        return self.segments
+
+    def _sync_transcribe(self, audio_path, **kwargs):
+        return self.texts[self.segments.index(audio_path)]
+
+
+def _segments(tmp_path, count: int) -> list[str]:
+    files = []
+    for num in range(count):
+        path = tmp_path / f"BV1 uuid temp_segment_{num}.mp3"
+        path.write_bytes(b"")
+        files.append(str(path))
+    return files
+
+
+def test_transcribe_segments_joins_without_duplicates(tmp_path):
+    segments = _segments(tmp_path, 3)
+    asr = _FakeASR(
+        segments, ["第一段说到了显卡的外观设计", "显卡的外观设计很好看，接下来看看性能", "接下来看看性能表现吧"]
+    )
+    text = asyncio.run(asr._transcribe_segments(str(tmp_path / "BV1 uuid temp.mp3")))
+    assert text == "第一段说到了显卡的外观设计很好看，接下来看看性能表现吧"
+    assert not any(os.path.exists(file) for file in segments)
+
+
+def test_remove_temp_files_after_permanent_failure(tmp_path):
+    audio = tmp_path / "BV1 uuid temp.mp3"
+    audio.write_bytes(b"")
+    segments = _segments(tmp_path, 2)
+    (tmp_path / "BV1 uuid temp_segment_2.mp3.part").write_bytes(b"")
+    other = tmp_path / "BV1 other temp_segment_0.mp3"
+    other.write_bytes(b"")
+    asr = _FakeASR(segments, ["第一段", None])
+    assert asyncio.run(asr._transcribe_segments(str(audio))) is None
+    assert all(os.path.exists(file) for file in segments)  # 还能重试，先留着
+
+    remove_temp_files(str(audio), str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == [other.name]  # 别的任务的切片不受影响
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from src.bilibili import bili_comment
+from src.bilibili.bili_comment import BiliComment
+from src.models.task import BiliGPTTask
+from src.utils.durable_queue import DurableQueue, open_queue_db
+
+
+class _FakeVideo:
+    def __init__(self, **_):
+        pass
+
+    async def get_video_obj(self):
+        class _Video:
+            @staticmethod
+            def get_aid():
+                return 123
+
+        return _Video(), None
+
+
+def _task() -> BiliGPTTask:
+    return BiliGPTTask.model_validate(
+        {
+            "source_type": "bili_comment",
+            "raw_task_data": {"user": {"nickname": "tester"}},
+            "sender_id": 1,
+            "video_url": "https://www.bilibili.com/video/BV1xx411c7mD",
+            "video_id": "BV1xx411c7mD",
+            "source_command": "总结一下",
+            "process_result": "这是第一句话。" * 30,
+        }
+    )
+
+
+def test_redelivered_reply_resumes_after_sent_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(bili_comment, "BiliVideo", _FakeVideo)
+    queue = DurableQueue(open_queue_db(str(tmp_path / "queue.db")), "reply", retry_delay=0)
+    sender = BiliComment(queue, credential=None, governor=None, max_length=100)
+    sent = []
+    fail_once = {"armed": True}
+
+    async def send(oid, text, root=None):
+        if len(sent) == 1 and fail_once["armed"]:
+            fail_once["armed"] = False
+            raise RuntimeError("网络错误")
+        sent.append((text, root))
+        return {"rpid": 1000 + len(sent)}
+
+    monkeypatch.setattr(sender, "_send_with_retry", send)
+
+    async def run():
+        queue.put_nowait(_task())
+        with pytest.raises(RuntimeError):
+            await sender._handle(queue.get_nowait())
+        await sender._handle(queue.get_nowait())  # 重新投递
+
+    asyncio.run(run())
+    texts = [text for text, _ in sent]
+    assert len(texts) >= 3
+    assert len(texts) == len(set(texts))  # 第一段没有被重复发出
+    assert sent[0][1] is None
+    assert all(root == 1001 for _, root in sent[1:])  # 后面的段落都接在第一段下面
+    assert queue.empty()
+
+
+def test_reply_stops_when_first_rpid_is_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(bili_comment, "BiliVideo", _FakeVideo)
+    queue = DurableQueue(open_queue_db(str(tmp_path / "queue.db")), "reply")
+    sender = BiliComment(queue, credential=None, governor=None, max_length=100)
+    sent = []
+
+    async def send(oid, text, root=None):
+        sent.append(root)
+        return {}
+
+    monkeypatch.setattr(sender, "_send_with_retry", send)
+    queue.put_nowait(_task())
+    asyncio.run(sender._handle(queue.get_nowait()))
+    assert sent == [None]  # 没有拿rpid 0凑合把剩下的段落发成单独的评论
@@ -0,0 +1,55 @@
+import asyncio
+
+from src.bilibili.bili_credential import BiliCredential
+from src.utils.leader_lease import LeaderLease
+
+
+def _credential(db_path: str, leader: LeaderLease) -> BiliCredential:
+    return BiliCredential(
+        SESSDATA="old-sess",
+        bili_jct="old-jct",
+        buvid3="buvid3",
+        dedeuserid="1",
+        ac_time_value="old-token",
+        sched=None,
+        db_path=db_path,
+        leader=leader,
+    )
+
+
+def _patch_network(monkeypatch, refreshed: list):
+    async def check_refresh(self):
+        return True
+
+    async def refresh(self):
+        refreshed.append(self)
+        self.sessdata, self.bili_jct, self.ac_time_value = "new-sess", "new-jct", "new-token"
+
+    async def check_valid(self):
+        return True
+
+    monkeypatch.setattr(BiliCredential, "check_refresh", check_refresh)
+    monkeypatch.setattr(BiliCredential, "refresh", refresh)
+    monkeypatch.setattr(BiliCredential, "check_valid", check_valid)
+
+
+def test_only_leader_refreshes_and_others_sync(tmp_path, monkeypatch):
+    refreshed = []
+    _patch_network(monkeypatch, refreshed)
+    db_path = str(tmp_path / "shared.db")
+    leader_lease = LeaderLease(db_path, ttl=30)
+    standby_lease = LeaderLease(db_path, ttl=30)
+    assert leader_lease.renew() and not standby_lease.renew()
+    leader = _credential(db_path, leader_lease)
+    standby = _credential(db_path, standby_lease)
+
+    asyncio.run(standby._check_refresh())
+    assert refreshed == []
+
+    asyncio.run(leader._check_refresh())
+    assert refreshed == [leader]
+
+    standby.sync()
+    assert (standby.sessdata, standby.bili_jct, standby.ac_time_value) == ("new-sess", "new-jct", "new-token")
+    # 新启动的进程直接拿到刷新过的cookie，不会再用配置文件里已经失效的
+    assert _credential(db_path, LeaderLease(db_path, ttl=30)).ac_time_value == "new-token"
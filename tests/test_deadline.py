@@ -0,0 +1,108 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.chain.summarize import Summarize
+from src.core.routers.chain_router import ChainRouter
+from src.models.config import QueueSettings
+from src.models.task import BiliGPTTask, Chains, EndReasons, ProcessStages
+from src.utils.deadline import DeadlineStatus, check_deadline
+from src.utils.durable_queue import DurableQueue, open_queue_db
+from src.utils.logging import LOGGER
+from src.utils.task_status_record import TaskStatusRecorder
+
+SETTINGS = QueueSettings(
+    soft_deadlines={"bili_comment": 600}, hard_deadlines={"bili_comment": 3600}, admission_max_wait=1800
+)
+
+
+def _task(age: float, **kwargs) -> BiliGPTTask:
+    return BiliGPTTask.model_validate(
+        {
+            "source_type": "bili_comment",
+            "raw_task_data": {},
+            "sender_id": 1,
+            "video_url": "https://www.bilibili.com/video/BV1xx411c7mD",
+            "video_id": "BV1xx411c7mD",
+            "source_command": "总结一下",
+            "chain": Chains.SUMMARIZE,
+            "gmt_create": int(time.time() - age),
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    ("age", "status"),
+    [(60, DeadlineStatus.NORMAL), (1200, DeadlineStatus.DEGRADED), (7200, DeadlineStatus.EXPIRED)],
+)
+def test_check_deadline(age, status):
+    assert check_deadline(_task(age), SETTINGS.soft_deadlines, SETTINGS.hard_deadlines) == status
+
+
+def test_unlisted_source_never_expires():
+    task = _task(10**7, source_type="api")
+    assert check_deadline(task, SETTINGS.soft_deadlines, SETTINGS.hard_deadlines) == DeadlineStatus.NORMAL
+
+
+@pytest.fixture
+def chain(tmp_path):
+    """不走注入器，只装上截止时间判断用得到的部件"""
+    chain = Summarize.__new__(Summarize)
+    chain.config = SimpleNamespace(queue_settings=SETTINGS)
+    chain.task_status_recorder = TaskStatusRecorder(str(tmp_path / "records.db"))
+    chain.summarize_queue = DurableQueue(open_queue_db(str(tmp_path / "queue.db")), "summarize")
+    chain._LOGGER = LOGGER
+    return chain
+
+
+def test_expired_task_is_shed(chain):
+    task = _task(7200)
+    chain.task_status_recorder.create_record(task)
+    assert asyncio.run(chain._shed_if_expired(task))
+    record = chain.task_status_recorder.get_data_by_uuid(task.uuid)
+    assert record.process_stage == ProcessStages.END
+    assert record.end_reason == EndReasons.EXPIRED
+
+
+def test_expired_task_with_result_is_still_sent(chain):
+    task = _task(7200, process_stage=ProcessStages.WAITING_SEND, process_result="总结好的内容")
+    assert not asyncio.run(chain._shed_if_expired(task))
+
+
+def test_fresh_task_is_not_shed(chain):
+    assert not asyncio.run(chain._shed_if_expired(_task(60)))
+
+
+def test_recovery_skips_expired_tasks(chain):
+    fresh, expired = _task(60), _task(7200)
+    for task in (fresh, expired):
+        chain.task_status_recorder.create_record(task)
+    asyncio.run(chain._on_start())
+    assert chain.summarize_queue.get_nowait().uuid == fresh.uuid
+    with pytest.raises(asyncio.QueueEmpty):
+        chain.summarize_queue.get_nowait()
+    assert chain.task_status_recorder.get_data_by_uuid(expired.uuid).end_reason == EndReasons.EXPIRED
+
+
+def test_admission_rejected_when_projected_wait_too_long(tmp_path):
+    conn = open_queue_db(str(tmp_path / "queue.db"))
+    queues = {name: DurableQueue(conn, name) for name in ("summarize", "reply")}
+    router = ChainRouter.__new__(ChainRouter)
+    router.config = SimpleNamespace(queue_settings=SETTINGS)
+    router.queue_manager = SimpleNamespace(get_queue=queues.__getitem__)
+    summarize = queues["summarize"]
+    conn.execute("INSERT INTO queue_stats (queue, service_time) VALUES ('summarize', 600)")
+
+    summarize.put_nowait(_task(0))
+    assert asyncio.run(router._admit(_task(0), summarize))  # 预计等600秒，没超过1800秒
+
+    for _ in range(3):
+        summarize.put_nowait(_task(0))
+    rejected = _task(0)
+    assert not asyncio.run(router._admit(rejected, summarize))  # 预计等2400秒
+    reply = queues["reply"].get_nowait()
+    assert reply.uuid == rejected.uuid
+    assert "排队的任务太多了" in reply.process_result
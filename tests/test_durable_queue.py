@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from src.models.task import BiliGPTTask
+from src.utils import durable_queue
+from src.utils.durable_queue import DurableQueue, open_queue_db
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(durable_queue.time, "time", clock)
+    return clock
+
+
+def _task(uuid: str, sender_id: int = 1, source_type: str = "bili_comment") -> BiliGPTTask:
+    return BiliGPTTask.model_validate(
+        {
+            "uuid": uuid,
+            "source_type": source_type,
+            "raw_task_data": {},
+            "sender_id": sender_id,
+            "video_url": "https://www.bilibili.com/video/BV1xx411c7mD",
+            "video_id": "BV1xx411c7mD",
+            "source_command": "总结一下",
+        }
+    )
+
+
+def _queue(path, **kwargs) -> DurableQueue:
+    return DurableQueue(open_queue_db(str(path)), "summarize", **kwargs)
+
+
+def test_expired_lease_is_redelivered_to_another_process(tmp_path, clock):
+    db = tmp_path / "queue.db"
+    crashed, alive = _queue(db, visibility_timeout=300), _queue(db, visibility_timeout=300)
+    crashed.put_nowait(_task("a"))
+    assert crashed.get_nowait().uuid == "a"
+    with pytest.raises(asyncio.QueueEmpty):
+        alive.get_nowait()  # 租约还没到期
+    clock.now += 301
+    assert alive.get_nowait().uuid == "a"
+
+
+def test_heartbeat_extends_lease(tmp_path, clock):
+    db = tmp_path / "queue.db"
+    worker, other = _queue(db, visibility_timeout=300), _queue(db, visibility_timeout=300)
+    worker.put_nowait(_task("a"))
+    worker.get_nowait()
+    clock.now += 200
+    worker.heartbeat()
+    clock.now += 200  # 距离取出已经400秒，但续过约
+    with pytest.raises(asyncio.QueueEmpty):
+        other.get_nowait()
+    clock.now += 101
+    assert other.get_nowait().uuid == "a"
+
+
+def test_nack_redelivers_after_delay(tmp_path, clock):
+    queue = _queue(tmp_path / "queue.db")
+    queue.put_nowait(_task("a"))
+    queue.nack(queue.get_nowait(), delay=30)
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+    clock.now += 31
+    assert queue.get_nowait().uuid == "a"
+
+
+def test_task_dropped_after_max_attempts(tmp_path, clock):
+    queue = _queue(tmp_path / "queue.db", max_attempts=2)
+    queue.put_nowait(_task("a"))
+    for _ in range(2):
+        queue.nack(queue.get_nowait(), delay=0)
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+    assert queue.empty()
+
+
+def test_projected_wait_divides_by_busy_workers(tmp_path, clock):
+    db = tmp_path / "queue.db"
+    workers = [_queue(db) for _ in range(3)]
+    for num in range(9):
+        workers[0].put_nowait(_task(str(num), sender_id=num))
+    workers[0].conn.execute("INSERT INTO queue_stats (queue, service_time) VALUES ('summarize', 10)")
+    assert workers[0].projected_wait("bili_comment") == 90
+    for worker in workers:
+        worker.get_nowait()
+    assert workers[0].projected_wait("bili_comment") == 30  # 三个进程同时在处理
+
+
+def test_pick_does_not_scan_the_whole_queue(tmp_path):
+    queue = _queue(tmp_path / "queue.db")
+    statements = []
+    queue.conn.set_trace_callback(statements.append)
+    queue.put_nowait(_task("a"))
+    queue.get_nowait()
+    queue.conn.set_trace_callback(None)
+    plans = [
+        detail
+        for sql in statements
+        if sql.startswith("SELECT")
+        for *_, detail in queue.conn.execute("EXPLAIN QUERY PLAN " + sql)
+    ]
+    assert plans and not any(detail.startswith("SCAN") or "TEMP B-TREE" in detail for detail in plans)
+
+
+PRIORITIES = {"bili_comment": 0, "bili_up": 2}
+
+
+def _drain(*queues: DurableQueue) -> list[str]:
+    """几个进程轮流取任务，取到就确认，返回取出的顺序"""
+    order = []
+    while True:
+        for queue in queues:
+            try:
+                task = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return order
+            order.append(task.uuid)
+            queue.ack(task)
+
+
+def test_higher_priority_source_first(tmp_path, clock):
+    queue = _queue(tmp_path / "queue.db", priorities=PRIORITIES)
+    queue.put_nowait(_task("up", source_type="bili_up"))
+    queue.put_nowait(_task("comment", source_type="bili_comment"))
+    assert _drain(queue) == ["comment", "up"]
+
+
+def test_waiting_task_is_promoted(tmp_path, clock):
+    queue = _queue(tmp_path / "queue.db", priorities=PRIORITIES, aging_interval=600)
+    queue.put_nowait(_task("up", source_type="bili_up"))
+    clock.now += 1200  # 等了两个aging_interval，提升到和评论同一级
+    queue.put_nowait(_task("comment", source_type="bili_comment"))
+    assert _drain(queue) == ["up", "comment"]  # 同一级里等得久的先出
+
+
+def test_senders_take_turns(tmp_path, clock):
+    queue = _queue(tmp_path / "queue.db")
+    for num in range(4):
+        queue.put_nowait(_task(f"a{num}", sender_id=1))
+    queue.put_nowait(_task("b0", sender_id=2))
+    queue.put_nowait(_task("c0", sender_id=3))
+    assert _drain(queue) == ["a0", "b0", "c0", "a1", "a2", "a3"]
+
+
+def test_senders_take_turns_across_processes(tmp_path, clock):
+    db = tmp_path / "queue.db"
+    first, second = _queue(db), _queue(db)
+    for num in range(3):
+        first.put_nowait(_task(f"a{num}", sender_id=1))
+        first.put_nowait(_task(f"b{num}", sender_id=2))
+    assert _drain(first, second) == ["a0", "b0", "a1", "b1", "a2", "b2"]
@@ -0,0 +1,77 @@
+import pytest
+from pydantic import BaseModel
+
+from src.utils.json_repair import REPAIR_STATS, parse_llm_json, repair_json
+
+
+class _Answer(BaseModel):
+    summary: str
+    score: int
+    tags: list[str] = []
+
+
+def test_code_fence():
+    text = '```json\n{"summary": "讲了显卡", "score": 80}\n```'
+    assert parse_llm_json(text, _Answer) == _Answer(summary="讲了显卡", score=80)
+
+
+def test_chatter_around_json():
+    text = '好的，以下是总结：\n{"summary": "讲了显卡", "score": 80}\n希望对你有帮助'
+    assert parse_llm_json(text, _Answer) == _Answer(summary="讲了显卡", score=80)
+
+
+def test_trailing_commas():
+    text = '{"summary": "讲了显卡", "score": 80, "tags": ["显卡", "评测",],}'
+    assert parse_llm_json(text, _Answer) == _Answer(summary="讲了显卡", score=80, tags=["显卡", "评测"])
+
+
+def test_single_quotes():
+    text = "{'summary': '讲了显卡', 'score': 80}"
+    assert parse_llm_json(text, _Answer) == _Answer(summary="讲了显卡", score=80)
+
+
+def test_single_quotes_with_python_literals():
+    class _Flagged(BaseModel):
+        summary: str
+        if_no_need_summary: bool
+
+    text = "{'summary': '讲了显卡', 'if_no_need_summary': False,}"
+    assert parse_llm_json(text, _Flagged) == _Flagged(summary="讲了显卡", if_no_need_summary=False)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"summary": "讲了显卡", "score": 80',  # 少了右括号
+        '{"summary": "讲了显卡", "score": 80, "tags": ["显卡", "评',  # 断在字符串和数组中间
+        '{"summary": "讲了显卡", "score": 80,',  # 断在逗号后面
+    ],
+)
+def test_truncated_object(text):
+    result = parse_llm_json(text, _Answer)
+    assert result is not None
+    assert (result.summary, result.score) == ("讲了显卡", 80)
+
+
+def test_unescaped_quote_and_newline_in_string():
+    text = '{"summary": "up主说"这张卡很强"\n第二行", "score": 80}'
+    assert parse_llm_json(text, _Answer) == _Answer(summary='up主说"这张卡很强"\n第二行', score=80)
+
+
+@pytest.mark.parametrize("text", ["", "这个视频我没法总结", "{}", '{"summary": "讲了显卡"}', "[1, 2, 3]"])
+def test_unrepairable_returns_none(text):
+    assert parse_llm_json(text, _Answer) is None
+
+
+def test_stats_counted_once_per_parse():
+    REPAIR_STATS.clear()
+    parse_llm_json('{"summary": "讲了显卡", "score": 80}', _Answer)
+    parse_llm_json('{"summary": "讲了显卡", "score": 80,', _Answer)
+    parse_llm_json("没法总结", _Answer)
+    parse_llm_json('{"summary": "讲了显卡", "score": 80}', _Answer, record_stats=False)
+    assert REPAIR_STATS == {"direct": 1, "repaired": 1, "failed": 1}
+
+
+def test_repair_json_leaves_valid_json_alone():
+    text = '{"summary": "a, b", "tags": ["x"]}'
+    assert repair_json(text) == text
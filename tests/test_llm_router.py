@@ -0,0 +1,166 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import openai
+
+from src.core.routers.llm_router import LLMRouter
+from src.llm.gpt import Openai
+from src.llm.llm_base import LLMBase
+from src.llm.templates import Templates
+from src.models.config import HedgeSettings, LLMSettings
+from src.models.task import LLMUsage
+from src.utils.rate_limiter import ProviderLimiter
+
+
+class _FakeLLM(LLMBase):
+    """按设定的耗时返回设定的结果，记下自己被调用、被取消的情况"""
+
+    def __init__(self, name: str, delay: float, answer: str | None):
+        super().__init__(config=None)
+        self.alias = name
+        self.delay = delay
+        self.answer = answer
+        self.calls = 0
+        self.cancelled = False
+
+    async def completion(self, prompt, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return None if self.answer is None else (self.answer, 100)
+
+
+def _router(*llms: _FakeLLM, tiers: list[int] = None, hedge_delay: float = 0.05) -> LLMRouter:
+    hedge = HedgeSettings(enable=True, min_delay=hedge_delay, max_delay=hedge_delay, default_delay=hedge_delay)
+    router = LLMRouter(SimpleNamespace(llm_settings=LLMSettings(hedge=hedge)))
+    for priority, llm in enumerate(llms):
+        router.llm_dict[llm.alias] = {
+            "priority": len(llms) - priority,  # 排在前面的优先级高
+            "enabled": True,
+            "prepared": True,
+            "err_times": 0,
+            "tier": tiers[priority] if tiers else 0,
+            "obj": llm,
+        }
+    return router
+
+
+def _valid(text: str) -> bool:
+    return text.startswith("ok")
+
+
+def test_fast_primary_never_hedges():
+    primary, backup = _FakeLLM("primary", 0.01, "ok-primary"), _FakeLLM("backup", 0.01, "ok-backup")
+    result = asyncio.run(_router(primary, backup).hedged_completion(Templates.SUMMARIZE_USER, validator=_valid))
+    assert result == ("ok-primary", 100)
+    assert backup.calls == 0
+
+
+def test_slow_primary_is_hedged_and_loser_cancelled():
+    primary, backup = _FakeLLM("primary", 1, "ok-primary"), _FakeLLM("backup", 0.01, "ok-backup")
+    primary.limiter = ProviderLimiter("primary", max_concurrency=1)
+    router = _router(primary, backup)
+
+    async def run():
+        start = time.perf_counter()
+        result = await router.hedged_completion(Templates.SUMMARIZE_USER, validator=_valid)
+        # 在事件循环结束前检查：返回时输掉的请求已经真正结束，并发名额已经还回去
+        assert primary.cancelled
+        assert not primary.limiter.semaphore.locked()
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(run())
+    assert result == ("ok-backup", 100)
+    assert 0.05 <= elapsed < 0.5  # 等了对冲间隔才发备用请求，但没有等主LLM跑完
+    assert router._hedge_used == 1
+
+
+def test_invalid_winner_waits_for_valid_result():
+    primary, backup = _FakeLLM("primary", 0.2, "ok-primary"), _FakeLLM("backup", 0.01, "格式不对")
+    result = asyncio.run(_router(primary, backup).hedged_completion(Templates.SUMMARIZE_USER, validator=_valid))
+    assert result == ("ok-primary", 100)
+
+
+def test_failed_primary_switches_to_backup_immediately():
+    primary, backup = _FakeLLM("primary", 0.01, None), _FakeLLM("backup", 0.01, "ok-backup")
+    router = _router(primary, backup, hedge_delay=10)
+    assert asyncio.run(router.hedged_completion(Templates.SUMMARIZE_USER)) == ("ok-backup", 100)
+    assert router.llm_dict["primary"]["err_times"] == 1
+    assert router._hedge_used == 0  # 出错换人不算对冲
+
+
+def test_hedge_budget_exhausted_keeps_waiting():
+    primary, backup = _FakeLLM("primary", 0.1, "ok-primary"), _FakeLLM("backup", 0.01, "ok-backup")
+    router = _router(primary, backup)
+    router.config.llm_settings.hedge.daily_budget = 0
+    assert asyncio.run(router.hedged_completion(Templates.SUMMARIZE_USER)) == ("ok-primary", 100)
+    assert backup.calls == 0
+
+
+def test_cascade_accepts_cheap_tier():
+    cheap, strong = _FakeLLM("cheap", 0, "ok-cheap"), _FakeLLM("strong", 0, "ok-strong")
+    usage: list[LLMUsage] = []
+    router = _router(strong, cheap, tiers=[1, 0])
+    result = asyncio.run(router.cascade_completion(Templates.SUMMARIZE_USER, validator=_valid, usage=usage))
+    assert result == ("ok-cheap", 100)
+    assert strong.calls == 0
+    assert [(item.llm, item.outcome) for item in usage] == [("cheap", "accepted")]
+
+
+def test_cascade_escalates_on_invalid_or_low_score():
+    for cheap_answer, accept, outcome in [
+        ("格式不对", None, "invalid"),
+        ("ok-60", lambda text: text != "ok-60", "low_score"),
+    ]:
+        cheap, strong = _FakeLLM("cheap", 0, cheap_answer), _FakeLLM("strong", 0, "ok-strong")
+        usage: list[LLMUsage] = []
+        router = _router(strong, cheap, tiers=[1, 0])
+        result = asyncio.run(
+            router.cascade_completion(Templates.SUMMARIZE_USER, validator=_valid, accept=accept, usage=usage)
+        )
+        assert result == ("ok-strong", 100)
+        assert [(item.llm, item.outcome) for item in usage] == [("cheap", outcome), ("strong", "accepted")]
+
+
+def test_cascade_falls_back_to_valid_low_score_result():
+    cheap, strong = _FakeLLM("cheap", 0, "ok-cheap"), _FakeLLM("strong", 0, "格式不对")
+    router = _router(strong, cheap, tiers=[1, 0])
+    result = asyncio.run(
+        router.cascade_completion(Templates.SUMMARIZE_USER, validator=_valid, accept=lambda text: False)
+    )
+    assert result == ("ok-cheap", 100)  # 强的一档不合法，退回到合法但评分低的结果
+
+
+def test_cascade_skip_cheap():
+    cheap, strong = _FakeLLM("cheap", 0, "ok-cheap"), _FakeLLM("strong", 0, "ok-strong")
+    router = _router(strong, cheap, tiers=[1, 0])
+    assert asyncio.run(router.cascade_completion(Templates.SUMMARIZE_USER, skip_cheap=True)) == ("ok-strong", 100)
+    assert cheap.calls == 0
+
+
+def test_openai_completion_is_cancellable(monkeypatch):
+    cancelled = []
+
+    async def acreate(**kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    llm = Openai(SimpleNamespace(LLMs=SimpleNamespace(openai=SimpleNamespace(model="gpt-3.5-turbo"))))
+    llm.openai = openai
+
+    async def run():
+        task = asyncio.create_task(llm.completion([{"role": "user", "content": "你好"}]))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert cancelled == [True]  # 请求跟着取消，不会留在线程池里接着跑
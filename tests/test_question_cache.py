@@ -0,0 +1,35 @@
+from src.utils.question_cache import QuestionCache, minhash, normalize_question, similarity
+
+
+def _cache_with(question: str) -> QuestionCache:
+    cache = QuestionCache(threshold=0.75, max_videos=10, max_questions_per_video=10)
+    cache.add("BV1", question, {"answer": question})
+    return cache
+
+
+def test_rephrased_question_hits():
+    cache = _cache_with("这个视频讲了什么")
+    assert cache.lookup("BV1", "请问视频讲的是啥呢") == {"answer": "这个视频讲了什么"}
+
+
+def _similarity(a: str, b: str) -> float:
+    return similarity(minhash(normalize_question(a)), minhash(normalize_question(b)))
+
+
+def test_negated_question_misses():
+    cached = "视频里up主最后在对比了三款手机之后选择购买的是哪一款手机"
+    asked = "视频里up主最后在对比了三款手机之后没有选择购买的是哪一款手机"
+    assert _similarity(cached, asked) >= 0.75  # 字面上足够像，靠逐字比对拦下来
+    assert _cache_with(cached).lookup("BV1", asked) is None
+
+
+def test_different_entity_misses():
+    cached = "up主在视频中评测苹果手机的续航和拍照表现时给出的结论是什么"
+    asked = "up主在视频中评测华为手机的续航和拍照表现时给出的结论是什么"
+    assert _similarity(cached, asked) >= 0.75
+    assert _cache_with(cached).lookup("BV1", asked) is None
+
+
+def test_different_number_misses():
+    cache = _cache_with("视频第37分钟的时候up主说的那个显卡型号是什么")
+    assert cache.lookup("BV1", "视频第38分钟的时候up主说的那个显卡型号是什么") is None
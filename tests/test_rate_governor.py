@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+from bilibili_api.exceptions import ResponseCodeException
+
+from src.bilibili.rate_governor import GLOBAL_COOLDOWN, RateGovernor
+
+
+def test_call_success_raises_rate():
+    governor = RateGovernor()
+    before = governor.current_rpm("video_info")
+
+    async def get_info():
+        return {"title": "标题"}
+
+    assert asyncio.run(governor.call("video_info", get_info())) == {"title": "标题"}
+    assert governor.current_rpm("video_info") > before
+
+
+def test_risk_on_worker_read_pauses_every_endpoint():
+    governor = RateGovernor()
+
+    async def get_info():
+        raise ResponseCodeException(-412, "请求被拦截")
+
+    with pytest.raises(ResponseCodeException):
+        asyncio.run(governor.call("video_info", get_info()))
+    assert governor._global_until >= time.monotonic() + GLOBAL_COOLDOWN - 1
+    assert governor.current_rpm("video_info") < 60  # 自己的速率减半
+
+
+def test_cancelled_while_queued_never_sends(monkeypatch):
+    governor = RateGovernor()
+    governor.risk("player_info", "测试")  # 进入冷却，下一次要排队
+    sent = []
+
+    async def get_player_info():
+        sent.append(True)
+
+    async def run():
+        task = asyncio.create_task(governor.call("player_info", get_player_info()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert sent == []
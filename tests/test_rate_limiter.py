@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import pytest
+
+from src.utils import rate_limiter
+from src.utils.rate_limiter import ProviderLimiter
+
+
+class _Clock:
+    """假时钟：sleep不真的等，只把时间往前拨，记下每次等了多久
+    只替换限流器模块里的time和asyncio，事件循环自己用的还是真的时钟
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+        await asyncio.sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(time, name, None) or getattr(asyncio, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(rate_limiter, "asyncio", clock)
+    return clock
+
+
+async def _request(limiter: ProviderLimiter, tokens: int = 0):
+    async with limiter.limit(tokens):
+        pass
+
+
+def test_rpm_burst_then_refill(clock):
+    limiter = ProviderLimiter("test", rpm=60)  # 每秒1个，桶容量6
+
+    async def run():
+        for _ in range(6):
+            await _request(limiter)
+        assert clock.sleeps == []  # 桶里攒着的额度直接用
+        await _request(limiter)
+        assert clock.sleeps == [1.0]  # 额度用完，等补充一个
+        clock.now += 3  # 空闲3秒补回3个
+        for _ in range(3):
+            await _request(limiter)
+        assert clock.sleeps == [1.0]
+
+    asyncio.run(run())
+
+
+def test_tpm_exhausted_blocks(clock):
+    limiter = ProviderLimiter("test", tpm=6000)  # 每秒100个token，桶容量600
+
+    async def run():
+        await _request(limiter, 600)
+        assert clock.sleeps == []
+        await _request(limiter, 300)
+        assert clock.sleeps == [3.0]
+
+    asyncio.run(run())
+
+
+def test_request_larger_than_bucket_overdraws(clock):
+    limiter = ProviderLimiter("test", tpm=6000)
+
+    async def run():
+        await _request(limiter, 1000)  # 超过桶容量，桶满就放行，透支400
+        assert clock.sleeps == []
+        await _request(limiter, 100)
+        assert clock.sleeps == [5.0]  # 先补上透支的400，再攒够100
+
+    asyncio.run(run())
+
+
+def test_settle_refunds_overestimate(clock):
+    limiter = ProviderLimiter("test", tpm=6000)
+
+    async def run():
+        await _request(limiter, 600)
+        limiter.settle(estimated_tokens=600, actual_tokens=100)
+        await _request(limiter, 500)
+        assert clock.sleeps == []
+
+    asyncio.run(run())
+
+
+def test_semaphore_caps_concurrency(clock):
+    limiter = ProviderLimiter("test", max_concurrency=2)
+    running = []
+    peak = []
+
+    async def request():
+        async with limiter.limit():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*[request() for _ in range(5)])
+
+    asyncio.run(run())
+    assert max(peak) == 2
+
+
+def test_zero_means_unlimited(clock):
+    limiter = ProviderLimiter("test")
+
+    async def run():
+        for _ in range(100):
+            await _request(limiter, 10_000)
+
+    asyncio.run(run())
+    assert clock.sleeps == []
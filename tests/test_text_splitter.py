@@ -0,0 +1,52 @@
+import pytest
+
+from src.utils.text_splitter import split_text
+
+SUMMARY = (
+    "这个视频评测了三款显卡。首先是外观，三款都采用了三风扇设计；其次是性能，4090遥遥领先！"
+    "The RTX 4090 is about 1.5x faster than the 3090. Power draw is higher, though! "
+    "最后作者的结论是：预算充足就买4090，否则3080也够用了……你觉得呢？"
+)
+
+
+@pytest.mark.parametrize("limit", [20, 37, 50, 100])
+def test_every_chunk_within_limit(limit):
+    chunks = split_text(SUMMARY, limit)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= limit for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") == SUMMARY.replace(" ", "")  # 没有丢字
+
+
+def test_short_text_untouched():
+    assert split_text("  很短的回复。 ", 100) == ["很短的回复。"]
+
+
+def test_splits_on_sentence_boundaries():
+    chunks = split_text(SUMMARY, 60)
+    assert all(chunk[-1] in "。！？!?….；;，," for chunk in chunks)
+
+
+def test_single_sentence_over_limit_splits_on_clauses():
+    sentence = "首先是外观，三款都采用了三风扇设计，其次是性能，4090遥遥领先，最后是价格，差距非常大。"
+    chunks = split_text(sentence, 20)
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert all(chunk[-1] in "，。" for chunk in chunks)
+    assert "".join(chunks) == sentence
+
+
+def test_single_sentence_without_punctuation_is_hard_cut():
+    sentence = "一" * 45
+    assert split_text(sentence, 20) == ["一" * 20, "一" * 20, "一" * 5]
+
+
+def test_english_period_needs_following_space():
+    chunks = split_text("Version 1.5 is out. See https://example.com/a.b for details. 下一句话在这里。", 30)
+    assert chunks[0] == "Version 1.5 is out."
+    assert any("https://example.com/a.b" in chunk for chunk in chunks)
+
+
+def test_numbered_chunks_stay_within_limit():
+    chunks = split_text(SUMMARY, 40, numbered=True)
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert chunks[0].endswith(f"（1/{len(chunks)}）")
+    assert chunks[-1].endswith(f"（{len(chunks)}/{len(chunks)}）")
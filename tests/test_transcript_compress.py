@@ -0,0 +1,12 @@
+from src.utils.transcript_compress import compress_transcript
+
+
+def test_numbers_are_kept():
+    text, _ = compress_transcript(["这台电脑卖10000元", "预算100000"])
+    assert "10000元" in text
+    assert "100000" in text
+
+
+def test_repeated_chars_are_shortened():
+    text, _ = compress_transcript(["笑死我了哈哈哈哈哈哈哈哈"])
+    assert text == "笑死我了哈哈哈"
@@ -0,0 +1,40 @@
+import pytest
+
+from src.utils.transcript_index import TranscriptIndex, strip_question
+
+# 十段内容各不相同的字幕，每段一行
+TOPICS = [
+    "大家好欢迎来到本期视频今天我们来聊聊显卡",
+    "首先看外观这张显卡采用了三风扇设计",
+    "接下来讲了一下散热表现满载温度七十度",
+    "然后是游戏性能四千分辨率下帧数很稳定",
+    "这一段讲了功耗整机满载大概六百瓦",
+    "再来看看价格首发价一万两千多",
+    "和上一代对比性能提升了百分之六十",
+    "驱动方面这次更新修复了不少问题",
+    "光线追踪的表现也比以前好了很多",
+    "最后总结一下预算充足的话值得入手",
+]
+SUBTITLE = "\n".join(TOPICS)
+
+
+def _retrieve(question: str, top_k: int = 3) -> list[str]:
+    index = TranscriptIndex(chunk_size=25, chunk_overlap=0, max_videos=10)
+    return index.retrieve("BV1", SUBTITLE, question, top_k)
+
+
+@pytest.mark.parametrize("question", ["讲了什么", "这个视频主要讲了什么", "总结一下", "视频里说的是啥"])
+def test_generic_question_spreads_over_whole_transcript(question):
+    assert _retrieve(question) == [TOPICS[0], TOPICS[4], TOPICS[9]]
+
+
+def test_specific_question_hits_relevant_chunk():
+    assert _retrieve("这个视频里整机功耗是多少") == [TOPICS[4]]
+
+
+def test_hits_keep_transcript_order():
+    assert _retrieve("显卡的功耗怎么样") == [TOPICS[0], TOPICS[1], TOPICS[4]]
+
+
+def test_stop_phrases_do_not_join_into_new_bigrams():
+    assert strip_question("up主对4090怎么评价").split() == ["对4090", "评价"]
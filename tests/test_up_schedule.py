@@ -0,0 +1,73 @@
+from src.listener.up_schedule import HISTORY_SIZE, UpSchedule, merge_pubtimes
+
+DAY = 86400
+NOW = 1_700_000_000.0
+
+
+def _schedule(**kwargs) -> UpSchedule:
+    options = {"default_interval": 3600, "min_interval": 600, "max_interval": 2 * DAY, "budget_per_hour": 60}
+    options.update(kwargs)
+    return UpSchedule(tick=60, **options)
+
+
+def _daily(count: int, last: float) -> list[int]:
+    """每天投一次稿，最后一次在last"""
+    return [int(last - DAY * i) for i in range(count)]
+
+
+def test_few_uploads_use_default_interval():
+    assert _schedule().interval_for([], NOW) == 3600
+    assert _schedule().interval_for([int(NOW)], NOW) == 3600
+
+
+def test_active_up_checked_several_times_per_gap():
+    assert _schedule().interval_for(_daily(5, NOW - 3600), NOW) == DAY / 4
+
+
+def test_backoff_when_idle_and_shrink_after_new_upload():
+    schedule = _schedule()
+    pubtimes = _daily(5, NOW - 4 * DAY)  # 平时每天更新，已经四天没动静
+    idle = schedule.interval_for(pubtimes, NOW)
+    assert idle == DAY / 2  # 进入休眠期，间隔翻倍
+    pubtimes = merge_pubtimes(pubtimes, [int(NOW - 600)])  # 又投稿了
+    assert schedule.interval_for(pubtimes, NOW) < idle
+
+
+def test_interval_clamped_to_min_and_max():
+    schedule = _schedule()
+    frequent = [int(NOW - 60 * i) for i in range(5)]  # 每分钟一个
+    assert schedule.interval_for(frequent, NOW) == 600
+    yearly = [int(NOW - 365 * DAY * i) for i in range(3)]
+    assert schedule.interval_for(yearly, NOW) == 2 * DAY
+
+
+def test_persisted_schedule_is_reloaded():
+    schedule = _schedule()
+    schedule.record(42, _daily(5, NOW - 3600), now=NOW)
+    saved = {"42": {"pubtimes": _daily(5, NOW - 3600), **schedule.state(42)}}
+    assert DAY / 4 * 0.9 <= saved["42"]["next_check"] - NOW <= DAY / 4 * 1.1
+
+    restarted = _schedule()
+    restarted.restore(saved)
+    assert restarted.state(42) == schedule.state(42)
+    assert restarted.due([{"uid": 42}], now=NOW + 3600) == []  # 没到时间，不会退回默认间隔马上检查
+    assert restarted.due([{"uid": 42}], now=saved["42"]["next_check"]) == [{"uid": 42}]
+
+
+def test_due_respects_budget_and_prefers_most_overdue():
+    schedule = _schedule(budget_per_hour=120)  # 每轮（60秒）最多2个
+    uids = [{"uid": uid} for uid in range(5)]
+    schedule.restore({str(uid): {"next_check": NOW - uid * 100, "interval": 3600} for uid in range(5)})
+    assert schedule.due(uids, now=NOW) == [{"uid": 4}, {"uid": 3}]
+
+
+def test_retry_later_waits_one_tick():
+    schedule = _schedule()
+    schedule.retry_later(7, now=NOW)
+    assert schedule.due([{"uid": 7}], now=NOW + 59) == []
+    assert schedule.due([{"uid": 7}], now=NOW + 60) == [{"uid": 7}]
+
+
+def test_merge_pubtimes_dedupes_and_keeps_recent():
+    merged = merge_pubtimes(list(range(HISTORY_SIZE)), [HISTORY_SIZE - 1, HISTORY_SIZE, HISTORY_SIZE + 1])
+    assert merged == list(range(2, HISTORY_SIZE + 2))